@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Measure the AES CBC decryption and CTR throughput of the available
+# backends (the pure python one and, if installed, pycryptodome and
+# cryptography) and of the original int list based implementation.
+#
+# Usage: devscripts/bench_aes.py [MEGABYTES]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import aes
+from youtube_dl.utils import bytes_to_intlist, intlist_to_bytes
+
+
+def reference_cbc_decrypt(data, key, iv):
+    expanded_key = aes.key_expansion(bytes_to_intlist(key))
+    data = bytes_to_intlist(data)
+    decrypted = []
+    previous = bytes_to_intlist(iv)
+    for i in range(0, len(data), aes.BLOCK_SIZE_BYTES):
+        block = data[i:i + aes.BLOCK_SIZE_BYTES]
+        decrypted += aes.xor(aes.aes_decrypt(block, expanded_key), previous)
+        previous = block
+    return intlist_to_bytes(decrypted)
+
+
+def backends():
+    yield 'python', aes._ecb_encrypt_python, aes._cbc_decrypt_python
+    try:
+        try:
+            from Cryptodome.Cipher import AES  # noqa: F401
+        except ImportError:
+            from Crypto.Cipher import AES  # noqa: F401
+        aes._Cryptodome_AES = AES
+        yield 'pycryptodome', aes._ecb_encrypt_cryptodome, aes._cbc_decrypt_cryptodome
+    except ImportError:
+        pass
+    try:
+        from cryptography.hazmat.primitives import ciphers
+        from cryptography.hazmat.backends import default_backend
+        aes._cryptography_ciphers = ciphers
+        aes._cryptography_default_backend = default_backend
+        yield 'cryptography', aes._ecb_encrypt_cryptography, aes._cbc_decrypt_cryptography
+    except ImportError:
+        pass
+
+
+def throughput(func, data, *args):
+    start = time.time()
+    result = func(data, *args)
+    return result, len(data) / 1024.0 / 1024 / max(time.time() - start, 1e-9)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 1024 * 1024
+    size -= size % aes.BLOCK_SIZE_BYTES
+    data = os.urandom(size)
+    key, iv = os.urandom(16), os.urandom(16)
+    print('Selected backend: %s' % aes.AES_BACKEND)
+
+    # The original implementation is too slow for the whole input
+    sample = data[:64 * 1024]
+    expected, speed = throughput(reference_cbc_decrypt, sample, key, iv)
+    print('%-14s CBC %8.2f MiB/s' % ('int list', speed))
+
+    for name, ecb_encrypt, cbc_decrypt in backends():
+        decrypted, cbc_speed = throughput(cbc_decrypt, data, key, iv)
+        assert decrypted[:len(sample)] == expected, name
+        _, ecb_speed = throughput(ecb_encrypt, data, key)
+        print('%-14s CBC %8.2f MiB/s, CTR keystream %8.2f MiB/s' % (
+            name, cbc_speed, ecb_speed))
+
+
+if __name__ == '__main__':
+    main()
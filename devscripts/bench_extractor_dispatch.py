@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Compare the linear suitable() scan over all extractors with the host
+# based dispatch index used by YoutubeDL for the test URLs of all
+# extractors (the same inputs as test/test_all_urls.py).
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import YoutubeDL
+from youtube_dl.extractor import gen_extractors
+from test.helper import gettestcases
+
+
+def main():
+    urls = [tc['url'] for tc in gettestcases(include_onlymatching=True)]
+    ydl = YoutubeDL({'quiet': True})
+    ies = ydl._ies
+
+    def linear(url):
+        return [ie for ie in ies if ie.suitable(url)][0]
+
+    def indexed(url):
+        return [ie for ie in ydl._ies_for_url(url) if ie.suitable(url)][0]
+
+    gen_extractors()
+    for url in urls:
+        indexed(url)
+    mismatches = [url for url in urls if linear(url) is not indexed(url)]
+    if mismatches:
+        print('Dispatch mismatch for: %s' % ', '.join(mismatches))
+        sys.exit(1)
+
+    index = ydl._ies_index
+    print('%d URLs, %d extractors, %d indexed hosts, %d unindexed extractors' % (
+        len(urls), len(ies), len(index['hosts']), len(index['unindexed'])))
+    for name, func in (('linear', linear), ('indexed', indexed)):
+        best = min(timeit.repeat(
+            lambda: [func(url) for url in urls], number=1, repeat=3))
+        print('%-8s %8.3fs total, %8.1fus per URL' % (
+            name, best, best * 1e6 / len(urls)))
+
+
+if __name__ == '__main__':
+    main()
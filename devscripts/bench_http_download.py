@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Measure the CPU time HttpFD needs per GB downloaded from a local HTTP
+# server (running in another process, so that its own CPU time is not
+# counted), with the read() based loop and with the readinto() one.
+#
+# Usage: devscripts/bench_http_download.py [MEGABYTES]
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import YoutubeDL
+from youtube_dl.compat import compat_http_server
+from youtube_dl.downloader.http import HttpFD
+
+
+BLOCK = b'\0' * (1024 * 1024)
+
+
+class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        size = int(self.path[1:])
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', size)
+        self.end_headers()
+        while size > 0:
+            self.wfile.write(BLOCK[:size])
+            size -= len(BLOCK)
+
+
+def serve(port_queue):
+    httpd = compat_http_server.HTTPServer(('127.0.0.1', 0), HTTPTestRequestHandler)
+    port_queue.put(httpd.socket.getsockname()[1])
+    httpd.serve_forever()
+
+
+class FakeLogger(object):
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        print(msg)
+
+
+class NoReadintoResponse(object):
+    """Hide readinto() so that HttpFD falls back to read()"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def __getattr__(self, name):
+        if name == 'readinto':
+            raise AttributeError(name)
+        return getattr(self._response, name)
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def bench(url, filename, use_readinto):
+    params = {'logger': FakeLogger(), 'noprogress': True}
+    ydl = YoutubeDL(params)
+    if not use_readinto:
+        urlopen = ydl.urlopen
+        ydl.urlopen = lambda req: NoReadintoResponse(urlopen(req))
+    downloader = HttpFD(ydl, params)
+    reports = []
+    downloader.add_progress_hook(reports.append)
+    start, start_cpu = time.time(), cpu_time()
+    assert downloader.real_download(filename, {'url': url})
+    elapsed, cpu = time.time() - start, cpu_time() - start_cpu
+    os.remove(filename)
+    return elapsed, cpu, len(reports)
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 512 * 1024 * 1024
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue,))
+    server.daemon = True
+    server.start()
+    url = 'http://127.0.0.1:%d/%d' % (port_queue.get(), size)
+    filename = os.path.join(tempfile.gettempdir(), 'bench_http_download.mp4')
+
+    try:
+        for name, use_readinto in (('read', False), ('readinto', True)):
+            elapsed, cpu, reports = bench(url, filename, use_readinto)
+            print('%-9s %7.2fs wall, %7.2fs CPU, %7.2fs CPU per GB, %d progress reports' % (
+                name, elapsed, cpu, cpu * 1024 ** 3 / size, reports))
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Measure the time JSInterpreter.call_function takes on the first call of a
+# signature-like function (parsing its body and the ones of the object
+# methods it calls) and on the following calls, which reuse the parsed code.
+#
+# Usage: devscripts/bench_jsinterp.py [NUMBER_OF_CALLS]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl.jsinterp import JSInterpreter
+
+
+JS_CODE = '''
+var Xy={ab:function(a){a.reverse()},cd:function(a,b){a.splice(0,b)},
+    ef:function(a,b){var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c}};
+function f(a){a=a.split("");Xy.ab(a,3);Xy.ef(a,17);Xy.cd(a,2);Xy.ef(a,40);return a.join("")}
+'''
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    sig = ''.join(chr(ord('0') + i) for i in range(70))
+    jsi = JSInterpreter(JS_CODE)
+
+    start = time.time()
+    first = jsi.call_function('f', sig)
+    t_first = time.time() - start
+
+    start = time.time()
+    for _ in range(count):
+        assert jsi.call_function('f', sig) == first
+    t_calls = time.time() - start
+
+    print('first call           %8.1f us' % (t_first * 1e6))
+    print('next %d calls %8.1f us per call' % (count, t_calls / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Compare the time needed to get from the text of an HLS media playlist of
+# 20,000 AES-128 encrypted segments (a key rotation every 10 segments) to
+# the fragments hlsnative downloads, with the regex checks and two
+# line-by-line passes hlsnative used to do and with youtube_dl.m3u8.
+#
+# Usage: devscripts/bench_m3u8.py [NUMBER_OF_SEGMENTS]
+
+import binascii
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import YoutubeDL
+from youtube_dl.compat import compat_urlparse
+from youtube_dl.downloader.hls import HlsFD
+from youtube_dl.m3u8 import parse_m3u8_playlist
+from youtube_dl.utils import parse_m3u8_attributes
+
+
+URL = 'https://example.com/hls/video/index.m3u8?token=abcdef'
+
+
+def make_playlist(count):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(count):
+        if i % 10 == 0:
+            lines.append('#EXT-X-KEY:METHOD=AES-128,URI="keys/%d.key",IV=0x%032x' % (i // 10, i))
+        lines.extend(['#EXTINF:6.006,', 'segments/seg-%d.ts?token=abcdef' % i])
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def reference_fragments(s, man_url):
+    """The checks and the parsing hlsnative used to do"""
+    assert not re.search(r'#EXT-X-KEY:METHOD=(?!NONE|AES-128)', s)
+    assert not ('#EXT-X-KEY:METHOD=AES-128' in s and '#EXT-X-BYTERANGE' in s)
+    media_frags = 0
+    for line in s.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            media_frags += 1
+    fragments = []
+    media_sequence = 0
+    decrypt_info = {'METHOD': 'NONE'}
+    for line in s.splitlines():
+        line = line.strip()
+        if line:
+            if not line.startswith('#'):
+                frag_url = (
+                    line
+                    if re.match(r'^https?://', line)
+                    else compat_urlparse.urljoin(man_url, line))
+                fragments.append({
+                    'frag_index': len(fragments) + 1,
+                    'url': frag_url,
+                    'headers': None,
+                    'decrypt_info': decrypt_info,
+                    'media_sequence': media_sequence,
+                })
+                media_sequence += 1
+            elif line.startswith('#EXT-X-KEY'):
+                decrypt_info = parse_m3u8_attributes(line[11:])
+                if decrypt_info['METHOD'] == 'AES-128':
+                    if 'IV' in decrypt_info:
+                        decrypt_info['IV'] = binascii.unhexlify(decrypt_info['IV'][2:].zfill(32))
+                    if not re.match(r'^https?://', decrypt_info['URI']):
+                        decrypt_info['URI'] = compat_urlparse.urljoin(
+                            man_url, decrypt_info['URI'])
+            elif line.startswith('#EXT-X-MEDIA-SEQUENCE'):
+                media_sequence = int(line[22:])
+    assert media_frags == len(fragments)
+    return fragments
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    m3u8_doc = make_playlist(count)
+    fd = HlsFD(YoutubeDL({'quiet': True}), {})
+    info_dict = {'url': URL}
+
+    expected, t_reference = timed(reference_fragments, m3u8_doc, URL)
+    playlist, t_parse = timed(parse_m3u8_playlist, m3u8_doc, URL)
+    assert fd.can_download(playlist, info_dict)
+    fragments, t_build = timed(fd._build_fragments, playlist, info_dict)
+    assert fragments == expected
+
+    print('%d segments, %d KiB of playlist' % (count, len(m3u8_doc) // 1024))
+    print('line-by-line passes %8.1f ms' % (t_reference * 1000))
+    print('m3u8 parser         %8.1f ms (%.1f ms parsing, %.1f ms building the fragments)' % (
+        (t_parse + t_build) * 1000, t_parse * 1000, t_build * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Compare the time YoutubeDL.prepare_filename needs for the entries of a
+# large playlist with info dicts of the size extractors return, with the
+# generic template substitution (every field sanitized, the template
+# patched with regular expressions for each entry) and with the parsed
+# output template.
+#
+# Usage: devscripts/bench_outtmpl.py [NUMBER_OF_ENTRIES]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import YoutubeDL
+from youtube_dl.utils import sanitize_path
+
+
+OUTTMPL = '%(playlist)s/%(playlist_index)s - %(title)s [%(id)s].%(ext)s'
+
+
+def make_info(index):
+    info = {
+        'id': 'vid%08d' % index,
+        'title': 'Entry #%d: "a title" with / some | characters?' % index,
+        'ext': 'mp4',
+        'description': 'A long description. ' * 25,
+        'playlist': 'Some playlist',
+        'playlist_index': index,
+        'n_entries': 50000,
+        'width': 1920,
+        'height': 1080,
+        'tags': ['tag%d' % i for i in range(20)],
+        'formats': [{'format_id': '%d' % i, 'url': 'https://example.com/%d' % i} for i in range(30)],
+        'thumbnails': [{'url': 'https://example.com/%d.jpg' % i} for i in range(10)],
+    }
+    for i in range(100):
+        info['extra_field_%d' % i] = 'value %d' % i
+    return info
+
+
+def timed(func, infos):
+    start = time.time()
+    result = [func(info) for info in infos]
+    return result, time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    # A few distinct dicts are enough, what matters is their size
+    infos = [make_info(i + 1) for i in range(100)] * (count // 100)
+    ydl = YoutubeDL({'outtmpl': OUTTMPL, 'restrictfilenames': True}, auto_init=False)
+
+    expected, t_generic = timed(
+        lambda info: sanitize_path(ydl._evaluate_outtmpl(OUTTMPL, info)), infos)
+    filenames, t_parsed = timed(ydl.prepare_filename, infos)
+    assert filenames == expected
+
+    print('%d entries, %d fields per info dict' % (len(infos), len(infos[0])))
+    print('generic substitution %8.1f ms (%.1f us per entry)' % (
+        t_generic * 1000, t_generic * 1e6 / len(infos)))
+    print('parsed template      %8.1f ms (%.1f us per entry)' % (
+        t_parsed * 1000, t_parsed * 1e6 / len(infos)))
+
+
+if __name__ == '__main__':
+    main()
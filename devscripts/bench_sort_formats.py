@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Compare the time needed to sort lists of 500 formats (progressive HTTP,
+# HLS and video-only/audio-only DASH formats served from several CDNs, as
+# some extractors return) with the key function InfoExtractor._sort_formats
+# used to build and with utils.formats_sort_key.
+#
+# Usage: devscripts/bench_sort_formats.py [NUMBER_OF_SORTS]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl.utils import determine_protocol, formats_sort_key
+
+
+def reference_key(params):
+    """The key function of _sort_formats"""
+    def _formats_key(f):
+        from youtube_dl.utils import determine_ext
+        if not f.get('ext') and 'url' in f:
+            f['ext'] = determine_ext(f['url'])
+
+        preference = f.get('preference')
+        if preference is None:
+            preference = 0
+            if f.get('ext') in ['f4f', 'f4m']:  # Not yet supported
+                preference -= 0.5
+
+        protocol = f.get('protocol') or determine_protocol(f)
+        proto_preference = 0 if protocol in ['http', 'https'] else (-0.5 if protocol == 'rtsp' else -0.1)
+
+        if f.get('vcodec') == 'none':  # audio only
+            preference -= 50
+            if params.get('prefer_free_formats'):
+                ORDER = ['aac', 'mp3', 'm4a', 'webm', 'ogg', 'opus']
+            else:
+                ORDER = ['webm', 'opus', 'ogg', 'mp3', 'aac', 'm4a']
+            ext_preference = 0
+            try:
+                audio_ext_preference = ORDER.index(f['ext'])
+            except ValueError:
+                audio_ext_preference = -1
+        else:
+            if f.get('acodec') == 'none':  # video only
+                preference -= 40
+            if params.get('prefer_free_formats'):
+                ORDER = ['flv', 'mp4', 'webm']
+            else:
+                ORDER = ['webm', 'flv', 'mp4']
+            try:
+                ext_preference = ORDER.index(f['ext'])
+            except ValueError:
+                ext_preference = -1
+            audio_ext_preference = 0
+
+        return (
+            preference,
+            f.get('language_preference') if f.get('language_preference') is not None else -1,
+            f.get('quality') if f.get('quality') is not None else -1,
+            f.get('tbr') if f.get('tbr') is not None else -1,
+            f.get('filesize') if f.get('filesize') is not None else -1,
+            f.get('vbr') if f.get('vbr') is not None else -1,
+            f.get('height') if f.get('height') is not None else -1,
+            f.get('width') if f.get('width') is not None else -1,
+            proto_preference,
+            ext_preference,
+            f.get('abr') if f.get('abr') is not None else -1,
+            audio_ext_preference,
+            f.get('fps') if f.get('fps') is not None else -1,
+            f.get('filesize_approx') if f.get('filesize_approx') is not None else -1,
+            f.get('source_preference') if f.get('source_preference') is not None else -1,
+            f.get('format_id') if f.get('format_id') is not None else '',
+        )
+    return _formats_key
+
+
+def make_formats(count):
+    formats = []
+    heights = [144, 240, 360, 480, 720, 1080, 1440, 2160]
+    for i in range(count):
+        cdn = 'https://cdn%d.example.com/v/%d' % (i % 5, i)
+        kind = i % 4
+        height = random.choice(heights)
+        if kind == 0:
+            formats.append({
+                'format_id': 'http-%d' % i, 'url': cdn + '/video.mp4',
+                'height': height, 'width': height * 16 // 9, 'tbr': height * 3,
+            })
+        elif kind == 1:
+            formats.append({
+                'format_id': 'hls-%d' % i, 'url': cdn + '/index.m3u8', 'ext': 'mp4',
+                'protocol': 'm3u8_native', 'height': height, 'tbr': height * 3 + 1,
+                'fps': 30,
+            })
+        elif kind == 2:
+            formats.append({
+                'format_id': 'dash-video-%d' % i, 'url': cdn + '/video.webm',
+                'acodec': 'none', 'vcodec': 'vp9', 'height': height,
+                'width': height * 16 // 9, 'vbr': height * 2, 'fps': random.choice([30, 60]),
+                'filesize': random.randint(10 ** 6, 10 ** 9),
+            })
+        else:
+            formats.append({
+                'format_id': 'dash-audio-%d' % i, 'url': cdn + '/audio',
+                'ext': random.choice(['m4a', 'webm']), 'vcodec': 'none',
+                'abr': random.choice([48, 128, 160]), 'language_preference': random.choice([None, 10]),
+            })
+    return formats
+
+
+def timed(key_func, format_lists):
+    start = time.time()
+    result = []
+    for formats in format_lists:
+        formats = list(formats)
+        formats.sort(key=key_func)
+        result.append([f['format_id'] for f in formats])
+    return result, time.time() - start
+
+
+def main():
+    sorts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    random.seed(0)
+    format_lists = [make_formats(500) for _ in range(20)] * (sorts // 20)
+
+    for prefer_free_formats in (False, True):
+        params = {'prefer_free_formats': prefer_free_formats}
+        expected, t_reference = timed(reference_key(params), format_lists)
+        result, t_new = timed(formats_sort_key(prefer_free_formats), format_lists)
+        assert result == expected
+        print('prefer_free_formats=%-5s %d sorts of 500 formats: %7.1f ms -> %7.1f ms (%.1f us per format)' % (
+            prefer_free_formats, len(format_lists), t_reference * 1000, t_new * 1000,
+            t_new * 1e6 / (500 * len(format_lists))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+from __future__ import unicode_literals, print_function
+
+# Compare decrypting signatures with the JSInterpreter based signature
+# function and with its compiled permutation, using the JS players of
+# test/test_youtube_signature.py (downloaded to test/testdata if missing).
+#
+# Usage: devscripts/bench_youtube_signature.py [NUMBER_OF_SIGNATURES]
+
+import io
+import os
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from test.helper import FakeYDL
+from test.test_youtube_signature import _TESTS
+from youtube_dl.compat import compat_chr, compat_str, compat_urlretrieve
+from youtube_dl.extractor import YoutubeIE
+
+
+TESTDATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test', 'testdata')
+
+
+def timed(func, sigs):
+    start = time.time()
+    for sig in sigs:
+        func(sig)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    if not os.path.exists(TESTDATA_DIR):
+        os.mkdir(TESTDATA_DIR)
+
+    ie = YoutubeIE(FakeYDL())
+    total_interpreted = total_compiled = 0
+    for url, stype, sig_input, expected_sig in _TESTS:
+        if stype != 'js':
+            continue
+        player_type, player_id = YoutubeIE._extract_player_info(url)
+        fn = os.path.join(TESTDATA_DIR, 'player-%s.%s' % (player_id, stype))
+        if not os.path.exists(fn):
+            compat_urlretrieve(url, fn)
+        with io.open(fn, encoding='utf-8') as f:
+            jscode = f.read()
+
+        src_sig = (
+            compat_str(string.printable[:sig_input])
+            if isinstance(sig_input, int) else sig_input)
+        interpreted = ie._parse_sig_js(jscode)
+        test_string = ''.join(map(compat_chr, range(len(src_sig))))
+        compiled = ie._compile_signature_spec(
+            [ord(c) for c in interpreted(test_string)])
+        assert interpreted(src_sig) == compiled(src_sig) == expected_sig
+
+        sigs = [src_sig] * count
+        t_interpreted = timed(interpreted, sigs)
+        t_compiled = timed(compiled, sigs)
+        total_interpreted += t_interpreted
+        total_compiled += t_compiled
+        print('%-12s interpreted %8.3fs  compiled %8.3fs' % (
+            player_id, t_interpreted, t_compiled))
+
+    print('%d signatures per player: interpreted %.3fs, compiled %.3fs' % (
+        count, total_interpreted, total_compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,7 @@ from test.helper import FakeYDL, expect_dict, expect_value, http_server_port
 from youtube_dl.compat import compat_etree_fromstring, compat_http_server
 from youtube_dl.extractor.common import InfoExtractor
 from youtube_dl.extractor import YoutubeIE, get_info_extractor
-from youtube_dl.utils import encode_data_uri, strip_jsonp, ExtractorError, RegexNotFoundError
+from youtube_dl.utils import encode_data_uri, strip_jsonp, ExtractorError, LazyFragmentList, RegexNotFoundError
 import threading
 
 
@@ -971,6 +971,37 @@ jwplayer("mediaplayer").setup({"abouttext":"Visit Indie DB","aboutlink":"http:\/
                 self.ie._sort_formats(formats)
                 expect_value(self, formats, expected_formats, None)
 
+    def test_parse_mpd_segment_timeline(self):
+        mpd_doc = compat_etree_fromstring(b'''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT30S">
+  <Period>
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="10" startNumber="5"
+          initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Time$-$Number%03d$.m4s">
+        <SegmentTimeline>
+          <S t="100" d="20" r="2"/>
+          <S d="15"/>
+          <S t="200" d="30" r="1"/>
+        </SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="v1" bandwidth="1000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>''')
+        formats = self.ie._parse_mpd_formats(mpd_doc, mpd_base_url='http://example.com/')
+        self.assertEqual(len(formats), 1)
+        fragments = formats[0]['fragments']
+        self.assertTrue(isinstance(fragments, LazyFragmentList))
+        expected = [{'path': 'v1/init.mp4'}] + [
+            {'path': 'v1/%d-%03d.m4s' % (t, n), 'duration': d}
+            for t, n, d in ((100, 5, 2), (120, 6, 2), (140, 7, 2), (160, 8, 1.5), (200, 9, 3), (230, 10, 3))]
+        self.assertEqual(list(fragments), expected)
+        self.assertEqual(fragments, expected)
+        self.assertEqual(fragments[4], expected[4])
+        self.assertEqual(fragments[-1], expected[-1])
+        self.assertEqual(fragments[1:3], expected[1:3])
+        self.assertRaises(IndexError, lambda: fragments[len(expected)])
+
     def test_parse_f4m_formats(self):
         _TEST_CASES = [
             (
@@ -10,14 +10,27 @@ import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import copy
+import io
+import itertools
+import json
+import threading
+import time
 
-from test.helper import FakeYDL, assertRegexpMatches
+from test.helper import FakeYDL, assertRegexpMatches, try_rm
 from youtube_dl import YoutubeDL
 from youtube_dl.compat import compat_str, compat_urllib_error
 from youtube_dl.extractor import YoutubeIE
 from youtube_dl.extractor.common import InfoExtractor
+from youtube_dl.m3u8 import M3U8Playlist
 from youtube_dl.postprocessor.common import PostProcessor
-from youtube_dl.utils import ExtractorError, match_filter_func
+from youtube_dl.utils import (
+    DownloadError,
+    ExtractorError,
+    MaxDownloadsReached,
+    OnDemandPagedList,
+    PostProcessingError,
+    match_filter_func,
+)
 
 TEST_URL = 'http://localhost/sample.mp4'
 
@@ -532,6 +545,36 @@ class TestFormatSelection(unittest.TestCase):
             pass
         self.assertEqual(ydl.downloaded_info_dicts, [])
 
+    def test_format_selector_plan(self):
+        formats = [
+            {'format_id': 'A', 'ext': 'mp4', 'height': 360, 'acodec': 'none', 'url': TEST_URL},
+            {'format_id': 'B', 'ext': 'webm', 'height': 1080, 'acodec': 'none', 'url': TEST_URL},
+            {'format_id': 'C', 'ext': 'm4a', 'vcodec': 'none', 'url': TEST_URL},
+            {'format_id': 'D', 'ext': 'mp4', 'height': 720, 'url': TEST_URL},
+        ]
+        ctx = {'formats': formats, 'incomplete_formats': False}
+        ydl = YDL()
+        plan = ydl.build_format_selector('bestvideo[height<=480][ext=webm]+bestaudio/bestvideo[height<=480]+bestaudio/best')
+        selected, explanation = plan.explain(ctx)
+        self.assertEqual([f['format_id'] for f in selected], ['A+C'])
+        self.assertTrue("picked 'bestvideo[height<=480]+bestaudio' (alternative 2 of 3)" in explanation)
+        self.assertEqual(plan(ctx), selected)
+        # The selected formats are copies
+        selected[0]['requested_formats'][0]['height'] = 0
+        self.assertEqual(formats[0]['height'], 360)
+
+        selected, explanation = ydl.build_format_selector('bestvideo[height>1080]/bestaudio[ext=mp3]').explain(ctx)
+        self.assertEqual(selected, [])
+        self.assertTrue('no alternative matched' in explanation)
+
+        # The format spec is compiled once for all the videos
+        ydl = YDL({'format': 'best'})
+        ydl.process_ie_result(_make_result(formats))
+        plan = ydl._format_selectors['best']
+        ydl.process_ie_result(_make_result(formats))
+        self.assertTrue(ydl._format_selectors['best'] is plan)
+        self.assertEqual([info['format_id'] for info in ydl.downloaded_info_dicts], ['D', 'D'])
+
     def test_default_format_spec(self):
         ydl = YDL({'simulate': True})
         self.assertEqual(ydl._default_format_spec({}), 'bestvideo+bestaudio/best')
@@ -622,6 +665,23 @@ class TestYoutubeDL(unittest.TestCase):
         self.assertEqual(test_dict['extractor'], 'Foo')
         self.assertEqual(test_dict['playlist'], 'funny videos')
 
+    def test_m3u8_playlist_format(self):
+        m3u8_doc = '#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXTINF:2,\nseg0.ts\n#EXT-X-ENDLIST\n'
+        formats = InfoExtractor(YDL())._parse_m3u8_formats(
+            m3u8_doc, 'http://example.com/index.m3u8', 'mp4', 'm3u8_native')
+        self.assertEqual(len(formats), 1)
+        playlist = formats[0]['m3u8_playlist']
+        self.assertTrue(isinstance(playlist, M3U8Playlist))
+        self.assertEqual(playlist.segments[0].url, 'http://example.com/seg0.ts')
+
+        ydl = YDL({'format': 'best'})
+        info_dict = _make_result(formats)
+        ydl.process_ie_result(info_dict)
+        downloaded = ydl.downloaded_info_dicts[0]
+        self.assertTrue(downloaded['m3u8_playlist'] is playlist)
+        json.dumps(ydl.strip_unserializable_info(downloaded))
+        self.assertTrue('m3u8_playlist' in downloaded)
+
     def test_prepare_filename(self):
         info = {
             'id': '1234',
@@ -657,6 +717,38 @@ class TestYoutubeDL(unittest.TestCase):
         self.assertEqual(fname('Hello %(title1)s'), 'Hello $PATH')
         self.assertEqual(fname('Hello %(title2)s'), 'Hello %PATH%')
 
+    def test_prepare_filename_parsed_template(self):
+        # The parsed templates give the same filenames as the generic path
+        info = {
+            'id': 'a/b',
+            'title': 'Title: "1"?',
+            'ext': 'mp4',
+            'width': 640,
+            'height': None,
+            'playlist_index': 3,
+            'n_entries': 120,
+            'uploader_id': 'a|b',
+            'tags': ['tag'],
+            'duration': 3.5,
+        }
+        ydl = YoutubeDL({'autonumber_start': 7}, auto_init=False)
+        for outtmpl in (
+                '%(title)s-%(id)s.%(ext)s',
+                '%(playlist_index)s-%(autonumber)s-%(playlist_index)s',
+                '%(autonumber)s-%(playlist_index)s-%(autonumber)d',
+                '%(height)05d-%(width)05d-%(resolution)s-%(tags)s',
+                '%(uploader_id)s-%(uploader)s-%(duration).2f-%(view_count)x',
+                '%%%(height)s-100%%-%%(ext)s-$$HOME',
+                '%(title)r-%(tags(0))s'):
+            ydl.params['outtmpl'] = outtmpl
+            ydl.params['restrictfilenames'] = False
+            self.assertEqual(
+                ydl.prepare_filename(info), ydl._evaluate_outtmpl(outtmpl, info), outtmpl)
+            ydl.params['restrictfilenames'] = True
+            self.assertEqual(
+                ydl.prepare_filename(info), ydl._evaluate_outtmpl(outtmpl, info), outtmpl)
+        self.assertEqual(ydl._outtmpl_cache['%(title)r-%(tags(0))s'], False)
+
     def test_format_note(self):
         ydl = YoutubeDL()
         self.assertEqual(ydl._format_note({}), '')
@@ -872,6 +964,163 @@ class TestYoutubeDL(unittest.TestCase):
         self.assertEqual(result[1]['playlist_index'], 2)
         # @}
 
+    def test_parallel_entries(self):
+        entries = [{
+            'id': compat_str(i),
+            'title': compat_str(i),
+            'url': TEST_URL,
+        } for i in range(1, 11)]
+        playlist = {
+            '_type': 'playlist',
+            'id': 'test',
+            'entries': entries,
+            'extractor': 'test:playlist',
+            'extractor_key': 'test:playlist',
+            'webpage_url': 'http://example.com',
+        }
+
+        class Logger(object):
+            def __init__(self):
+                self.msgs = []
+
+            def debug(self, msg):
+                self.msgs.append(msg)
+
+            warning = error = debug
+
+        class SlowYDL(YoutubeDL):
+            def process_info(self, info_dict):
+                # Later entries finish first
+                time.sleep(0.01 * (10 - int(info_dict['id'])))
+                super(SlowYDL, self).process_info(info_dict)
+                self.to_screen('processed %s' % info_dict['id'])
+
+        def process(params):
+            logger = Logger()
+            params.update({
+                'logger': logger,
+                'simulate': True,
+                'parallel_entries': 4,
+            })
+            ydl = SlowYDL(params)
+            try:
+                res = ydl.process_ie_result(copy.deepcopy(playlist), download=True)
+            except MaxDownloadsReached:
+                res = None
+            return ydl, res, [
+                msg for msg in logger.msgs
+                if msg.startswith(('processed', '[download] Downloading video'))]
+
+        ydl, res, msgs = process({})
+        self.assertEqual([e['id'] for e in res['entries']], [e['id'] for e in entries])
+        expected_msgs = []
+        for i in range(1, 11):
+            expected_msgs.extend([
+                '[download] Downloading video %d of 10' % i, 'processed %d' % i])
+        self.assertEqual(msgs, expected_msgs)
+        self.assertEqual(ydl._num_downloads, 10)
+
+        ydl, res, msgs = process({'max_downloads': 5})
+        self.assertEqual(res, None)
+        self.assertEqual(ydl._num_downloads, 5)
+        self.assertEqual(len([msg for msg in msgs if msg.startswith('processed')]), 5)
+
+    def test_postprocessor_workers(self):
+        archive_file = 'test_postprocessor_workers.txt'
+        filenames = ['pp-workers-%d.mp4' % i for i in range(1, 4)]
+        entries = [{
+            'id': compat_str(i),
+            'title': compat_str(i),
+            'url': TEST_URL,
+            'ext': 'mp4',
+            'extractor': 'test',
+            'extractor_key': 'TestEx',
+        } for i in range(1, 4)]
+        second_started = threading.Event()
+        waited = []
+        post_processed = []
+
+        class BackgroundYDL(YoutubeDL):
+            def process_info(self, info_dict):
+                if info_dict['id'] == '2':
+                    second_started.set()
+                super(BackgroundYDL, self).process_info(info_dict)
+
+        class WaitingPP(PostProcessor):
+            def run(self, info):
+                if info['id'] == '1':
+                    # The next video is downloaded meanwhile
+                    second_started.wait(5)
+                    waited.append(second_started.is_set())
+                if info['id'] == 'error':
+                    raise PostProcessingError('failed')
+                post_processed.append((info['id'], threading.current_thread()))
+                return [], info
+
+        for fn in filenames:
+            with open(fn, 'wt') as f:
+                f.write('EXAMPLE')
+        try:
+            ydl = BackgroundYDL({
+                'outtmpl': 'pp-workers-%(id)s.%(ext)s',
+                'nooverwrites': True,
+                'download_archive': archive_file,
+                'postprocessor_workers': 2,
+                'quiet': True,
+            })
+            ydl.add_post_processor(WaitingPP())
+            for entry in entries:
+                ydl.process_ie_result(dict(entry), download=True)
+            ydl.wait_for_postprocessing()
+            self.assertEqual(waited, [True])
+            self.assertEqual(sorted(video_id for video_id, _ in post_processed), ['1', '2', '3'])
+            self.assertTrue(all(t is not threading.current_thread() for _, t in post_processed))
+            for entry in entries:
+                self.assertTrue(ydl.in_download_archive(entry))
+
+            # Errors are raised in the main thread and the video is not archived
+            with open('pp-workers-error.mp4', 'wt') as f:
+                f.write('EXAMPLE')
+            error_entry = dict(entries[0], id='error', title='error')
+            ydl.process_ie_result(dict(error_entry), download=True)
+            self.assertRaises(DownloadError, ydl.wait_for_postprocessing)
+            self.assertFalse(ydl.in_download_archive(error_entry))
+        finally:
+            for fn in filenames + ['pp-workers-error.mp4', archive_file]:
+                try_rm(fn)
+
+    def test_download_archive(self):
+        archive_file = 'test_download_archive.txt'
+        try_rm(archive_file)
+
+        def video(video_id):
+            return {'id': video_id, 'extractor_key': 'TestEx'}
+
+        try:
+            ydl = YDL({'download_archive': archive_file})
+            self.assertFalse(ydl.in_download_archive(video('a')))
+            ydl.record_download_archive(video('a'))
+            self.assertTrue(ydl.in_download_archive(video('a')))
+            self.assertFalse(ydl.in_download_archive(video('b')))
+
+            # Entries appended by another process sharing the archive
+            other_ydl = YDL({'download_archive': archive_file})
+            other_ydl.record_download_archive(video('b'))
+            with io.open(archive_file, 'a', encoding='utf-8') as f:
+                f.write('testex c\n')
+            self.assertTrue(ydl.in_download_archive(video('b')))
+            self.assertTrue(ydl.in_download_archive(video('c')))
+            self.assertTrue(other_ydl.in_download_archive(video('a')))
+            self.assertFalse(ydl.in_download_archive(video('d')))
+
+            # Rewritten archive
+            with io.open(archive_file, 'w', encoding='utf-8') as f:
+                f.write('testex d\n')
+            self.assertFalse(ydl.in_download_archive(video('a')))
+            self.assertTrue(ydl.in_download_archive(video('d')))
+        finally:
+            try_rm(archive_file)
+
     def test_urlopen_no_file_protocol(self):
         # see https://github.com/ytdl-org/youtube-dl/issues/8227
         ydl = YDL()
@@ -919,6 +1168,120 @@ class TestYoutubeDL(unittest.TestCase):
         self.assertEqual(downloaded['extractor'], 'testex')
         self.assertEqual(downloaded['extractor_key'], 'TestEx')
 
+    def test_match_filter_early(self):
+        class VideoIE(InfoExtractor):
+            _VALID_URL = r'video:(?P<id>\d+)'
+            extracted = []
+
+            def _real_extract(self, url):
+                video_id = self._match_id(url)
+                self.extracted.append(video_id)
+                return {
+                    'id': video_id,
+                    'title': 'Video %s' % video_id,
+                    'url': TEST_URL,
+                    'duration': int(video_id) * 10,
+                }
+
+        class PlaylistIE(InfoExtractor):
+            _VALID_URL = r'playlist:'
+
+            def _real_extract(self, url):
+                # Only the first entries tell their duration
+                return self.playlist_result([
+                    dict(self.url_result('video:%d' % n, VideoIE.ie_key()), duration=n * 10 if n < 3 else None)
+                    for n in range(1, 6)])
+
+        def run(params):
+            VideoIE.extracted = []
+            ydl = YDL(dict(params, match_filter=match_filter_func('duration > 15')))
+            ydl.add_info_extractor(VideoIE(ydl))
+            ydl.add_info_extractor(PlaylistIE(ydl))
+            ydl.extract_info('playlist:')
+            return VideoIE.extracted
+
+        self.assertEqual(run({}), ['1', '2', '3', '4', '5'])
+        # The first entry is known not to match without extracting it, the
+        # entries whose duration is unknown are still extracted
+        self.assertEqual(run({'match_filter_early': True}), ['2', '3', '4', '5'])
+
+    def test_playlist_archived_entries(self):
+        archive_file = 'test_playlist_archived_entries.txt'
+
+        class VideoIE(InfoExtractor):
+            _VALID_URL = r'video:(?P<id>\d+)'
+            extracted = []
+
+            def _real_extract(self, url):
+                video_id = self._match_id(url)
+                self.extracted.append(video_id)
+                return {
+                    'id': video_id,
+                    'title': 'Video %s' % video_id,
+                    'url': TEST_URL,
+                }
+
+        class PlaylistIE(InfoExtractor):
+            _VALID_URL = r'(?P<id>paged|generated):'
+            requested_pages = []
+
+            def _entries(self, pagenum):
+                self.requested_pages.append(pagenum)
+                # Flat entries without id nor ie_key
+                for n in range(pagenum * 2 + 1, min(pagenum * 2 + 2, 8) + 1):
+                    yield self.url_result('video:%d' % n)
+
+            def _generated_entries(self):
+                for pagenum in itertools.count():
+                    entries = list(self._entries(pagenum))
+                    if not entries:
+                        break
+                    for entry in entries:
+                        yield entry
+
+            def _real_extract(self, url):
+                if self._match_id(url) == 'paged':
+                    return self.playlist_result(OnDemandPagedList(self._entries, 2))
+                return self.playlist_result(self._generated_entries())
+
+        def run(url, params):
+            VideoIE.extracted = []
+            PlaylistIE.requested_pages = []
+            ydl = YDL(dict(params, download_archive=archive_file))
+            ydl.add_info_extractor(VideoIE(ydl))
+            ydl.add_info_extractor(PlaylistIE(ydl))
+            ydl.extract_info(url)
+            return VideoIE.extracted, PlaylistIE.requested_pages
+
+        try:
+            with io.open(archive_file, 'w', encoding='utf-8') as f:
+                f.write('video 2\nvideo 4\nvideo 5\nvideo 6\n')
+            for url in ('paged:', 'generated:'):
+                # The archive ids of the entries are derived from their URL
+                self.assertEqual(run(url, {}), (['1', '3', '7', '8'], [0, 1, 2, 3, 4]))
+                self.assertEqual(
+                    run(url, {'break_on_archived': 2}), (['1', '3'], [0, 1, 2]))
+                self.assertEqual(
+                    run(url, {'break_on_archived': 4}), (['1', '3', '7', '8'], [0, 1, 2, 3, 4]))
+        finally:
+            try_rm(archive_file)
+
+    def test_archive_id_from_url(self):
+        class OptionalIdIE(InfoExtractor):
+            _VALID_URL = r'optional:(?:(?P<id>\d+)|latest)'
+
+        class NoIdIE(InfoExtractor):
+            _VALID_URL = r'noid:\d+'
+
+        ydl = YDL()
+        ydl.add_info_extractor(OptionalIdIE(ydl))
+        ydl.add_info_extractor(NoIdIE(ydl))
+        self.assertEqual(ydl._make_archive_id({'url': 'optional:42'}), 'optionalid 42')
+        self.assertEqual(ydl._make_archive_id({'url': 'optional:latest'}), None)
+        self.assertEqual(ydl._make_archive_id({'url': 'noid:42'}), None)
+        self.assertEqual(
+            ydl._make_archive_id({'url': 'optional:latest', 'id': '42'}), 'optionalid 42')
+
     # Test case for https://github.com/ytdl-org/youtube-dl/issues/27064
     def test_ignoreerrors_for_playlist_with_url_transparent_iterable_entries(self):
 
@@ -8,7 +8,18 @@ import sys
 import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from youtube_dl.aes import aes_decrypt, aes_encrypt, aes_cbc_decrypt, aes_cbc_encrypt, aes_decrypt_text
+from youtube_dl.aes import (
+    _cbc_decrypt_python,
+    _ecb_encrypt_python,
+    aes_decrypt,
+    aes_encrypt,
+    aes_cbc_decrypt,
+    aes_cbc_decrypt_bytes,
+    aes_cbc_encrypt,
+    aes_ctr_decrypt_bytes,
+    aes_decrypt_text,
+    key_expansion,
+)
 from youtube_dl.utils import bytes_to_intlist, intlist_to_bytes
 import base64
 
@@ -58,6 +69,56 @@ class TestAES(unittest.TestCase):
         decrypted = (aes_decrypt_text(encrypted, password, 32))
         self.assertEqual(decrypted, self.secret_msg)
 
+    def test_cbc_decrypt_bytes(self):
+        data = b"\x97\x92+\xe5\x0b\xc3\x18\x91ky9m&\xb3\xb5@\xe6'\xc2\x96.\xc8u\x88\xab9-[\x9e|\xf1\xcd"
+        key = iv = intlist_to_bytes(self.key)
+        decrypted = aes_cbc_decrypt_bytes(data, key, iv)
+        self.assertEqual(decrypted, self.secret_msg + b'\x08' * 8)
+        self.assertEqual(aes_cbc_decrypt_bytes(memoryview(data), bytearray(key), iv), decrypted)
+        # An incomplete last block is filled with 0's
+        self.assertEqual(aes_cbc_decrypt_bytes(data[:20], key, iv)[:16], decrypted[:16])
+        self.assertEqual(len(aes_cbc_decrypt_bytes(data[:20], key, iv)), 20)
+
+    def test_ctr_decrypt_bytes(self):
+        class Counter(object):
+            value = 0
+
+            def next_value(self):
+                self.value += 1
+                return [0] * 15 + [self.value]
+
+        key = intlist_to_bytes(self.key)
+        data = b'\x00' * 40
+        keystream = aes_ctr_decrypt_bytes(data, key, Counter())
+        self.assertEqual(len(keystream), 40)
+        for i in range(3):
+            self.assertEqual(
+                keystream[i * 16:(i + 1) * 16],
+                intlist_to_bytes(aes_encrypt([0] * 15 + [i + 1], key_expansion(self.key)))[:40 - i * 16])
+        self.assertEqual(
+            aes_ctr_decrypt_bytes(aes_ctr_decrypt_bytes(self.secret_msg, key, Counter()), key, Counter()),
+            self.secret_msg)
+
+    def test_python_backend(self):
+        # Compare the T-table implementation with the reference one for all
+        # key sizes
+        data = bytes_to_intlist(self.secret_msg) * 3
+        data = data[:len(data) // 16 * 16]
+        for key_size in (16, 24, 32):
+            key = list(range(key_size))
+            expanded_key = key_expansion(key)
+            encrypted = []
+            for i in range(0, len(data), 16):
+                encrypted += aes_encrypt(data[i:i + 16], expanded_key)
+            self.assertEqual(
+                _ecb_encrypt_python(intlist_to_bytes(data), intlist_to_bytes(key)),
+                intlist_to_bytes(encrypted))
+
+            encrypted = intlist_to_bytes(aes_cbc_encrypt(data, key, self.iv))
+            self.assertEqual(
+                _cbc_decrypt_python(encrypted, intlist_to_bytes(key), intlist_to_bytes(self.iv)),
+                intlist_to_bytes(data))
+
 
 if __name__ == '__main__':
     unittest.main()
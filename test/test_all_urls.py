@@ -7,11 +7,15 @@ import os
 import sys
 import unittest
 import collections
+import re
+import threading
+import time
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
 from test.helper import gettestcases
 
+from youtube_dl import YoutubeDL
 from youtube_dl.extractor import (
     FacebookIE,
     gen_extractors,
@@ -95,6 +99,51 @@ class TestAllURLsMatching(unittest.TestCase):
                         ie.suitable(url),
                         '%s should not match URL %r . That URL belongs to %s.' % (type(ie).__name__, url, tc['name']))
 
+    def test_dispatch_index(self):
+        ydl = YoutubeDL({'quiet': True})
+        for ie in self.ies:
+            ydl.add_info_extractor(ie)
+        ydl._IES_INDEX_THRESHOLD = 0
+        urls = set()
+        for tc in gettestcases(include_onlymatching=True):
+            url = tc['url']
+            urls.update((
+                url, re.sub(r'^(https?://[^/?#]+)', lambda m: m.group(1).upper() + ':8080', url)))
+        for url in urls:
+            candidates = ydl._ies_for_url(url)
+            self.assertTrue(candidates[-1].IE_NAME == 'generic')
+            for ie in self.ies:
+                if ie.suitable(url):
+                    self.assertTrue(
+                        ie in candidates,
+                        '%s matches URL %r but is missing from the dispatch index' % (type(ie).__name__, url))
+
+    def test_dispatch_index_concurrent(self):
+        ydl = YoutubeDL({'quiet': True}, auto_init=False)
+        for ie in self.ies:
+            ydl.add_info_extractor(ie)
+        ydl._IES_INDEX_THRESHOLD = 0
+        url = 'https://www.youtube.com/watch?v=BaW_jenozKc'
+        results = []
+
+        def dispatch():
+            results.append([ie.IE_NAME for ie in ydl._ies_for_url(url) if ie.suitable(url)])
+
+        # Another worker dispatches a URL while the index is being built
+        add_to_ies_index = ydl._add_to_ies_index
+        worker = threading.Thread(target=dispatch)
+
+        def slow_add_to_ies_index(index, position, ie):
+            if position == 1:
+                worker.start()
+                time.sleep(0.1)
+            add_to_ies_index(index, position, ie)
+
+        ydl._add_to_ies_index = slow_add_to_ies_index
+        dispatch()
+        worker.join()
+        self.assertEqual(results, [['youtube', 'generic']] * 2)
+
     def test_keywords(self):
         self.assertMatch(':ytsubs', ['youtube:subscriptions'])
         self.assertMatch(':ytsubscriptions', ['youtube:subscriptions'])
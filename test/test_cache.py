@@ -4,6 +4,7 @@
 from __future__ import unicode_literals
 
 import shutil
+import time
 
 # Allow direct execution
 import os
@@ -54,6 +55,120 @@ class TestCache(unittest.TestCase):
         self.assertFalse(os.path.exists(self.test_dir))
         self.assertEqual(c.load('test_cache', 'k.'), None)
 
+    def test_memory_cache(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        c = Cache(ydl)
+        self.assertEqual(c.load('test_cache', 'k'), None)
+        c.store('test_cache', 'k', {'x': [1]})
+        obj = c.load('test_cache', 'k')
+        self.assertEqual(obj, {'x': [1]})
+        # Changes of the loaded object must not leak into the cache
+        obj['x'].append(2)
+        self.assertEqual(c.load('test_cache', 'k'), {'x': [1]})
+        self.assertEqual(c.stats['memory_hits'], 2)
+        self.assertEqual(c.stats['misses'], 1)
+
+        # A new instance has to read from disk first
+        c = Cache(ydl)
+        self.assertEqual(c.load('test_cache', 'k'), {'x': [1]})
+        self.assertEqual(c.load('test_cache', 'k'), {'x': [1]})
+        self.assertEqual(c.stats['disk_hits'], 1)
+        self.assertEqual(c.stats['memory_hits'], 1)
+
+    def test_ttl(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        c = Cache(ydl)
+        c._SECTION_TTL = {'test_ttl': 60}
+        c.store('test_ttl', 'k', 1)
+        c.store('test_cache', 'k', 2)
+        fn = c._get_cache_fn('test_ttl', 'k', 'json')
+        old = time.time() - 120
+        os.utime(fn, (old, old))
+        os.utime(c._get_cache_fn('test_cache', 'k', 'json'), (old, old))
+
+        c = Cache(ydl)
+        c._SECTION_TTL = {'test_ttl': 60}
+        self.assertEqual(c.load('test_ttl', 'k'), None)
+        self.assertFalse(os.path.exists(fn))
+        self.assertEqual(c.load('test_cache', 'k'), 2)
+
+    def test_size_limit(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+            'cache_max_size': 1000,
+        })
+        c = Cache(ydl)
+        for i in range(10):
+            c.store('test_cache', 'k%d' % i, 'x' * 200)
+            fn = c._get_cache_fn('test_cache', 'k%d' % i, 'json')
+            os.utime(fn, (i, i))
+        self.assertTrue(c.stats['evictions'] > 0)
+        cache_files = os.listdir(os.path.join(self.test_dir, 'test_cache'))
+        self.assertTrue(len(cache_files) <= 4)
+        # The most recent entries are kept
+        self.assertTrue('k9.json' in cache_files)
+
+    def test_size_limit_foreign_files(self):
+        def write(fn, mtime):
+            with open(fn, 'w') as f:
+                f.write('x' * 2000)
+            os.utime(fn, (mtime, mtime))
+
+        # Files the cache has not written are neither counted nor removed
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+            'cache_max_size': 1000,
+        })
+        _mkdir(self.test_dir)
+        _mkdir(os.path.join(self.test_dir, 'notes'))
+        foreign = [
+            os.path.join(self.test_dir, 'notes.json'),
+            os.path.join(self.test_dir, 'notes', 'todo.txt'),
+        ]
+        for fn in foreign:
+            write(fn, 0)
+        c = Cache(ydl)
+        c.store('test_cache', 'k', 'x')
+        self.assertEqual(c.stats['evictions'], 0)
+        for fn in foreign:
+            self.assertTrue(os.path.exists(fn))
+
+        # Nothing is removed from a directory not looking like a cache dir
+        other_dir = os.path.join(self.test_dir, 'other')
+        ydl = FakeYDL({
+            'cachedir': other_dir,
+            'cache_max_size': 1000,
+        })
+        c = Cache(ydl)
+        c._looks_like_cache_dir = lambda cachedir: 'cache' in os.path.basename(cachedir)
+        c.store('test_cache', 'k', 'x')
+        fn = c._get_cache_fn('test_cache', 'k0', 'json')
+        write(fn, 0)
+        c.store('test_cache', 'k1', 'x')
+        self.assertEqual(c.stats['evictions'], 0)
+        self.assertTrue(os.path.exists(fn))
+
+    def test_miss_expiry(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        other = Cache(ydl)
+        c = Cache(ydl)
+        self.assertEqual(c.load('test_cache', 'k'), None)
+        other.store('test_cache', 'k', 1)
+        self.assertEqual(c.load('test_cache', 'k'), None)
+
+        # Entries stored by others are seen once the miss has expired
+        c = Cache(ydl)
+        c._MISS_TTL = -1
+        self.assertEqual(c.load('test_cache', 'k2'), None)
+        other.store('test_cache', 'k2', 2)
+        self.assertEqual(c.load('test_cache', 'k2'), 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf-8
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base64
+import io
+import threading
+
+from test.helper import FakeYDL, http_server_port, try_rm
+from youtube_dl import YoutubeDL
+from youtube_dl.compat import compat_http_server, compat_struct_pack
+from youtube_dl.downloader.f4m import (
+    DataTruncatedError,
+    F4mFD,
+    FlvReader,
+    build_fragments_list,
+    count_fragments,
+    iter_fragments,
+    read_bootstrap_info,
+)
+from youtube_dl.utils import encodeFilename
+
+
+def box(box_type, payload):
+    return compat_struct_pack('!I', 8 + len(payload)) + box_type + payload
+
+
+def bootstrap(segment_runs, first_fragment, live=False):
+    asrt = b'\0' * 4 + b'\x01quality\0' + compat_struct_pack('!I', len(segment_runs)) + b''.join(
+        compat_struct_pack('!II', *run) for run in segment_runs)
+    afrt = b'\0' * 4 + compat_struct_pack('!I', 1000) + b'\0' + compat_struct_pack('!I', 2) + (
+        compat_struct_pack('!IQI', first_fragment, 0, 4000)
+        + compat_struct_pack('!IQIB', first_fragment + 1, 4000, 0, 1))
+    abst = (
+        b'\0' * 4 + compat_struct_pack('!I', 1) + (b'\x20' if live else b'\0')
+        + compat_struct_pack('!IQQ', 1000, 0, 0) + b'movie\0'
+        + b'\x01server\0' + b'\0' + b'\0' + b'\0'
+        + b'\x01' + box(b'asrt', asrt) + b'\x01' + box(b'afrt', afrt))
+    return box(b'abst', abst)
+
+
+class TestF4M(unittest.TestCase):
+    def test_read_bootstrap_info(self):
+        boot_info = read_bootstrap_info(bootstrap([(1, 3), (4, 2)], 5, live=True))
+        self.assertTrue(boot_info['live'])
+        self.assertEqual(boot_info['segments'], [{'segment_run': [(1, 3), (4, 2)]}])
+        self.assertEqual(boot_info['fragments'], [{'fragments': [
+            (5, 0, 4000, None), (6, 4000, 0, 1)]}])
+        self.assertEqual(boot_info['fragments'][0]['fragments'][1].discontinuity_indicator, 1)
+
+        self.assertRaises(DataTruncatedError, read_bootstrap_info, bootstrap([(1, 3)], 1)[:-3])
+
+    def test_iter_fragments(self):
+        boot_info = read_bootstrap_info(bootstrap([(1, 3), (4, 2)], 5))
+        self.assertEqual(
+            build_fragments_list(boot_info), [(1, 5), (1, 6), (1, 7), (4, 8), (4, 9)])
+        self.assertEqual(count_fragments(boot_info), 5)
+        self.assertEqual(list(iter_fragments(boot_info, after=6)), [(1, 7), (4, 8), (4, 9)])
+        self.assertEqual(list(iter_fragments(boot_info, after=7)), [(4, 8), (4, 9)])
+        self.assertEqual(list(iter_fragments(boot_info, after=9)), [])
+
+        boot_info = read_bootstrap_info(bootstrap([(1, 3), (4, 2)], 5, live=True))
+        self.assertEqual(build_fragments_list(boot_info), [(4, 8), (4, 9)])
+        self.assertEqual(count_fragments(boot_info), 2)
+        self.assertEqual(list(iter_fragments(boot_info, after=8)), [(4, 9)])
+
+        # Abnormal fragment counts of live streams
+        boot_info = read_bootstrap_info(bootstrap([(1, 4294967295)], 1, live=True))
+        self.assertEqual(build_fragments_list(boot_info), [(1, 1), (1, 2)])
+
+    def test_read_box_info(self):
+        data = box(b'afra', b'x' * 3) + box(b'mdat', b'media')
+        reader = FlvReader(data)
+        self.assertEqual(reader.read_box_info(), (b'afra', 8, 11))
+        self.assertEqual(reader.read_box_info(), (b'mdat', 19, 24))
+        self.assertRaises(DataTruncatedError, reader.read_box_info)
+
+
+class F4MTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/manifest.f4m':
+            self.send_body((
+                '<manifest xmlns="http://ns.adobe.com/f4m/1.0">'
+                '<bootstrapInfo id="b" profile="named">%s</bootstrapInfo>'
+                '<media url="media" bitrate="100" bootstrapInfoId="b"/>'
+                '</manifest>' % base64.b64encode(bootstrap([(1, 3)], 1)).decode('ascii')
+            ).encode('utf-8'), 'application/f4m+xml')
+        elif self.path in ('/mediaSeg1-Frag1', '/mediaSeg1-Frag3'):
+            self.send_body(box(b'mdat', self.path.encode('ascii')), 'video/f4f')
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+
+class FakeLogger(object):
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+class TestF4mFD(unittest.TestCase):
+    def setUp(self):
+        self.httpd = compat_http_server.HTTPServer(
+            ('127.0.0.1', 0), F4MTestRequestHandler)
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.filename = 'testfile.flv'
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for fn in (self.filename, self.filename + '.part', self.filename + '.ytdl'):
+            try_rm(encodeFilename(fn))
+
+    def test_unavailable_fragment(self):
+        # A missing fragment aborts the download even though unavailable
+        # fragments are skipped for other protocols
+        params = {
+            'logger': FakeLogger(),
+            'ignoreerrors': True,
+            'fragment_retries': 1,
+        }
+        fd = F4mFD(YoutubeDL(params), params)
+        self.assertFalse(fd.real_download(self.filename, {
+            'url': 'http://127.0.0.1:%d/manifest.f4m' % self.port,
+        }))
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_update_live_fragments(self):
+        ydl = FakeYDL()
+        ydl.urlopen = lambda url: io.BytesIO(bootstrap([(1, 3), (4, 2)], 5, live=True))
+        fd = F4mFD(ydl, {})
+        fd._get_bootstrap_from_url('http://127.0.0.1/bootstrap')
+        # The fragment 7 was unavailable, the following ones are still
+        # listed by the unchanged bootstrap
+        self.assertEqual(
+            fd._update_live_fragments('http://127.0.0.1/bootstrap', 7), [(4, 8), (4, 9)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# coding: utf-8
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import re
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from test.helper import http_server_port, try_rm
+from youtube_dl import YoutubeDL
+from youtube_dl.compat import compat_http_server
+from youtube_dl.downloader.dash import DashSegmentsFD
+from youtube_dl.downloader.hls import HlsFD
+from youtube_dl.downloader.ism import (
+    IsmFD,
+    box,
+    find_box,
+    full_box,
+    iter_boxes,
+    u32,
+    u64,
+)
+from youtube_dl.m3u8 import parse_m3u8_playlist
+from youtube_dl.utils import encodeFilename
+import threading
+
+
+FRAGMENT_COUNT = 20
+MISSING_FRAGMENT = 13
+
+
+def fragment_content(i):
+    return ('[fragment %d]' % i).encode('ascii') * (100 + i)
+
+
+def ism_fragment_content(i):
+    return box(b'moof', box(b'traf', full_box(b'tfhd', 0, 0, u32.pack(7)))) + box(
+        b'mdat', fragment_content(i))
+
+
+class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type='video/mp2t'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/index.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+            for i in range(FRAGMENT_COUNT):
+                lines.extend(['#EXTINF:2.0,', 'frag%d.ts' % i])
+            lines.append('#EXT-X-ENDLIST')
+            self.send_body('\n'.join(lines).encode('utf-8'), 'application/vnd.apple.mpegurl')
+            return
+        if self.path == '/live.m3u8':
+            # A sliding window of 3 segments that moves by one segment every
+            # time the playlist is requested, the stream ends at the 5th one
+            first = self.server.live_requests
+            self.server.live_requests += 1
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:0', '#EXT-X-MEDIA-SEQUENCE:%d' % first]
+            for i in range(first, first + 3):
+                lines.extend(['#EXTINF:2.0,', 'frag%d.ts' % i])
+            if first == 4:
+                lines.append('#EXT-X-ENDLIST')
+            self.send_body('\n'.join(lines).encode('utf-8'), 'application/vnd.apple.mpegurl')
+            return
+        mobj = re.match(r'^/ism/frag(\d+)$', self.path)
+        if mobj:
+            self.send_body(ism_fragment_content(int(mobj.group(1))), 'video/mp4')
+            return
+        mobj = re.match(r'^/frag(\d+)\.ts$', self.path)
+        if mobj:
+            i = int(mobj.group(1))
+            if i == MISSING_FRAGMENT:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_body(fragment_content(i))
+            return
+        assert False
+
+
+class FakeLogger(object):
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+class TestFragmentFD(unittest.TestCase):
+    def setUp(self):
+        self.httpd = compat_http_server.HTTPServer(
+            ('127.0.0.1', 0), HTTPTestRequestHandler)
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.filename = 'testfile.ts'
+        try_rm(encodeFilename(self.filename))
+
+    def tearDown(self):
+        try_rm(encodeFilename(self.filename))
+        try_rm(encodeFilename(self.filename + '.ytdl'))
+
+    def expected_content(self, skip=(MISSING_FRAGMENT, )):
+        return b''.join(
+            fragment_content(i) for i in range(FRAGMENT_COUNT) if i not in skip)
+
+    def download(self, fd_class, info_dict, **params):
+        params.update({
+            'logger': FakeLogger(),
+            'fragment_retries': 0,
+        })
+        ydl = YoutubeDL(params)
+        fd = fd_class(ydl, params)
+        result = fd.real_download(self.filename, info_dict)
+        content = None
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as f:
+                content = f.read()
+        return result, content
+
+    def download_hls(self, **params):
+        return self.download(HlsFD, {
+            'url': 'http://127.0.0.1:%d/index.m3u8' % self.port,
+        }, **params)
+
+    def download_dash(self, **params):
+        return self.download(DashSegmentsFD, {
+            'fragment_base_url': 'http://127.0.0.1:%d/' % self.port,
+            'fragments': [{'path': 'frag%d.ts' % i} for i in range(FRAGMENT_COUNT)],
+        }, **params)
+
+    def test_sequential(self):
+        self.assertEqual(self.download_hls(), (True, self.expected_content()))
+        self.assertEqual(self.download_dash(), (True, self.expected_content()))
+
+    def test_hls_parsed_playlist(self):
+        # The playlist attached by the extractor is not downloaded again
+        url = 'http://127.0.0.1:%d/gone.m3u8' % self.port
+        m3u8_doc = '\n'.join(
+            ['#EXTM3U', '#EXT-X-TARGETDURATION:2']
+            + ['#EXTINF:2.0,\nfrag%d.ts' % i for i in range(3)]
+            + ['#EXT-X-ENDLIST'])
+        self.assertEqual(
+            self.download(HlsFD, {
+                'url': url,
+                'm3u8_playlist': parse_m3u8_playlist(m3u8_doc, url),
+            }),
+            (True, self.expected_content(skip=range(3, FRAGMENT_COUNT))))
+
+    def test_concurrent(self):
+        for n in (2, 4, FRAGMENT_COUNT * 2):
+            self.assertEqual(
+                self.download_hls(concurrent_fragment_downloads=n),
+                (True, self.expected_content()))
+            self.assertEqual(
+                self.download_dash(concurrent_fragment_downloads=n),
+                (True, self.expected_content()))
+
+    def fragment_files(self):
+        return [f for f in os.listdir('.') if f.startswith(self.filename + '.part-Frag')]
+
+    def test_keep_fragments(self):
+        for n in (1, 4):
+            self.assertEqual(
+                self.download_hls(concurrent_fragment_downloads=n),
+                (True, self.expected_content()))
+            self.assertEqual(self.fragment_files(), [])
+            self.assertEqual(
+                self.download_hls(concurrent_fragment_downloads=n, keep_fragments=True),
+                (True, self.expected_content()))
+            fragment_files = self.fragment_files()
+            for f in fragment_files:
+                try_rm(f)
+            self.assertEqual(len(fragment_files), FRAGMENT_COUNT - 1)
+
+    def test_abort_on_unavailable_fragment(self):
+        for n in (1, 4):
+            result, _ = self.download_hls(
+                concurrent_fragment_downloads=n, skip_unavailable_fragments=False,
+                ignoreerrors=True)
+            self.assertFalse(result)
+            try_rm(encodeFilename(self.filename + '.part'))
+            try_rm(encodeFilename(self.filename + '.ytdl'))
+
+    def test_resume(self):
+        # Pretend that the first 5 fragments have already been downloaded
+        with open(self.filename + '.part', 'wb') as f:
+            f.write(self.expected_content(skip=range(5, FRAGMENT_COUNT)))
+        with open(self.filename + '.ytdl', 'w') as f:
+            f.write('{"downloader": {"current_fragment": {"index": 5}}}')
+        self.assertEqual(
+            self.download_hls(concurrent_fragment_downloads=3),
+            (True, self.expected_content()))
+        self.assertFalse(os.path.exists(self.filename + '.ytdl'))
+
+    def download_live(self, m3u8_playlist=None, **params):
+        self.httpd.live_requests = 0
+        info_dict = {
+            'url': 'http://127.0.0.1:%d/live.m3u8' % self.port,
+            'is_live': True,
+        }
+        if m3u8_playlist is not None:
+            info_dict['m3u8_playlist'] = m3u8_playlist
+        return self.download(HlsFD, info_dict, **params)
+
+    def test_live(self):
+        self.assertEqual(
+            self.download_live(live_from_start=True),
+            (True, self.expected_content(skip=range(7, FRAGMENT_COUNT))))
+        self.assertEqual(
+            self.download_live(live_window=1),
+            (True, self.expected_content(skip=list(range(2)) + list(range(7, FRAGMENT_COUNT)))))
+
+    def test_live_parsed_playlist(self):
+        # The playlist of a live stream attached by the extractor is stale
+        # by the time the stream is downloaded, it is downloaded again
+        url = 'http://127.0.0.1:%d/live.m3u8' % self.port
+        m3u8_doc = '\n'.join(
+            ['#EXTM3U', '#EXT-X-TARGETDURATION:0', '#EXT-X-MEDIA-SEQUENCE:5']
+            + ['#EXTINF:2.0,\nfrag%d.ts' % i for i in range(5, 8)])
+        self.assertEqual(
+            self.download_live(parse_m3u8_playlist(m3u8_doc, url), live_window=1),
+            (True, self.expected_content(skip=list(range(2)) + list(range(7, FRAGMENT_COUNT)))))
+
+    def download_ism(self, **params):
+        return self.download(IsmFD, {
+            'fragments': [
+                {'url': 'http://127.0.0.1:%d/ism/frag%d' % (self.port, i)}
+                for i in range(FRAGMENT_COUNT)],
+            '_download_params': {
+                'fourcc': 'AACL',
+                'duration': 1000,
+                'sampling_rate': 48000,
+            },
+        }, **params)
+
+    def test_ism(self):
+        expected_fragments = b''.join(ism_fragment_content(i) for i in range(FRAGMENT_COUNT))
+        for n in (1, 4):
+            result, content = self.download_ism(concurrent_fragment_downloads=n)
+            self.assertTrue(result)
+            self.assertTrue(content.endswith(expected_fragments))
+            header = content[:-len(expected_fragments)]
+            self.assertEqual(
+                [box_type for box_type, _, _ in iter_boxes(header)], [b'ftyp', b'moov'])
+            # Track id from the tfhd box of the first fragment
+            trex_start, _ = find_box(header, [b'moov', b'mvex', b'trex'])
+            self.assertEqual(u32.unpack_from(header, trex_start + 4)[0], 7)
+
+        # Resuming does not write the PIFF header again
+        with open(self.filename + '.part', 'wb') as f:
+            f.write(header + expected_fragments[:len(ism_fragment_content(0))])
+        with open(self.filename + '.ytdl', 'w') as f:
+            f.write('{"downloader": {"current_fragment": {"index": 1}, '
+                    '"extra": {"piff_header": {"track_id": 7}}}}')
+        self.assertEqual(self.download_ism(), (True, header + expected_fragments))
+
+    def test_iter_boxes(self):
+        data = b'junk' + box(b'abcd', b'1234') + u32.pack(1) + b'wxyz' + u64.pack(20) + b'5678' + box(b'efgh', b'')
+        self.assertEqual(
+            list(iter_boxes(data, 4)),
+            [(b'abcd', 12, 16), (b'wxyz', 32, 36), (b'efgh', 44, 44)])
+        # Truncated boxes are ignored
+        self.assertEqual(list(iter_boxes(data[:30], 4)), [(b'abcd', 12, 16)])
+        self.assertEqual(find_box(data, [b'efgh'], 4), (44, 44))
+        self.assertEqual(find_box(data, [b'abcd', b'1234'], 4), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
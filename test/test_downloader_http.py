@@ -10,12 +10,18 @@ import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from test.helper import http_server_port, try_rm
+import json
 from youtube_dl import YoutubeDL
 from youtube_dl.compat import compat_http_server
 from youtube_dl.downloader.http import HttpFD
 from youtube_dl.utils import encodeFilename
 import threading
 
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from SocketServer import ThreadingMixIn
+
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
@@ -110,6 +116,157 @@ class TestHttpFD(unittest.TestCase):
             'http_chunk_size': 1000,
         })
 
+    def test_preallocate(self):
+        self.download_all({
+            'preallocate': True,
+        })
+        self.download_all({
+            'preallocate': True,
+            'http_chunk_size': 1000,
+        })
+
+    def test_resume_killed_preallocated(self):
+        # A preallocated download killed after the first 1000 bytes have
+        # been written
+        filename = 'testfile.mp4'
+        params = {
+            'http_chunk_size': 1000,
+            'logger': FakeLogger(),
+        }
+        downloader = HttpFD(YoutubeDL(params), params)
+        with open(encodeFilename(filename + '.part'), 'wb') as f:
+            f.write(b'#' * 1000 + b'\0' * (TEST_SIZE - 1000))
+            f.seek(1000)
+            downloader._write_preallocation_state(filename, f)
+        self.assertEqual(downloader._read_preallocation_state(filename), 1000)
+        try:
+            self.assertTrue(downloader.real_download(filename, {
+                'url': 'http://127.0.0.1:%d/regular' % self.port,
+            }))
+            with open(encodeFilename(filename), 'rb') as f:
+                self.assertEqual(f.read(), b'#' * TEST_SIZE)
+            self.assertFalse(os.path.exists(encodeFilename(filename + '.ytdl')))
+        finally:
+            for fn in (filename, filename + '.part', filename + '.ytdl'):
+                try_rm(encodeFilename(fn))
+
+    def test_progress_throttling(self):
+        statuses = []
+        params = {
+            'buffersize': 100,
+            'noresizebuffer': True,
+            'logger': FakeLogger(),
+        }
+        downloader = HttpFD(YoutubeDL(params), params)
+        downloader._PROGRESS_INTERVAL = 1000
+        downloader.add_progress_hook(lambda d: statuses.append(d['status']))
+        filename = 'testfile.mp4'
+        try_rm(encodeFilename(filename))
+        self.assertTrue(downloader.real_download(filename, {
+            'url': 'http://127.0.0.1:%d/regular' % self.port,
+        }))
+        try_rm(encodeFilename(filename))
+        # 103 blocks, only the first and the last ones are reported
+        self.assertEqual(statuses, ['downloading', 'downloading', 'finished'])
+
+
+CHUNKS_TEST_CONTENT = b''.join(('%07d\n' % i).encode('ascii') for i in range(20000))
+
+
+class ChunksTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        content = CHUNKS_TEST_CONTENT
+        start, end = 0, len(content) - 1
+        mobj = re.match(r'^bytes=(\d+)-(\d+)$', self.headers.get('Range') or '')
+        if self.path == '/ranges' and mobj:
+            start, end = int(mobj.group(1)), int(mobj.group(2))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', end - start + 1)
+        self.end_headers()
+        with self.server.lock:
+            self.server.requests.append((start, end))
+            # Cut the first connection of every chunk but the first one in
+            # the middle
+            truncate = start > 0 and end not in self.server.truncated
+            self.server.truncated.add(end)
+        body = content[start:end + 1]
+        self.wfile.write(body[:len(body) // 2] if truncate else body)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, compat_http_server.HTTPServer):
+    daemon_threads = True
+
+
+class TestHttpChunks(unittest.TestCase):
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(
+            ('127.0.0.1', 0), ChunksTestRequestHandler)
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = []
+        self.httpd.truncated = set()
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.filename = 'testfile.mp4'
+        try_rm(encodeFilename(self.filename))
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for fn in (self.filename, self.filename + '.part', self.filename + '.ytdl'):
+            try_rm(encodeFilename(fn))
+
+    def download(self, ep, **params):
+        params.update({
+            'logger': FakeLogger(),
+            'retries': 1,
+        })
+        downloader = HttpFD(YoutubeDL(params), params)
+        self.assertTrue(downloader.real_download(self.filename, {
+            'url': 'http://127.0.0.1:%d/%s' % (self.port, ep),
+        }))
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), CHUNKS_TEST_CONTENT)
+        self.assertFalse(os.path.exists(self.filename + '.ytdl'))
+
+    def test_chunks(self):
+        self.download('ranges', http_chunks=4)
+        chunk_len = len(CHUNKS_TEST_CONTENT) // 4
+        self.assertEqual(
+            sorted(set(self.httpd.requests)),
+            sorted([(0, 0), (0, chunk_len - 1)]
+                   + [(chunk_len * i, chunk_len * (i + 1) - 1) for i in range(1, 4)]
+                   + [(chunk_len * i + chunk_len // 2, chunk_len * (i + 1) - 1) for i in range(1, 4)]))
+
+    def test_no_ranges(self):
+        self.download('no-ranges', http_chunks=4)
+
+    def test_resume(self):
+        total = len(CHUNKS_TEST_CONTENT)
+        half = total // 2
+        # The first half is downloaded, the second one is missing its last
+        # 1000 bytes
+        with open(self.filename + '.part', 'wb') as f:
+            f.write(CHUNKS_TEST_CONTENT[:total - 1000])
+            f.write(b'\0' * 1000)
+        with open(self.filename + '.ytdl', 'w') as f:
+            json.dump({'downloader': {'http_chunks': {
+                'total': total,
+                'chunks': [[0, half - 1, half], [half, total - 1, total - half - 1000]],
+            }}}, f)
+        self.download('ranges')
+        self.assertEqual(
+            [r for r in self.httpd.requests if r != (0, 0)],
+            [(total - 1000, total - 1), (total - 500, total - 1)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,12 +10,52 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from test.helper import http_server_port
 from youtube_dl import YoutubeDL
-from youtube_dl.compat import compat_http_server, compat_urllib_request
+from youtube_dl.compat import (
+    compat_http_server,
+    compat_urllib_error,
+    compat_urllib_request,
+)
+import gzip
+import io
+import socket
 import ssl
 import threading
+import zlib
+
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from SocketServer import ThreadingMixIn
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
+ENCODED_CONTENT = b''.join(('line %d\n' % i).encode('ascii') for i in range(50000))
+
+
+def gzip_compress(data):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def deflate_compress(data, wbits):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+ENCODED_RESPONSES = {
+    'gzip': ('gzip', gzip_compress(ENCODED_CONTENT)),
+    'gzip-junk': ('gzip', gzip_compress(ENCODED_CONTENT) + b'\x00junk' * 10),
+    'gzip-members': ('gzip', b''.join(
+        gzip_compress(ENCODED_CONTENT[i:i + 100000])
+        for i in range(0, len(ENCODED_CONTENT), 100000))),
+    'gzip-truncated': ('gzip', gzip_compress(ENCODED_CONTENT)[:-100]),
+    'deflate': ('deflate', deflate_compress(ENCODED_CONTENT, -zlib.MAX_WBITS)),
+    'deflate-zlib': ('deflate', deflate_compress(ENCODED_CONTENT, zlib.MAX_WBITS)),
+}
+
 
 class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
     def log_message(self, format, *args):
@@ -43,6 +83,14 @@ class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
             self.send_response(302)
             self.send_header(b'Location', new_url.encode('utf-8'))
             self.end_headers()
+        elif self.path.startswith('/encoded/'):
+            encoding, body = ENCODED_RESPONSES[self.path[len('/encoded/'):]]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
         elif self.path == '/%E4%B8%AD%E6%96%87.html':
             self.send_response(200)
             self.send_header('Content-Type', 'text/html; charset=utf-8')
@@ -81,6 +129,24 @@ class TestHTTP(unittest.TestCase):
         r = ydl.extract_info('http://127.0.0.1:%d/302' % self.port)
         self.assertEqual(r['entries'][0]['url'], 'http://127.0.0.1:%d/vid.mp4' % self.port)
 
+    def test_content_encoding(self):
+        ydl = YoutubeDL({'logger': FakeLogger()})
+        for name in ('gzip', 'gzip-junk', 'gzip-members', 'deflate', 'deflate-zlib'):
+            url = 'http://127.0.0.1:%d/encoded/%s' % (self.port, name)
+            res = ydl.urlopen(url)
+            self.assertEqual(res.headers.get('Content-Encoding'), None)
+            self.assertEqual(res.read(), ENCODED_CONTENT, name)
+
+            # Partial reads only decode what is needed
+            res = ydl.urlopen(url)
+            self.assertEqual(res.read(10), ENCODED_CONTENT[:10])
+            self.assertEqual(res.readline(), ENCODED_CONTENT[10:ENCODED_CONTENT.index(b'\n', 10) + 1])
+            res.close()
+
+        if sys.version_info >= (3, 3):
+            res = ydl.urlopen('http://127.0.0.1:%d/encoded/gzip-truncated' % self.port)
+            self.assertRaises(IOError, res.read)
+
 
 class TestHTTPS(unittest.TestCase):
     def setUp(self):
@@ -106,6 +172,103 @@ class TestHTTPS(unittest.TestCase):
         self.assertEqual(r['entries'][0]['url'], 'https://127.0.0.1:%d/vid.mp4' % self.port)
 
 
+class KeepAliveTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (b'foo', b'bar', b''):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            return
+        body = b'x' * 1000
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, compat_http_server.HTTPServer):
+    daemon_threads = True
+
+
+class TestKeepAlive(unittest.TestCase):
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(
+            ('127.0.0.1', 0), KeepAliveTestRequestHandler)
+        self.httpd.connections = set()
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def urlopen(self, ydl, path):
+        return ydl.urlopen('http://127.0.0.1:%d%s' % (self.port, path))
+
+    def test_reuse(self):
+        ydl = YoutubeDL({'logger': FakeLogger()})
+        for path in ('/a', '/b', '/chunked', '/c'):
+            self.urlopen(ydl, path).read()
+        self.assertEqual(len(self.httpd.connections), 1)
+
+    def test_no_reuse(self):
+        ydl = YoutubeDL({'logger': FakeLogger()})
+        # Partially read response
+        resp = self.urlopen(ydl, '/a')
+        resp.read(10)
+        resp.close()
+        self.urlopen(ydl, '/b').read()
+        self.assertEqual(len(self.httpd.connections), 2)
+        # Connection closed by the server
+        self.urlopen(ydl, '/close').read()
+        self.urlopen(ydl, '/c').read()
+        self.assertEqual(len(self.httpd.connections), 3)
+
+    def test_stale_connection(self):
+        ydl = YoutubeDL({'logger': FakeLogger()})
+        self.urlopen(ydl, '/a').read()
+        for conns in ydl._connection_pool._idle.values():
+            for conn in conns:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(len(self.urlopen(ydl, '/b').read()), 1000)
+        self.assertEqual(len(self.httpd.connections), 2)
+
+    def test_stale_connection_not_detected(self):
+        ydl = YoutubeDL({'logger': FakeLogger()})
+        pool = ydl._connection_pool
+        pool._is_stale = lambda conn: False
+
+        def drop_idle_connections():
+            self.urlopen(ydl, '/a').read()
+            for conns in pool._idle.values():
+                for conn in conns:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+
+        # Only requests without side effects are sent again
+        drop_idle_connections()
+        self.assertEqual(len(self.urlopen(ydl, '/b').read()), 1000)
+        drop_idle_connections()
+        self.assertRaises(
+            compat_urllib_error.URLError, ydl.urlopen, compat_urllib_request.Request(
+                'http://127.0.0.1:%d/c' % self.port, data=b'x'))
+
+
 def _build_proxy_handler(name):
     class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
         proxy_name = name
@@ -73,8 +73,6 @@ class TestJSInterpreter(unittest.TestCase):
         self.assertEqual(jsi.call_function('f'), -11)
 
     def test_comments(self):
-        'Skipping: Not yet fully implemented'
-        return
         jsi = JSInterpreter('''
         function x() {
             var x = /* 1 + */ 2;
@@ -112,6 +110,28 @@ class TestJSInterpreter(unittest.TestCase):
         ''')
         self.assertEqual(jsi.call_function('z'), 5)
 
+    def test_logical_and_conditional(self):
+        jsi = JSInterpreter('function f(a){return a > 2 && a < 5 ? "in" : a || "zero";}')
+        self.assertEqual(jsi.call_function('f', 3), 'in')
+        self.assertEqual(jsi.call_function('f', 7), 7)
+        self.assertEqual(jsi.call_function('f', 0), 'zero')
+
+    def test_call_function_reuses_parsed_code(self):
+        jsi = JSInterpreter('''
+        var Xy={ab:function(a){a.reverse()},cd:function(a,b){a.splice(0,b)},
+            ef:function(a,b){var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c}};
+        function f(a){a=a.split("");Xy.ab(a,3);Xy.ef(a,17);Xy.cd(a,2);Xy.ef(a,40);return a.join("")}
+        ''')
+        sig = ''.join(chr(ord('0') + i) for i in range(70))
+        first = jsi.call_function('f', sig)
+        compiled = len(jsi._compiled)
+
+        for _ in range(10):
+            self.assertEqual(jsi.call_function('f', sig), first)
+
+        # The function bodies are only parsed on the first call
+        self.assertEqual(len(jsi._compiled), compiled)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copy
+
+from youtube_dl.compat import compat_urlparse
+from youtube_dl.m3u8 import (
+    _uri_resolver,
+    parse_m3u8_playlist,
+)
+
+MEDIA_PLAYLIST = '''#EXTM3U
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:10
+#EXTINF:6.006,
+seg10.ts
+#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x0102
+#EXT-X-BYTERANGE:100@0
+#EXTINF:6.006,
+media.ts
+#EXT-X-BYTERANGE:50
+#EXTINF:5.005,title
+media.ts
+#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x0102
+#EXT-X-DISCONTINUITY
+#EXTINF:6,
+https://cdn.example.com/seg13.ts
+#UPLYNK-SEGMENT:abc,00000000,ad
+#EXTINF:6,
+ad.ts
+#UPLYNK-SEGMENT:abc,00000001,segment
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:6,
+seg15.ts
+#EXT-X-ENDLIST
+'''
+
+
+class TestM3U8(unittest.TestCase):
+    def test_parse_m3u8_playlist(self):
+        url = 'http://example.com/hls/index.m3u8?token=1'
+        playlist = parse_m3u8_playlist(MEDIA_PLAYLIST, url)
+        self.assertEqual(playlist.target_duration, 6)
+        self.assertEqual(playlist.media_sequence, 10)
+        self.assertTrue(playlist.endlist)
+        self.assertEqual(playlist.key_methods, set(['AES-128', 'NONE']))
+        self.assertTrue(playlist.has_byte_range)
+        self.assertEqual(playlist.ad_segment_count, 1)
+
+        segments = playlist.segments
+        self.assertEqual([s.url for s in segments], [
+            'http://example.com/hls/seg10.ts',
+            'http://example.com/hls/media.ts',
+            'http://example.com/hls/media.ts',
+            'https://cdn.example.com/seg13.ts',
+            'http://example.com/hls/ad.ts',
+            'http://example.com/hls/seg15.ts',
+        ])
+        self.assertEqual([s.media_sequence for s in segments], list(range(10, 16)))
+        self.assertEqual([s.duration for s in segments], [6.006, 6.006, 5.005, 6, 6, 6])
+        self.assertEqual(
+            [s.byte_range for s in segments],
+            [None, (0, 100), (100, 150), None, None, None])
+        self.assertEqual([s.discontinuity for s in segments], [False] * 3 + [True] + [False] * 2)
+        self.assertEqual([s.ad for s in segments], [False] * 4 + [True, False])
+
+        self.assertEqual(segments[0].key['METHOD'], 'NONE')
+        key = segments[1].key
+        self.assertEqual(key, {
+            'METHOD': 'AES-128',
+            'URI': 'http://example.com/hls/key.bin',
+            'IV': b'\0' * 14 + b'\x01\x02',
+        })
+        # Repeated #EXT-X-KEY tags share the same dict
+        self.assertTrue(segments[3].key is key)
+        self.assertEqual(segments[5].key['METHOD'], 'NONE')
+
+        self.assertTrue(copy.deepcopy(playlist) is playlist)
+
+    def test_uri_resolver(self):
+        for base_url in (
+                'http://example.com/a/b/index.m3u8',
+                'https://example.com:8080/index.m3u8?a=b#c',
+                'http://example.com/a/',
+                'http://example.com',
+                'index.m3u8'):
+            resolve = _uri_resolver(base_url)
+            for uri in (
+                    'seg.ts', 'seg.ts?x=1&y=2', 'sub/dir/seg-1_2.ts', '../seg.ts',
+                    './seg.ts', 'sub/../seg.ts', '/abs/seg.ts', '//cdn.example.com/seg.ts',
+                    '?x=1', '#frag', 'http://other.com/seg.ts', 'data:a,b', 'a:b/c.ts'):
+                self.assertEqual(
+                    resolve(uri), compat_urlparse.urljoin(base_url, uri),
+                    '%s with %s' % (uri, base_url))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,10 +8,140 @@ import sys
 import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from youtube_dl.postprocessor import MetadataFromTitlePP
+from test.helper import FakeYDL, try_rm
+from youtube_dl.postprocessor import (
+    ExecAfterDownloadPP,
+    FFmpegEmbedSubtitlePP,
+    FFmpegFixupStretchedPP,
+    FFmpegMergerPP,
+    FFmpegMetadataPP,
+    MetadataFromTitlePP,
+    fuse_ffmpeg_postprocessors,
+)
+from youtube_dl.utils import PostProcessingError
 
 
 class TestMetadataFromTitle(unittest.TestCase):
     def test_format_to_regex(self):
         pp = MetadataFromTitlePP(None, '%(title)s - %(artist)s')
         self.assertEqual(pp._titleregex, r'(?P<title>.+)\ \-\ (?P<artist>.+)')
+
+
+class TestFFmpegFusion(unittest.TestCase):
+    def run_fused(self, pps, info):
+        chain = fuse_ffmpeg_postprocessors(pps)
+        self.assertEqual(len(chain), 1)
+        commands = []
+        chain[0]._pps[0]._run_command = lambda command, filename: commands.append(
+            (command.input_paths, command.opts(), filename))
+        files_to_delete, _ = chain[0].run(info)
+        return commands, files_to_delete
+
+    def test_fuse_chain(self):
+        ydl = FakeYDL()
+
+        class CustomMetadataPP(FFmpegMetadataPP):
+            def run(self, info):
+                return [], info
+
+        merger, stretched, metadata = FFmpegMergerPP(ydl), FFmpegFixupStretchedPP(ydl), FFmpegMetadataPP(ydl)
+        exec_pp, custom = ExecAfterDownloadPP(ydl, 'true'), CustomMetadataPP(ydl)
+        chain = fuse_ffmpeg_postprocessors([merger, stretched, exec_pp, metadata, custom])
+        self.assertEqual(len(chain), 4)
+        self.assertEqual(chain[0]._pps, [merger, stretched])
+        self.assertEqual(chain[1:], [exec_pp, metadata, custom])
+
+    def test_single_command(self):
+        ydl = FakeYDL()
+        commands, files_to_delete = self.run_fused(
+            [FFmpegMergerPP(ydl), FFmpegFixupStretchedPP(ydl),
+             FFmpegMetadataPP(ydl), FFmpegEmbedSubtitlePP(ydl)], {
+                'filepath': 'video.mp4',
+                'ext': 'mp4',
+                '__files_to_merge': ['video.f1.mp4', 'video.f2.m4a'],
+                'stretched_ratio': 1.5,
+                'title': 'Title',
+                'requested_subtitles': {'en': {'ext': 'vtt'}},
+            })
+        self.assertEqual(commands, [(
+            ['video.f1.mp4', 'video.f2.m4a', 'video.en.vtt'],
+            ['-map', '0:v:0', '-map', '1:a:0', '-map', '2:0', '-c', 'copy',
+             '-aspect', '1.500000', '-metadata', 'title=Title',
+             '-c:s', 'mov_text', '-metadata:s:s:0', 'language=eng'],
+            'video.mp4')])
+        self.assertEqual(files_to_delete, ['video.f1.mp4', 'video.f2.m4a', 'video.en.vtt'])
+
+    def test_unfusable_step(self):
+        ydl = FakeYDL()
+        # Adding the metadata of a m4a file drops the video streams
+        commands, files_to_delete = self.run_fused(
+            [FFmpegFixupStretchedPP(ydl), FFmpegMetadataPP(ydl)], {
+                'filepath': 'audio.m4a',
+                'ext': 'm4a',
+                'stretched_ratio': 2,
+                'title': 'Title',
+            })
+        self.assertEqual(commands, [
+            (['audio.m4a'], ['-c', 'copy', '-aspect', '2.000000'], 'audio.m4a'),
+            (['audio.m4a'], ['-vn', '-acodec', 'copy', '-metadata', 'title=Title'], 'audio.m4a'),
+        ])
+        self.assertEqual(files_to_delete, [])
+
+    def test_fallback(self):
+        ydl = FakeYDL()
+        warnings = []
+        ydl.report_warning = warnings.append
+        pps = [FFmpegMergerPP(ydl), FFmpegEmbedSubtitlePP(ydl)]
+        chain = fuse_ffmpeg_postprocessors(pps)
+        self.assertEqual(len(chain), 1)
+        commands = []
+
+        def run_command(command, filename):
+            commands.append(command.input_paths)
+            # ffmpeg can not read the subtitles
+            if 'video.en.vtt' in command.input_paths:
+                raise PostProcessingError('Invalid data found when processing input')
+
+        for pp in pps:
+            pp._run_command = run_command
+        info = {
+            'filepath': 'video.mp4',
+            'ext': 'mp4',
+            '__files_to_merge': ['video.f1.mp4', 'video.f2.m4a'],
+            'requested_subtitles': {'en': {'ext': 'vtt'}},
+        }
+        # The formats are still merged when the steps are run one by one
+        try:
+            chain[0].run(info)
+        except PostProcessingError as err:
+            # The merged formats are still to be deleted
+            self.assertEqual(err.files_to_delete, ['video.f1.mp4', 'video.f2.m4a'])
+        else:
+            self.fail('PostProcessingError not raised')
+        self.assertEqual(commands, [
+            ['video.f1.mp4', 'video.f2.m4a', 'video.en.vtt'],
+            ['video.f1.mp4', 'video.f2.m4a'],
+            ['video.mp4', 'video.en.vtt'],
+        ])
+        self.assertEqual(len(warnings), 1)
+
+        # They are deleted even though a later step fails
+        for fn in info['__files_to_merge']:
+            with open(fn, 'w') as f:
+                f.write('x')
+        try:
+            for pp in pps:
+                ydl.add_post_processor(pp)
+            self.assertRaises(Exception, ydl.post_process, 'video.mp4', info)
+            for fn in info['__files_to_merge']:
+                self.assertFalse(os.path.exists(fn))
+        finally:
+            for fn in info['__files_to_merge']:
+                try_rm(fn)
+
+        # Nothing is run twice when the command succeeds
+        commands[:] = []
+        del info['requested_subtitles']['en']
+        files_to_delete, _ = chain[0].run(info)
+        self.assertEqual(commands, [['video.f1.mp4', 'video.f2.m4a']])
+        self.assertEqual(files_to_delete, ['video.f1.mp4', 'video.f2.m4a'])
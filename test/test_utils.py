@@ -35,6 +35,7 @@ from youtube_dl.utils import (
     find_xpath_attr,
     fix_xml_ampersands,
     float_or_none,
+    formats_sort_key,
     get_element_by_class,
     get_element_by_attribute,
     get_elements_by_class,
@@ -85,7 +86,9 @@ from youtube_dl.utils import (
     uppercase_escape,
     lowercase_escape,
     url_basename,
+    url_host_suffix_keys,
     url_or_none,
+    url_pattern_host_suffixes,
     base_url,
     urljoin,
     urlencode_postdata,
@@ -98,6 +101,7 @@ from youtube_dl.utils import (
     xpath_attr,
     render_table,
     match_str,
+    MatchFilter,
     parse_dfxp_time_expr,
     dfxp2srt,
     cli_option,
@@ -378,6 +382,25 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(determine_ext('http://example.com/foo/bar.m3u8//?download'), 'm3u8')
         self.assertEqual(determine_ext('foobar', None), None)
 
+    def test_formats_sort_key(self):
+        def sorted_ids(formats, *args):
+            return [f['format_id'] for f in sorted(formats, key=formats_sort_key(*args))]
+
+        formats = [
+            {'format_id': 'hls', 'url': 'http://example.com/index.m3u8', 'height': 720},
+            {'format_id': 'http', 'url': 'http://example.com/video.mp4', 'height': 720},
+            {'format_id': 'rtsp', 'url': 'rtsp://example.com/video', 'height': 720},
+            {'format_id': 'webm', 'url': 'https://example.com/video.webm', 'height': 720},
+            {'format_id': 'audio', 'url': 'http://example.com/audio.m4a', 'vcodec': 'none'},
+            {'format_id': 'low', 'url': 'http://example.com/low.mp4', 'height': 360},
+        ]
+        self.assertEqual(sorted_ids(formats), ['audio', 'low', 'rtsp', 'hls', 'webm', 'http'])
+        self.assertEqual(sorted_ids(formats, True), ['audio', 'low', 'rtsp', 'hls', 'http', 'webm'])
+        self.assertEqual(formats[0]['ext'], 'm3u8')
+        self.assertEqual(
+            sorted_ids(formats, False, ('format_id',)),
+            ['audio', 'hls', 'http', 'low', 'rtsp', 'webm'])
+
     def test_find_xpath_attr(self):
         testxml = '''<root>
             <node/>
@@ -516,6 +539,38 @@ class TestUtil(unittest.TestCase):
             url_basename('http://media.w3.org/2010/05/sintel/trailer.mp4'),
             'trailer.mp4')
 
+    def test_url_pattern_host_suffixes(self):
+        self.assertEqual(
+            url_pattern_host_suffixes(r'https?://(?:www\.)?foo\.com/(?P<id>\d+)'),
+            set(['foo.com', 'www.foo.com']))
+        self.assertEqual(
+            url_pattern_host_suffixes(r'(?:https?://)?(?:[^/]+\.)?FOO\.(?:com|net)(?:/|$)'),
+            set(['foo.com', 'foo.net']))
+        self.assertEqual(
+            url_pattern_host_suffixes(r'(?x)https?://(?:www\.foo\.com/video|player\.bar\.tv)/(?P<id>\d+)'),
+            set(['www.foo.com/video', 'player.bar.tv']))
+        self.assertEqual(
+            url_pattern_host_suffixes(r'https?://[^/]+\.foo\.com[/?#]'), set(['.foo.com']))
+        # Anything may follow the host
+        self.assertEqual(url_pattern_host_suffixes(r'https?://foo\.com'), None)
+        # Partial label
+        self.assertEqual(url_pattern_host_suffixes(r'https?://[^/]+foo\.com/'), None)
+        self.assertEqual(url_pattern_host_suffixes(r'https?://(?:www\.)?foo\.[a-z]{2,3}/'), None)
+        self.assertEqual(url_pattern_host_suffixes(r'(?:foo:|https?://foo\.com/)(?P<id>\d+)'), None)
+        self.assertEqual(url_pattern_host_suffixes(r'.*'), None)
+
+    def test_url_host_suffix_keys(self):
+        keys = url_host_suffix_keys('https://WWW.foo.com:8080/bar.html?x=1', 20)
+        self.assertTrue('www.foo.com:8080' in keys)
+        self.assertTrue('foo.com:8080' in keys)
+        self.assertFalse('foo.com' in keys)
+        keys = url_host_suffix_keys('//www.foo.com/bar', 20)
+        self.assertTrue('www.foo.com' in keys)
+        self.assertTrue('.foo.com' in keys)
+        self.assertTrue('foo.com' in keys)
+        self.assertFalse('oo.com' in keys)
+        self.assertEqual(url_host_suffix_keys('https://www.foo.com/', 4), set(['.com', 'com']))
+
     def test_base_url(self):
         self.assertEqual(base_url('http://foo.de/'), 'http://foo.de/')
         self.assertEqual(base_url('http://foo.de/bar'), 'http://foo.de/')
@@ -642,6 +697,17 @@ class TestUtil(unittest.TestCase):
         testPL(5, 2, (2, 99), [2, 3, 4])
         testPL(5, 2, (20, 99), [])
 
+        requested_pages = []
+
+        def get_page(pagenum):
+            requested_pages.append(pagenum)
+            return range(pagenum * 2, pagenum * 2 + 2)
+
+        entries = OnDemandPagedList(get_page, 2).iterslice(1)
+        self.assertEqual(requested_pages, [])
+        self.assertEqual([next(entries) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(requested_pages, [0, 1])
+
     def test_read_batch_urls(self):
         f = io.StringIO('''\xef\xbb\xbf foo
             bar\r
@@ -1213,6 +1279,20 @@ ffmpeg version 2.4.4 Copyright (c) 2000-2014 the FFmpeg ...'''), '2.4.4')
         self.assertTrue(match_str('title', {'title': ''}))
         self.assertFalse(match_str('!title', {'title': 'abc'}))
         self.assertFalse(match_str('!title', {'title': ''}))
+        self.assertTrue(match_str('x > 5 & y || z', {'x': 10, 'y': 1}))
+        self.assertTrue(match_str('x > 5 & y || z', {'z': 1}))
+        self.assertFalse(match_str('x > 5 & y || z', {'x': 10}))
+        self.assertTrue(match_str('x < 5 || x > 10', {'x': 20}))
+        self.assertFalse(match_str('x < 5 || x > 10', {'x': 7}))
+        self.assertTrue(match_str('title = "a & b || c"', {'title': 'a & b || c'}))
+
+    def test_match_filter(self):
+        match_filter = MatchFilter('duration > 60 & uploader != "a" || is_live')
+        self.assertEqual(match_filter.keys, set(['duration', 'uploader', 'is_live']))
+        self.assertTrue(match_filter({'duration': 90, 'uploader': 'b'}))
+        self.assertFalse(match_filter({'duration': 30, 'uploader': 'b'}))
+        self.assertFalse(match_filter.decidable({'duration': 30, 'uploader': 'b'}))
+        self.assertTrue(match_filter.decidable({'duration': 30, 'uploader': 'b', 'is_live': False}))
 
     def test_parse_dfxp_time_expr(self):
         self.assertEqual(parse_dfxp_time_expr(None), None)
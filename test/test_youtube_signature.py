@@ -96,6 +96,21 @@ class TestPlayerInfo(unittest.TestCase):
             self.assertEqual(player_id, expected_player_id)
 
 
+class TestSignatureSpec(unittest.TestCase):
+    def test_compile_signature_spec(self):
+        src_sig = compat_str(string.printable[:86])
+        for spec in (
+                [],
+                [3],
+                list(range(86)),
+                list(range(85, -1, -1)),
+                list(range(85, 2, -1)),
+                [2, 0, 1, 5, 4, 3, 6, 7, 8, 0],
+                [0] + list(range(84, 0, -1)) + [85]):
+            func = YoutubeIE._compile_signature_spec(spec)
+            self.assertEqual(func(src_sig), ''.join(src_sig[i] for i in spec))
+
+
 class TestSignature(unittest.TestCase):
     def setUp(self):
         TEST_DIR = os.path.dirname(os.path.abspath(__file__))
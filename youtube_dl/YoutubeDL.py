@@ -21,6 +21,7 @@ import shutil
 import subprocess
 import socket
 import sys
+import threading
 import time
 import tokenize
 import traceback
@@ -60,8 +61,10 @@ from .utils import (
     format_bytes,
     formatSeconds,
     GeoRestrictedError,
+    HTTPConnectionPool,
     int_or_none,
     ISO3166Utils,
+    LazyFragmentList,
     locked_file,
     make_HTTPS_handler,
     MaxDownloadsReached,
@@ -86,6 +89,8 @@ from .utils import (
     subtitles_filename,
     UnavailableVideoError,
     url_basename,
+    url_host_suffix_keys,
+    url_pattern_host_suffixes,
     version_tuple,
     write_json_file,
     write_string,
@@ -105,6 +110,7 @@ from .postprocessor import (
     FFmpegFixupStretchedPP,
     FFmpegMergerPP,
     FFmpegPostProcessor,
+    fuse_ffmpeg_postprocessors,
     get_postprocessor,
 )
 from .version import __version__
@@ -113,6 +119,330 @@ if compat_os_name == 'nt':
     import ctypes
 
 
+class _EntryOutput(object):
+    """Screen output of a playlist entry processed by a worker thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = []
+        self._live = False
+
+    def hold(self, func, args, replaceable=False):
+        """Hold back func(*args) unless the entry is being printed already.
+        Returns False if the output should be printed right away."""
+        with self._lock:
+            if self._live:
+                return False
+            # Only keep the latest of consecutive progress lines
+            if self._held and self._held[-1][2]:
+                self._held.pop()
+            self._held.append((func, args, replaceable))
+            return True
+
+    def release(self):
+        """Print the held output and stop holding it back"""
+        with self._lock:
+            for func, args, _ in self._held:
+                func(*args)
+            self._held = []
+            self._live = True
+
+
+class _PostProcessingQueue(object):
+    """Runs post-processing jobs on a pool of worker threads"""
+
+    def __init__(self, run_job, max_workers):
+        self._run_job = run_job
+        self._max_workers = max_workers
+        self._cond = threading.Condition()
+        self._jobs = collections.deque()
+        self._workers = 0
+        self._running = 0
+        self._error = None
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, *args):
+        """Queue run_job(*args). Blocks while max_workers jobs are waiting
+        already, and re-raises the exception a previous job raised."""
+        with self._cond:
+            while len(self._jobs) >= self._max_workers and self._error is None:
+                # Wait with a timeout so that KeyboardInterrupt is not
+                # deferred (Python 2)
+                self._cond.wait(1)
+            self._raise_error()
+            self._jobs.append(args)
+            if self._workers < self._max_workers:
+                self._workers += 1
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                if not self._jobs:
+                    self._workers -= 1
+                    return
+                args = self._jobs.popleft()
+                self._running += 1
+                self._cond.notify_all()
+            try:
+                self._run_job(*args)
+            except BaseException:
+                with self._cond:
+                    if self._error is None:
+                        self._error = sys.exc_info()[1]
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def wait(self):
+        """Wait for all the queued jobs, and re-raise the exception one
+        of them raised"""
+        with self._cond:
+            while self._jobs or self._running:
+                self._cond.wait(1)
+            self._raise_error()
+
+
+class _OutputTemplate(object):
+    """An output template parsed once into literal strings and fields, so
+    that only the fields it references are computed and sanitized"""
+
+    _FIELD_RE = re.compile(r'''(?x)
+        %(?:
+            %|
+            \((?P<key>[^()]*)\)
+            [#0\-+ ]*\d*(?:\.\d+)?[hlL]?
+            (?P<type>[diouxXeEfFgGcrsa])
+        )''')
+    _FIELD_SIZE_COMPAT_RE = r'(?<!%)%\((?P<field>autonumber|playlist_index)\)s'
+    # The conversion types for which missing numeric fields become 'NA'
+    _NA_TYPES = 'diouxXeEfFgGcrs'
+
+    def __init__(self, ops, field_size_compat):
+        self._ops = ops
+        self._field_size_compat = field_size_compat
+
+    @classmethod
+    def compile(cls, outtmpl, numeric_fields):
+        """Parse outtmpl, returns None if it uses formatting features (e.g.
+        positional fields) only YoutubeDL._evaluate_outtmpl handles"""
+        # All the %(autonumber)s and %(playlist_index)s fields get the size
+        # of the first one, see YoutubeDL._evaluate_outtmpl
+        mobj = re.search(cls._FIELD_SIZE_COMPAT_RE, outtmpl)
+        field_size_compat = mobj.group('field') if mobj else None
+
+        sep = ''.join([random.choice(ascii_letters) for _ in range(32)])
+        outtmpl = outtmpl.replace('%%', '%{0}%'.format(sep)).replace('$$', '${0}$'.format(sep))
+        outtmpl = expand_path(outtmpl).replace(sep, '')
+
+        # Each op is either a literal string or a (key, format, sized,
+        # missing_as_na) tuple, where sized tells whether the field gets
+        # the size of field_size_compat and missing_as_na whether 'NA' is
+        # used in place of the format when the field is missing. As in the
+        # regular expressions of _evaluate_outtmpl, neither applies to the
+        # fields right after a '%'.
+        ops = []
+        literal = ''
+        pos = 0
+        for mobj in cls._FIELD_RE.finditer(outtmpl):
+            text = outtmpl[pos:mobj.start()]
+            if '%' in text:
+                return None
+            literal += text
+            pos = mobj.end()
+            if mobj.group(0) == '%%':
+                literal += '%'
+                continue
+            if literal:
+                ops.append(literal)
+                literal = ''
+            key = mobj.group('key')
+            patchable = mobj.start() == 0 or outtmpl[mobj.start() - 1] != '%'
+            ops.append((
+                key, mobj.group(0),
+                patchable and field_size_compat is not None
+                and key in ('autonumber', 'playlist_index')
+                and mobj.group(0) == '%%(%s)s' % key,
+                patchable and key in numeric_fields and mobj.group('type') in cls._NA_TYPES))
+        text = outtmpl[pos:]
+        if '%' in text:
+            return None
+        literal += text
+        if literal:
+            ops.append(literal)
+        return cls(ops, field_size_compat)
+
+    @staticmethod
+    def _field_value(ydl, info_dict, key):
+        """The value of the field in the template dict of
+        _evaluate_outtmpl, None for missing fields"""
+        if key == 'epoch':
+            return int(time.time())
+        if key == 'autonumber':
+            return ydl.params.get('autonumber_start', 1) - 1 + ydl._num_downloads
+        value = info_dict.get(key)
+        if key == 'resolution' and value is None:
+            if info_dict.get('width') and info_dict.get('height'):
+                value = '%dx%d' % (info_dict['width'], info_dict['height'])
+            elif info_dict.get('height'):
+                value = '%sp' % info_dict['height']
+            elif info_dict.get('width'):
+                value = '%dx?' % info_dict['width']
+        if value is None or isinstance(value, (list, tuple, dict)):
+            return None
+        if isinstance(value, compat_numeric_types):
+            return value
+        return sanitize_filename(
+            compat_str(value),
+            restricted=ydl.params.get('restrictfilenames'),
+            is_id=(key == 'id' or key.endswith('_id')))
+
+    def _field_size(self, ydl, info_dict):
+        if self._field_size_compat == 'autonumber':
+            autonumber_size = ydl.params.get('autonumber_size')
+            return 5 if autonumber_size is None else autonumber_size
+        n_entries = self._field_value(ydl, info_dict, 'n_entries')
+        return len(str('NA' if n_entries is None else n_entries))
+
+    def evaluate(self, ydl, info_dict):
+        parts = []
+        for op in self._ops:
+            if not isinstance(op, tuple):
+                parts.append(op)
+                continue
+            key, fmt, sized, missing_as_na = op
+            value = self._field_value(ydl, info_dict, key)
+            if value is None:
+                if missing_as_na:
+                    parts.append('NA')
+                    continue
+                value = 'NA'
+            if sized:
+                fmt = '%%(%s)0%dd' % (key, self._field_size(ydl, info_dict))
+            parts.append(fmt % {key: value})
+        return ''.join(parts)
+
+
+class _FormatSelection(object):
+    """The formats of a video being selected, with the lists filtered by
+    the [...] filters of the format specification and their indexes by
+    type, extension and format id, computed once for all the selectors"""
+
+    _EXTENSIONS = ('mp4', 'flv', 'webm', '3gp', 'm4a', 'mp3', 'ogg', 'aac', 'wav')
+
+    def __init__(self, formats, incomplete_formats, filters, decisions=None):
+        self._formats = formats
+        self._incomplete_formats = incomplete_formats
+        self._filters = filters
+        self._filtered = {}
+        self._indexes = {}
+        # The alternatives picked, for _FormatSelectorPlan.explain
+        self.decisions = decisions
+
+    def formats(self, chain):
+        """The formats passing the filters whose specs are in the chain
+        tuple"""
+        if not chain:
+            return self._formats
+        formats = self._filtered.get(chain)
+        if formats is None:
+            format_filter = self._filters[chain[-1]]
+            formats = self._filtered[chain] = [
+                f for f in self.formats(chain[:-1]) if format_filter(f)]
+        return formats
+
+    def _index(self, chain, kind):
+        key = (chain, kind)
+        index = self._indexes.get(key)
+        if index is None:
+            formats = self.formats(chain)
+            if kind == 'audiovideo':
+                index = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+            elif kind == 'audio':
+                index = [f for f in formats if f.get('vcodec') == 'none']
+            elif kind == 'video':
+                index = [f for f in formats if f.get('acodec') == 'none']
+            else:
+                # The last matching format is the best one
+                index = dict((f.get(kind), f) for f in formats)
+            self._indexes[key] = index
+        return index
+
+    def select(self, format_spec, chain):
+        """The formats picked by a single format selector"""
+        formats = self.formats(chain)
+        if not formats:
+            return []
+        if format_spec == 'all':
+            return list(formats)
+        if format_spec in ('best', 'worst', None):
+            format_idx = 0 if format_spec == 'worst' else -1
+            audiovideo_formats = self._index(chain, 'audiovideo')
+            if audiovideo_formats:
+                return [audiovideo_formats[format_idx]]
+            # for extractors with incomplete formats (audio only (soundcloud)
+            # or video only (imgur)) we will fallback to best/worst
+            # {video,audio}-only format
+            if self._incomplete_formats:
+                return [formats[format_idx]]
+            return []
+        if format_spec in ('bestaudio', 'worstaudio', 'bestvideo', 'worstvideo'):
+            matches = self._index(chain, format_spec[-5:])
+            if not matches:
+                return []
+            return [matches[0 if format_spec.startswith('worst') else -1]]
+        match = self._index(
+            chain, 'ext' if format_spec in self._EXTENSIONS else 'format_id').get(format_spec)
+        return [match] if match is not None else []
+
+
+class _FormatSelectorPlan(object):
+    """A format specification compiled by YoutubeDL.build_format_selector
+
+    Calling it with the {'formats', 'incomplete_formats'} context of a
+    video returns the list of the selected formats."""
+
+    def __init__(self, format_spec, select, filters):
+        self.format_spec = format_spec
+        self._select = select
+        self._filters = filters
+
+    def _run(self, ctx, decisions):
+        selection = _FormatSelection(
+            ctx['formats'], ctx['incomplete_formats'], self._filters, decisions)
+        # The selected formats are copies, the ones of the info dict
+        # must not be modified by the processing of the download
+        return [copy.deepcopy(f) for f in self._select(selection, ())]
+
+    def __call__(self, ctx):
+        return self._run(ctx, None)
+
+    def explain(self, ctx):
+        """Select the formats like calling the plan does, and also return
+        a description of the alternatives picked and of the time taken"""
+        decisions = []
+        start = time.time()
+        formats = self._run(ctx, decisions)
+        elapsed = time.time() - start
+        lines = ["Format selection '%s' took %.2f ms, selected %s" % (
+            self.format_spec, elapsed * 1000,
+            ', '.join(f['format_id'] for f in formats if f) or 'nothing')]
+        for alternatives, picked in decisions:
+            lines.append('  %s: %s' % (
+                '/'.join(alternatives),
+                'no alternative matched' if picked is None
+                else "picked '%s' (alternative %d of %d)" % (
+                    alternatives[picked], picked + 1, len(alternatives))))
+        return formats, '\n'.join(lines)
+
+
 class YoutubeDL(object):
     """YoutubeDL class.
 
@@ -172,6 +502,9 @@ class YoutubeDL(object):
     playlist_items:    Specific indices of playlist to download.
     playlistreverse:   Download playlist items in reverse order.
     playlistrandom:    Download playlist items in random order.
+    parallel_entries:  Number of playlist items to process (extract and
+                       download) concurrently. The results are still
+                       returned and printed in playlist order.
     matchtitle:        Download only matching titles.
     rejecttitle:       Reject downloads for matching titles.
     logger:            Log messages to a logging.Logger instance.
@@ -193,6 +526,9 @@ class YoutubeDL(object):
     skip_download:     Skip the actual download of the video file
     cachedir:          Location of the cache files in the filesystem.
                        False to disable filesystem cache.
+    cache_max_size:    Maximum size of the cache directory in bytes, the
+                       oldest cache files are removed beyond it (default 50MiB).
+                       None for no limit.
     noplaylist:        Download single video instead of a playlist if in doubt.
     age_limit:         An integer representing the user's age in years.
                        Unsuitable videos for the given age are skipped.
@@ -208,6 +544,10 @@ class YoutubeDL(object):
     download_archive:  File name of a file where all downloads are recorded.
                        Videos already present in the file are not downloaded
                        again.
+    break_on_archived: Stop collecting the entries of a playlist after this
+                       number of consecutive entries already present in the
+                       download archive (for playlists whose newest entries
+                       come first).
     cookiefile:        File name where cookies should be read from and dumped to.
     nocheckcertificate:Do not verify SSL certificates
     prefer_insecure:   Use HTTP instead of HTTPS to retrieve information.
@@ -231,6 +571,12 @@ class YoutubeDL(object):
                                youtube_dl/postprocessor/__init__.py for a list.
                        as well as any further keyword arguments for the
                        postprocessor.
+    postprocessor_workers: Number of videos that may be post-processed in
+                       the background while the next ones are downloaded
+                       (the video is only recorded in the download archive
+                       once post-processed). download() waits for them
+                       before returning, other callers should call
+                       wait_for_postprocessing().
     progress_hooks:    A list of functions that get called on download
                        progress, with a dictionary with the entries
                        * status: One of "downloading", "error", or "finished".
@@ -282,6 +628,11 @@ class YoutubeDL(object):
                        If it returns a message, the video is ignored.
                        If it returns None, the video is downloaded.
                        match_filter_func in utils.py is one example for this.
+    match_filter_early: Also call match_filter with the playlist entries
+                       before they are extracted, with incomplete=True as
+                       keyword argument. The functions of match_filter_func
+                       then only reject the entries having all the fields
+                       they test.
     no_color:          Do not emit color codes in output.
     geo_bypass:        Bypass geographic restriction via faking X-Forwarded-For
                        HTTP header
@@ -305,7 +656,9 @@ class YoutubeDL(object):
     nopart, updatetime, buffersize, ratelimit, min_filesize, max_filesize, test,
     noresizebuffer, retries, continuedl, noprogress, consoletitle,
     xattr_set_filesize, external_downloader_args, hls_use_mpegts,
-    http_chunk_size.
+    http_chunk_size, fragment_retries, skip_unavailable_fragments,
+    keep_fragments, concurrent_fragment_downloads, preallocate, http_chunks,
+    live_from_start, live_window.
 
     The following options are used by the post processors:
     prefer_ffmpeg:     If False, use avconv instead of ffmpeg if both are available,
@@ -346,10 +699,23 @@ class YoutubeDL(object):
             params = {}
         self._ies = []
         self._ies_instances = {}
+        self._ies_index = None
+        self._ies_linear_dispatches = 0
         self._pps = []
         self._progress_hooks = []
         self._download_retcode = 0
         self._num_downloads = 0
+        self._download_archive = None
+        # Guards the download counter, the download archive and the
+        # extractors, which are shared by the workers processing playlist
+        # entries concurrently
+        self._lock = threading.RLock()
+        self._entry_output = threading.local()
+        self._pp_queue = None
+        # Parsed output templates, by template
+        self._outtmpl_cache = {}
+        # Compiled format specs, by spec
+        self._format_selectors = {}
         self._screen_file = [sys.stdout, sys.stderr][params.get('logtostderr', False)]
         self._err_file = sys.stderr
         self.params = {
@@ -452,10 +818,13 @@ class YoutubeDL(object):
 
     def add_info_extractor(self, ie):
         """Add an InfoExtractor object to the end of the list."""
-        self._ies.append(ie)
-        if not isinstance(ie, type):
-            self._ies_instances[ie.ie_key()] = ie
-            ie.set_downloader(self)
+        with self._lock:
+            self._ies.append(ie)
+            if self._ies_index is not None:
+                self._add_to_ies_index(self._ies_index, len(self._ies) - 1, ie)
+            if not isinstance(ie, type):
+                self._ies_instances[ie.ie_key()] = ie
+                ie.set_downloader(self)
 
     def get_info_extractor(self, ie_key):
         """
@@ -463,12 +832,77 @@ class YoutubeDL(object):
         the _ies list, if there's no instance it will create a new one and add
         it to the extractor list.
         """
-        ie = self._ies_instances.get(ie_key)
-        if ie is None:
-            ie = get_info_extractor(ie_key)()
-            self.add_info_extractor(ie)
+        with self._lock:
+            ie = self._ies_instances.get(ie_key)
+            if ie is None:
+                ie = get_info_extractor(ie_key)()
+                self.add_info_extractor(ie)
         return ie
 
+    # URLs dispatched with a linear scan of the extractors before the
+    # dispatch index is built, building it costs about as much as a few scans
+    _IES_INDEX_THRESHOLD = 10
+    # Host suffixes of _VALID_URL patterns, shared by all instances
+    _ies_host_suffixes_cache = {}
+
+    @classmethod
+    def _ie_host_suffixes(cls, ie):
+        """
+        Return the set of host suffixes of URLs ie is suitable for (see
+        url_pattern_host_suffixes) or None if they cannot be determined
+        """
+        ie_cls = ie if isinstance(ie, type) else type(ie)
+        # Extractors overriding suitable may accept any URL
+        suitable_owner = next(
+            klass for klass in ie_cls.__mro__ if 'suitable' in klass.__dict__)
+        if suitable_owner.__name__ not in ('InfoExtractor', 'LazyLoadExtractor'):
+            return None
+        valid_url = getattr(ie_cls, '_VALID_URL', None)
+        if not valid_url:
+            return None
+        if valid_url not in cls._ies_host_suffixes_cache:
+            cls._ies_host_suffixes_cache[valid_url] = url_pattern_host_suffixes(valid_url)
+        return cls._ies_host_suffixes_cache[valid_url]
+
+    def _add_to_ies_index(self, index, position, ie):
+        suffixes = self._ie_host_suffixes(ie)
+        if suffixes is None:
+            index['unindexed'].append(position)
+            return
+        for suffix in suffixes:
+            index['hosts'].setdefault(suffix, []).append(position)
+            index['max_length'] = max(index['max_length'], len(suffix))
+
+    def _ies_for_url(self, url):
+        """
+        Return the registered extractors that may be suitable for url,
+        in the order they have been added
+        """
+        index = self._ies_index
+        if index is None:
+            with self._lock:
+                index = self._ies_index
+                if index is None:
+                    if self._ies_linear_dispatches < self._IES_INDEX_THRESHOLD:
+                        self._ies_linear_dispatches += 1
+                        return list(self._ies)
+                    # Only published once complete: other threads may
+                    # be dispatching URLs meanwhile
+                    index = {
+                        # Positions in self._ies of extractors by host suffix
+                        'hosts': {},
+                        # Positions of extractors to be tried for any URL
+                        'unindexed': [],
+                        'max_length': 0,
+                    }
+                    for position, ie in enumerate(self._ies):
+                        self._add_to_ies_index(index, position, ie)
+                    self._ies_index = index
+        positions = set(index['unindexed'])
+        for key in url_host_suffix_keys(url, index['max_length']):
+            positions.update(index['hosts'].get(key, ()))
+        return [self._ies[position] for position in sorted(positions)]
+
     def add_default_info_extractors(self):
         """
         Add the InfoExtractors returned by gen_extractors to the end of the list
@@ -505,8 +939,15 @@ class YoutubeDL(object):
     def _write_string(self, s, out=None):
         write_string(s, out=out, encoding=self.params.get('encoding'))
 
+    def _hold_output(self, func, args, replaceable=False):
+        output = getattr(self._entry_output, 'output', None)
+        return output is not None and output.hold(func, args, replaceable)
+
     def to_stdout(self, message, skip_eol=False, check_quiet=False):
         """Print message to stdout if not in quiet mode."""
+        if self._hold_output(
+                self.to_stdout, (message, skip_eol, check_quiet), skip_eol):
+            return
         if self.params.get('logger'):
             self.params['logger'].debug(message)
         elif not check_quiet or not self.params.get('quiet', False):
@@ -519,6 +960,8 @@ class YoutubeDL(object):
     def to_stderr(self, message):
         """Print message to stderr."""
         assert isinstance(message, compat_str)
+        if self._hold_output(self.to_stderr, (message, )):
+            return
         if self.params.get('logger'):
             self.params['logger'].error(message)
         else:
@@ -560,11 +1003,19 @@ class YoutubeDL(object):
         return self
 
     def __exit__(self, *args):
+        if args[0] is None:
+            self.wait_for_postprocessing()
+
         self.restore_console_title()
 
         if self.params.get('cookiefile') is not None:
             self.cookiejar.save(ignore_discard=True, ignore_expires=True)
 
+        self._connection_pool.close()
+
+        if self.params.get('verbose'):
+            self.cache.report_stats()
+
     def trouble(self, message=None, tb=None):
         """Determine action to take when a download problem appears.
 
@@ -634,81 +1085,15 @@ class YoutubeDL(object):
     def prepare_filename(self, info_dict):
         """Generate the output filename."""
         try:
-            template_dict = dict(info_dict)
-
-            template_dict['epoch'] = int(time.time())
-            autonumber_size = self.params.get('autonumber_size')
-            if autonumber_size is None:
-                autonumber_size = 5
-            template_dict['autonumber'] = self.params.get('autonumber_start', 1) - 1 + self._num_downloads
-            if template_dict.get('resolution') is None:
-                if template_dict.get('width') and template_dict.get('height'):
-                    template_dict['resolution'] = '%dx%d' % (template_dict['width'], template_dict['height'])
-                elif template_dict.get('height'):
-                    template_dict['resolution'] = '%sp' % template_dict['height']
-                elif template_dict.get('width'):
-                    template_dict['resolution'] = '%dx?' % template_dict['width']
-
-            sanitize = lambda k, v: sanitize_filename(
-                compat_str(v),
-                restricted=self.params.get('restrictfilenames'),
-                is_id=(k == 'id' or k.endswith('_id')))
-            template_dict = dict((k, v if isinstance(v, compat_numeric_types) else sanitize(k, v))
-                                 for k, v in template_dict.items()
-                                 if v is not None and not isinstance(v, (list, tuple, dict)))
-            template_dict = collections.defaultdict(lambda: 'NA', template_dict)
-
             outtmpl = self.params.get('outtmpl', DEFAULT_OUTTMPL)
-
-            # For fields playlist_index and autonumber convert all occurrences
-            # of %(field)s to %(field)0Nd for backward compatibility
-            field_size_compat_map = {
-                'playlist_index': len(str(template_dict['n_entries'])),
-                'autonumber': autonumber_size,
-            }
-            FIELD_SIZE_COMPAT_RE = r'(?<!%)%\((?P<field>autonumber|playlist_index)\)s'
-            mobj = re.search(FIELD_SIZE_COMPAT_RE, outtmpl)
-            if mobj:
-                outtmpl = re.sub(
-                    FIELD_SIZE_COMPAT_RE,
-                    r'%%(\1)0%dd' % field_size_compat_map[mobj.group('field')],
-                    outtmpl)
-
-            # Missing numeric fields used together with integer presentation types
-            # in format specification will break the argument substitution since
-            # string 'NA' is returned for missing fields. We will patch output
-            # template for missing fields to meet string presentation type.
-            for numeric_field in self._NUMERIC_FIELDS:
-                if numeric_field not in template_dict:
-                    # As of [1] format syntax is:
-                    #  %[mapping_key][conversion_flags][minimum_width][.precision][length_modifier]type
-                    # 1. https://docs.python.org/2/library/stdtypes.html#string-formatting
-                    FORMAT_RE = r'''(?x)
-                        (?<!%)
-                        %
-                        \({0}\)  # mapping key
-                        (?:[#0\-+ ]+)?  # conversion flags (optional)
-                        (?:\d+)?  # minimum field width (optional)
-                        (?:\.\d+)?  # precision (optional)
-                        [hlL]?  # length modifier (optional)
-                        [diouxXeEfFgGcrs%]  # conversion type
-                    '''
-                    outtmpl = re.sub(
-                        FORMAT_RE.format(numeric_field),
-                        r'%({0})s'.format(numeric_field), outtmpl)
-
-            # expand_path translates '%%' into '%' and '$$' into '$'
-            # correspondingly that is not what we want since we need to keep
-            # '%%' intact for template dict substitution step. Working around
-            # with boundary-alike separator hack.
-            sep = ''.join([random.choice(ascii_letters) for _ in range(32)])
-            outtmpl = outtmpl.replace('%%', '%{0}%'.format(sep)).replace('$$', '${0}$'.format(sep))
-
-            # outtmpl should be expand_path'ed before template dict substitution
-            # because meta fields may contain env variables we don't want to
-            # be expanded. For example, for outtmpl "%(title)s.%(ext)s" and
-            # title "Hello $PATH", we don't want `$PATH` to be expanded.
-            filename = expand_path(outtmpl).replace(sep, '') % template_dict
+            template = self._outtmpl_cache.get(outtmpl)
+            if template is None:
+                template = self._outtmpl_cache[outtmpl] = (
+                    _OutputTemplate.compile(outtmpl, self._NUMERIC_FIELDS) or False)
+            if template:
+                filename = template.evaluate(self, info_dict)
+            else:
+                filename = self._evaluate_outtmpl(outtmpl, info_dict)
 
             # Temporary fix for #4787
             # 'Treat' all problem characters by passing filename through preferredencoding
@@ -720,6 +1105,84 @@ class YoutubeDL(object):
             self.report_error('Error in output template: ' + str(err) + ' (encoding: ' + repr(preferredencoding()) + ')')
             return None
 
+    def _evaluate_outtmpl(self, outtmpl, info_dict):
+        """Substitute the fields of info_dict in outtmpl, the generic
+        path of prepare_filename for the templates _OutputTemplate cannot
+        parse"""
+        template_dict = dict(info_dict)
+
+        template_dict['epoch'] = int(time.time())
+        autonumber_size = self.params.get('autonumber_size')
+        if autonumber_size is None:
+            autonumber_size = 5
+        template_dict['autonumber'] = self.params.get('autonumber_start', 1) - 1 + self._num_downloads
+        if template_dict.get('resolution') is None:
+            if template_dict.get('width') and template_dict.get('height'):
+                template_dict['resolution'] = '%dx%d' % (template_dict['width'], template_dict['height'])
+            elif template_dict.get('height'):
+                template_dict['resolution'] = '%sp' % template_dict['height']
+            elif template_dict.get('width'):
+                template_dict['resolution'] = '%dx?' % template_dict['width']
+
+        sanitize = lambda k, v: sanitize_filename(
+            compat_str(v),
+            restricted=self.params.get('restrictfilenames'),
+            is_id=(k == 'id' or k.endswith('_id')))
+        template_dict = dict((k, v if isinstance(v, compat_numeric_types) else sanitize(k, v))
+                             for k, v in template_dict.items()
+                             if v is not None and not isinstance(v, (list, tuple, dict)))
+        template_dict = collections.defaultdict(lambda: 'NA', template_dict)
+
+        # For fields playlist_index and autonumber convert all occurrences
+        # of %(field)s to %(field)0Nd for backward compatibility
+        field_size_compat_map = {
+            'playlist_index': len(str(template_dict['n_entries'])),
+            'autonumber': autonumber_size,
+        }
+        FIELD_SIZE_COMPAT_RE = r'(?<!%)%\((?P<field>autonumber|playlist_index)\)s'
+        mobj = re.search(FIELD_SIZE_COMPAT_RE, outtmpl)
+        if mobj:
+            outtmpl = re.sub(
+                FIELD_SIZE_COMPAT_RE,
+                r'%%(\1)0%dd' % field_size_compat_map[mobj.group('field')],
+                outtmpl)
+
+        # Missing numeric fields used together with integer presentation types
+        # in format specification will break the argument substitution since
+        # string 'NA' is returned for missing fields. We will patch output
+        # template for missing fields to meet string presentation type.
+        for numeric_field in self._NUMERIC_FIELDS:
+            if numeric_field not in template_dict:
+                # As of [1] format syntax is:
+                #  %[mapping_key][conversion_flags][minimum_width][.precision][length_modifier]type
+                # 1. https://docs.python.org/2/library/stdtypes.html#string-formatting
+                FORMAT_RE = r'''(?x)
+                    (?<!%)
+                    %
+                    \({0}\)  # mapping key
+                    (?:[#0\-+ ]+)?  # conversion flags (optional)
+                    (?:\d+)?  # minimum field width (optional)
+                    (?:\.\d+)?  # precision (optional)
+                    [hlL]?  # length modifier (optional)
+                    [diouxXeEfFgGcrs%]  # conversion type
+                '''
+                outtmpl = re.sub(
+                    FORMAT_RE.format(numeric_field),
+                    r'%({0})s'.format(numeric_field), outtmpl)
+
+        # expand_path translates '%%' into '%' and '$$' into '$'
+        # correspondingly that is not what we want since we need to keep
+        # '%%' intact for template dict substitution step. Working around
+        # with boundary-alike separator hack.
+        sep = ''.join([random.choice(ascii_letters) for _ in range(32)])
+        outtmpl = outtmpl.replace('%%', '%{0}%'.format(sep)).replace('$$', '${0}$'.format(sep))
+
+        # outtmpl should be expand_path'ed before template dict substitution
+        # because meta fields may contain env variables we don't want to
+        # be expanded. For example, for outtmpl "%(title)s.%(ext)s" and
+        # title "Hello $PATH", we don't want `$PATH` to be expanded.
+        return expand_path(outtmpl).replace(sep, '') % template_dict
+
     def _match_entry(self, info_dict, incomplete):
         """ Returns None iff the file should be downloaded """
 
@@ -753,12 +1216,15 @@ class YoutubeDL(object):
         if self.in_download_archive(info_dict):
             return '%s has already been recorded in archive' % video_title
 
-        if not incomplete:
-            match_filter = self.params.get('match_filter')
-            if match_filter is not None:
+        match_filter = self.params.get('match_filter')
+        if match_filter is not None:
+            ret = None
+            if not incomplete:
                 ret = match_filter(info_dict)
-                if ret is not None:
-                    return ret
+            elif self.params.get('match_filter_early'):
+                ret = match_filter(info_dict, incomplete=True)
+            if ret is not None:
+                return ret
 
         return None
 
@@ -782,7 +1248,7 @@ class YoutubeDL(object):
         if ie_key:
             ies = [self.get_info_extractor(ie_key)]
         else:
-            ies = self._ies
+            ies = self._ies_for_url(url)
 
         for ie in ies:
             if not ie.suitable(url):
@@ -944,12 +1410,21 @@ class YoutubeDL(object):
                     '[%s] playlist %s: Downloading %d videos' %
                     (ie_result['extractor'], playlist, num_entries))
 
+            break_on_archived = None
+            if self.params.get('download_archive') is not None:
+                break_on_archived = self.params.get('break_on_archived')
+
+            def until_archived_entries(list_ie_entries):
+                if not break_on_archived:
+                    return list(list_ie_entries)
+                return list(self._until_archived_entries(list_ie_entries, break_on_archived))
+
             if isinstance(ie_entries, list):
                 n_all_entries = len(ie_entries)
                 if playlistitems:
                     entries = make_playlistitems_entries(ie_entries)
                 else:
-                    entries = ie_entries[playliststart:playlistend]
+                    entries = until_archived_entries(ie_entries[playliststart:playlistend])
                 n_entries = len(entries)
                 self.to_screen(
                     '[%s] playlist %s: Collected %d video ids (downloading %d of them)' %
@@ -962,8 +1437,9 @@ class YoutubeDL(object):
                             item - 1, item
                         ))
                 else:
-                    entries = ie_entries.getslice(
-                        playliststart, playlistend)
+                    # Pages are only requested as long as entries are needed
+                    entries = until_archived_entries(ie_entries.iterslice(
+                        playliststart, playlistend))
                 n_entries = len(entries)
                 report_download(n_entries)
             else:  # iterable
@@ -971,7 +1447,7 @@ class YoutubeDL(object):
                     entries = make_playlistitems_entries(list(itertools.islice(
                         ie_entries, 0, max(playlistitems))))
                 else:
-                    entries = list(itertools.islice(
+                    entries = until_archived_entries(itertools.islice(
                         ie_entries, playliststart, playlistend))
                 n_entries = len(entries)
                 report_download(n_entries)
@@ -984,7 +1460,7 @@ class YoutubeDL(object):
 
             x_forwarded_for = ie_result.get('__x_forwarded_for_ip')
 
-            for i, entry in enumerate(entries, 1):
+            def process_entry(i, entry):
                 self.to_screen('[download] Downloading video %s of %s' % (i, n_entries))
                 # This __x_forwarded_for_ip thing is a bit ugly but requires
                 # minimal changes
@@ -1007,9 +1483,24 @@ class YoutubeDL(object):
                 reason = self._match_entry(entry, incomplete=True)
                 if reason is not None:
                     self.to_screen('[download] ' + reason)
-                    continue
+                    return False, None
+
+                return True, self.__process_iterable_entry(entry, download, extra)
 
-                entry_result = self.__process_iterable_entry(entry, download, extra)
+            parallel_entries = self.params.get('parallel_entries') or 1
+            # Entries of nested playlists are processed by the worker
+            # processing the nested playlist
+            if (parallel_entries > 1 and n_entries > 1
+                    and getattr(self._entry_output, 'output', None) is None):
+                processed_entries = self._process_entries_concurrently(
+                    process_entry, entries, parallel_entries)
+            else:
+                processed_entries = (
+                    process_entry(i, entry) for i, entry in enumerate(entries, 1))
+
+            for processed, entry_result in processed_entries:
+                if not processed:
+                    continue
                 # TODO: skip failed (empty) entries?
                 playlist_results.append(entry_result)
             ie_result['entries'] = playlist_results
@@ -1039,11 +1530,96 @@ class YoutubeDL(object):
         else:
             raise Exception('Invalid result type: %s' % result_type)
 
+    def _until_archived_entries(self, entries, count):
+        """Yield the playlist entries until count consecutive ones have
+        already been recorded in the download archive"""
+        archived = 0
+        for entry in entries:
+            yield entry
+            if not self.in_download_archive(entry):
+                archived = 0
+                continue
+            archived += 1
+            if archived >= count:
+                self.to_screen(
+                    '[download] %d consecutive entries have already been recorded in archive, '
+                    'not looking for further entries' % archived)
+                return
+
     @__handle_extraction_exceptions
     def __process_iterable_entry(self, entry, download, extra_info):
         return self.process_ie_result(
             entry, download=download, extra_info=extra_info)
 
+    def _process_entries_concurrently(self, process_entry, entries, max_workers):
+        """
+        Call process_entry(i, entry) for the playlist entries on a pool of
+        max_workers threads and yield the results in playlist order.
+
+        The screen output of an entry is held back until all the previous
+        entries are done. If processing an entry raises an exception, no
+        new entries are started and the exception is re-raised once the
+        entries being processed have finished.
+        """
+        cond = threading.Condition()
+        state = {
+            'next': 0,
+            'stop': False,
+        }
+        results = {}
+        outputs = [_EntryOutput() for _ in entries]
+
+        def worker():
+            while True:
+                with cond:
+                    if state['stop'] or state['next'] >= len(entries):
+                        return
+                    idx = state['next']
+                    state['next'] += 1
+                self._entry_output.output = outputs[idx]
+                try:
+                    result = True, process_entry(idx + 1, entries[idx])
+                except BaseException:
+                    result = False, sys.exc_info()[1]
+                finally:
+                    self._entry_output.output = None
+                with cond:
+                    results[idx] = result
+                    cond.notify_all()
+
+        def wait_for(idx):
+            outputs[idx].release()
+            with cond:
+                while idx not in results:
+                    # Wait with a timeout so that KeyboardInterrupt is not
+                    # deferred (Python 2)
+                    cond.wait(1)
+                return results.pop(idx)
+
+        for _ in range(min(max_workers, len(entries))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+
+        error = None
+        try:
+            for idx in range(len(entries)):
+                ok, value = wait_for(idx)
+                if not ok:
+                    error = value
+                    break
+                yield value
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify_all()
+
+        if error is not None:
+            # Let the entries already being processed finish
+            for started_idx in range(idx + 1, state['next']):
+                wait_for(started_idx)
+            raise error
+
     def _build_format_filter(self, filter_spec):
         " Returns a function to filter the formats according to the filter_spec "
 
@@ -1100,10 +1676,13 @@ class YoutubeDL(object):
         if not m:
             raise ValueError('Invalid filter specification %r' % filter_spec)
 
+        key = m.group('key')
+        none_inclusive = m.group('none_inclusive')
+
         def _filter(f):
-            actual_value = f.get(m.group('key'))
+            actual_value = f.get(key)
             if actual_value is None:
-                return m.group('none_inclusive')
+                return none_inclusive
             return op(actual_value, comparison_value)
         return _filter
 
@@ -1239,81 +1818,59 @@ class YoutubeDL(object):
                 selectors.append(current_selector)
             return selectors
 
+        # Format filter functions, by filter spec
+        filters = {}
+
+        def _selector_text(selector):
+            if isinstance(selector, list):
+                return ','.join(map(_selector_text, selector))
+            if selector.type == GROUP:
+                text = '(%s)' % _selector_text(selector.selector)
+            elif selector.type == PICKFIRST:
+                text = '/'.join(map(_selector_text, selector.selector))
+            elif selector.type == MERGE:
+                text = '+'.join(map(_selector_text, selector.selector))
+            else:
+                text = selector.selector
+            return text + ''.join('[%s]' % f for f in selector.filters)
+
+        def _alternatives(selector):
+            # a/b/c is parsed as PICKFIRST(a, [PICKFIRST(b, [c])])
+            first_choice, second_choice = selector.selector
+            if (len(second_choice) == 1 and second_choice[0].type == PICKFIRST
+                    and not second_choice[0].filters):
+                return [first_choice] + _alternatives(second_choice[0])
+            return [first_choice, second_choice]
+
         def _build_selector_function(selector):
             if isinstance(selector, list):
                 fs = [_build_selector_function(s) for s in selector]
 
-                def selector_function(ctx):
-                    for f in fs:
-                        for format in f(ctx):
-                            yield format
+                def selector_function(selection, chain):
+                    return [format for f in fs for format in f(selection, chain)]
                 return selector_function
             elif selector.type == GROUP:
                 selector_function = _build_selector_function(selector.selector)
             elif selector.type == PICKFIRST:
-                fs = [_build_selector_function(s) for s in selector.selector]
+                alternatives = _alternatives(selector)
+                texts = [_selector_text(s) for s in alternatives]
+                fs = [_build_selector_function(s) for s in alternatives]
 
-                def selector_function(ctx):
-                    for f in fs:
-                        picked_formats = list(f(ctx))
+                def selector_function(selection, chain):
+                    for i, f in enumerate(fs):
+                        picked_formats = f(selection, chain)
                         if picked_formats:
+                            if selection.decisions is not None:
+                                selection.decisions.append((texts, i))
                             return picked_formats
+                    if selection.decisions is not None:
+                        selection.decisions.append((texts, None))
                     return []
             elif selector.type == SINGLE:
                 format_spec = selector.selector
 
-                def selector_function(ctx):
-                    formats = list(ctx['formats'])
-                    if not formats:
-                        return
-                    if format_spec == 'all':
-                        for f in formats:
-                            yield f
-                    elif format_spec in ['best', 'worst', None]:
-                        format_idx = 0 if format_spec == 'worst' else -1
-                        audiovideo_formats = [
-                            f for f in formats
-                            if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
-                        if audiovideo_formats:
-                            yield audiovideo_formats[format_idx]
-                        # for extractors with incomplete formats (audio only (soundcloud)
-                        # or video only (imgur)) we will fallback to best/worst
-                        # {video,audio}-only format
-                        elif ctx['incomplete_formats']:
-                            yield formats[format_idx]
-                    elif format_spec == 'bestaudio':
-                        audio_formats = [
-                            f for f in formats
-                            if f.get('vcodec') == 'none']
-                        if audio_formats:
-                            yield audio_formats[-1]
-                    elif format_spec == 'worstaudio':
-                        audio_formats = [
-                            f for f in formats
-                            if f.get('vcodec') == 'none']
-                        if audio_formats:
-                            yield audio_formats[0]
-                    elif format_spec == 'bestvideo':
-                        video_formats = [
-                            f for f in formats
-                            if f.get('acodec') == 'none']
-                        if video_formats:
-                            yield video_formats[-1]
-                    elif format_spec == 'worstvideo':
-                        video_formats = [
-                            f for f in formats
-                            if f.get('acodec') == 'none']
-                        if video_formats:
-                            yield video_formats[0]
-                    else:
-                        extensions = ['mp4', 'flv', 'webm', '3gp', 'm4a', 'mp3', 'ogg', 'aac', 'wav']
-                        if format_spec in extensions:
-                            filter_f = lambda f: f['ext'] == format_spec
-                        else:
-                            filter_f = lambda f: f['format_id'] == format_spec
-                        matches = list(filter(filter_f, formats))
-                        if matches:
-                            yield matches[-1]
+                def selector_function(selection, chain):
+                    return selection.select(format_spec, chain)
             elif selector.type == MERGE:
                 def _merge(formats_info):
                     format_1, format_2 = [f['format_id'] for f in formats_info]
@@ -1353,18 +1910,20 @@ class YoutubeDL(object):
                     }
                 video_selector, audio_selector = map(_build_selector_function, selector.selector)
 
-                def selector_function(ctx):
-                    for pair in itertools.product(
-                            video_selector(copy.deepcopy(ctx)), audio_selector(copy.deepcopy(ctx))):
-                        yield _merge(pair)
+                def selector_function(selection, chain):
+                    return [
+                        _merge(pair) for pair in itertools.product(
+                            video_selector(selection, chain), audio_selector(selection, chain))]
 
-            filters = [self._build_format_filter(f) for f in selector.filters]
+            if not selector.filters:
+                return selector_function
+            for f in selector.filters:
+                if f not in filters:
+                    filters[f] = self._build_format_filter(f)
+            selector_filters = tuple(selector.filters)
 
-            def final_selector(ctx):
-                ctx_copy = copy.deepcopy(ctx)
-                for _filter in filters:
-                    ctx_copy['formats'] = list(filter(_filter, ctx_copy['formats']))
-                return selector_function(ctx_copy)
+            def final_selector(selection, chain):
+                return selector_function(selection, chain + selector_filters)
             return final_selector
 
         stream = io.BytesIO(format_spec.encode('utf-8'))
@@ -1394,7 +1953,8 @@ class YoutubeDL(object):
                 self.counter -= 1
 
         parsed_selector = _parse_format_selection(iter(TokenIterator(tokens)))
-        return _build_selector_function(parsed_selector)
+        return _FormatSelectorPlan(
+            format_spec, _build_selector_function(parsed_selector), filters)
 
     def _calc_headers(self, info_dict):
         res = std_headers.copy()
@@ -1612,7 +2172,10 @@ class YoutubeDL(object):
             if self.params.get('verbose'):
                 self._write_string('[debug] Default format spec: %s\n' % req_format)
 
-        format_selector = self.build_format_selector(req_format)
+        # The format spec is compiled once for all the videos
+        format_selector = self._format_selectors.get(req_format)
+        if format_selector is None:
+            format_selector = self._format_selectors[req_format] = self.build_format_selector(req_format)
 
         # While in format selection we may need to have an access to the original
         # format set in order to calculate some metrics or do some processing.
@@ -1640,7 +2203,11 @@ class YoutubeDL(object):
             'incomplete_formats': incomplete_formats,
         }
 
-        formats_to_download = list(format_selector(ctx))
+        if self.params.get('verbose'):
+            formats_to_download, explanation = format_selector.explain(ctx)
+            self._write_string('[debug] %s\n' % explanation)
+        else:
+            formats_to_download = format_selector(ctx)
         if not formats_to_download:
             raise ExtractorError('requested format not available',
                                  expected=True)
@@ -1733,32 +2300,34 @@ class YoutubeDL(object):
             self.to_stdout(formatSeconds(info_dict['duration']))
         print_mandatory('format')
         if self.params.get('forcejson', False):
-            self.to_stdout(json.dumps(info_dict))
+            self.to_stdout(json.dumps(self.strip_unserializable_info(info_dict)))
 
     def process_info(self, info_dict):
         """Process a single resolved IE result."""
 
         assert info_dict.get('_type', 'video') == 'video'
 
-        max_downloads = self.params.get('max_downloads')
-        if max_downloads is not None:
-            if self._num_downloads >= int(max_downloads):
-                raise MaxDownloadsReached()
-
         # TODO: backward compatibility, to be removed
         info_dict['fulltitle'] = info_dict['title']
 
         if 'format' not in info_dict:
             info_dict['format'] = info_dict['ext']
 
-        reason = self._match_entry(info_dict, incomplete=False)
-        if reason is not None:
-            self.to_screen('[download] ' + reason)
-            return
+        with self._lock:
+            max_downloads = self.params.get('max_downloads')
+            if max_downloads is not None:
+                if self._num_downloads >= int(max_downloads):
+                    raise MaxDownloadsReached()
 
-        self._num_downloads += 1
+            reason = self._match_entry(info_dict, incomplete=False)
+            if reason is not None:
+                self.to_screen('[download] ' + reason)
+                return
+
+            self._num_downloads += 1
 
-        info_dict['_filename'] = filename = self.prepare_filename(info_dict)
+            # autonumber is derived from the download counter
+            info_dict['_filename'] = filename = self.prepare_filename(info_dict)
 
         # Forced printings
         self.__forced_printings(info_dict, filename, incomplete=False)
@@ -1857,7 +2426,8 @@ class YoutubeDL(object):
             else:
                 self.to_screen('[info] Writing video description metadata as JSON to: ' + infofn)
                 try:
-                    write_json_file(self.filter_requested_info(info_dict), infofn)
+                    write_json_file(
+                        self.strip_unserializable_info(self.filter_requested_info(info_dict)), infofn)
                 except (OSError, IOError):
                     self.report_error('Cannot write metadata to JSON file ' + infofn)
                     return
@@ -2006,12 +2576,27 @@ class YoutubeDL(object):
                     else:
                         assert fixup_policy in ('ignore', 'never')
 
-                try:
-                    self.post_process(filename, info_dict)
-                except (PostProcessingError) as err:
-                    self.report_error('postprocessing: %s' % str(err))
-                    return
-                self.record_download_archive(info_dict)
+                if self.params.get('postprocessor_workers'):
+                    with self._lock:
+                        if self._pp_queue is None:
+                            self._pp_queue = _PostProcessingQueue(
+                                self._post_process_and_record, self.params['postprocessor_workers'])
+                    self._pp_queue.submit(filename, info_dict)
+                else:
+                    self._post_process_and_record(filename, info_dict)
+
+    def _post_process_and_record(self, filename, info_dict):
+        try:
+            self.post_process(filename, info_dict)
+        except (PostProcessingError) as err:
+            self.report_error('postprocessing: %s' % str(err))
+            return
+        self.record_download_archive(info_dict)
+
+    def wait_for_postprocessing(self):
+        """Wait for the videos being post-processed in the background"""
+        if self._pp_queue is not None:
+            self._pp_queue.wait()
 
     def download(self, url_list):
         """Download a given list of URLs."""
@@ -2031,11 +2616,13 @@ class YoutubeDL(object):
                 self.report_error('unable to download video')
             except MaxDownloadsReached:
                 self.to_screen('[info] Maximum number of downloaded files reached.')
+                self.wait_for_postprocessing()
                 raise
             else:
                 if self.params.get('dump_single_json', False):
-                    self.to_stdout(json.dumps(res))
+                    self.to_stdout(json.dumps(self.strip_unserializable_info(res)))
 
+        self.wait_for_postprocessing()
         return self._download_retcode
 
     def download_with_info_file(self, info_filename):
@@ -2053,6 +2640,7 @@ class YoutubeDL(object):
                 return self.download([webpage_url])
             else:
                 raise
+        self.wait_for_postprocessing()
         return self._download_retcode
 
     @staticmethod
@@ -2061,6 +2649,19 @@ class YoutubeDL(object):
             (k, v) for k, v in info_dict.items()
             if k not in ['requested_formats', 'requested_subtitles'])
 
+    @classmethod
+    def strip_unserializable_info(cls, info):
+        """Make info serializable to JSON: remove the parsed manifests
+        attached to the formats and expand the lazy fragment lists, in info
+        and its nested dicts"""
+        if isinstance(info, dict):
+            return dict(
+                (k, cls.strip_unserializable_info(v)) for k, v in info.items()
+                if k != 'm3u8_playlist')
+        if isinstance(info, (list, LazyFragmentList)):
+            return [cls.strip_unserializable_info(v) for v in info]
+        return info
+
     def post_process(self, filename, ie_info):
         """Run all the postprocessors on the given file."""
         info = dict(ie_info)
@@ -2069,12 +2670,17 @@ class YoutubeDL(object):
         if ie_info.get('__postprocessors') is not None:
             pps_chain.extend(ie_info['__postprocessors'])
         pps_chain.extend(self._pps)
-        for pp in pps_chain:
+        # Consecutive ffmpeg steps rewriting the file are run at once
+        for pp in fuse_ffmpeg_postprocessors(pps_chain):
             files_to_delete = []
+            error = None
             try:
                 files_to_delete, info = pp.run(info)
             except PostProcessingError as e:
-                self.report_error(e.msg)
+                # The steps of fused postprocessors done before the failing
+                # one may have left files to delete
+                files_to_delete = getattr(e, 'files_to_delete', None) or []
+                error = e
             if files_to_delete and not self.params.get('keepvideo', False):
                 for old_filename in files_to_delete:
                     self.to_screen('Deleting original file %s (pass -k to keep)' % old_filename)
@@ -2082,27 +2688,82 @@ class YoutubeDL(object):
                         os.remove(encodeFilename(old_filename))
                     except (IOError, OSError):
                         self.report_warning('Unable to remove downloaded original file')
+            if error is not None:
+                self.report_error(error.msg)
 
     def _make_archive_id(self, info_dict):
         video_id = info_dict.get('id')
-        if not video_id:
-            return
         # Future-proof against any change in case
         # and backwards compatibility with prior versions
         extractor = info_dict.get('extractor_key') or info_dict.get('ie_key')  # key in a playlist
-        if extractor is None:
+        if extractor is None or not video_id:
             url = str_or_none(info_dict.get('url'))
             if not url:
                 return
             # Try to find matching extractor for the URL and take its ie_key
-            for ie in self._ies:
-                if ie.suitable(url):
-                    extractor = ie.ie_key()
+            for ie in self._ies_for_url(url):
+                if (extractor is None or ie.ie_key() == extractor) and ie.suitable(url):
                     break
             else:
                 return
+            extractor = ie.ie_key()
+            if not video_id:
+                # Entries of flat playlists may only have a URL: the id
+                # it contains is usually the one of the video
+                video_id = self._url_video_id(ie, url)
+                if not video_id:
+                    return
         return extractor.lower() + ' ' + video_id
 
+    @staticmethod
+    def _url_video_id(ie, url):
+        mobj = re.match(ie._VALID_URL, url)
+        if not mobj:
+            return None
+        try:
+            video_id = mobj.group('id')
+        except IndexError:
+            # No id group in _VALID_URL
+            return None
+        # The id group may be optional
+        return compat_str(video_id) if video_id else None
+
+    def _load_download_archive(self, fn):
+        """Return the set of ids recorded in the download archive fn.
+
+        The archive file is only read in full once, afterwards only the
+        entries appended to it since the previous call (e.g. by other
+        youtube-dl processes sharing the file) are read."""
+        archive = self._download_archive
+        if archive is None or archive['filename'] != fn:
+            archive = self._download_archive = {
+                'filename': fn,
+                'ids': set(),
+                # Number of bytes of the archive file read so far
+                'offset': 0,
+            }
+        try:
+            size = os.path.getsize(encodeFilename(fn))
+        except OSError as ose:
+            if ose.errno != errno.ENOENT:
+                raise
+            size = 0
+        if size == archive['offset']:
+            return archive['ids']
+        if size < archive['offset']:
+            # The archive has been rewritten, start over
+            archive['ids'] = set()
+            archive['offset'] = 0
+        with locked_file(fn, 'rb') as archive_file:
+            archive_file.seek(archive['offset'])
+            data = archive_file.read()
+        archive['offset'] += len(data)
+        for line in data.decode('utf-8').splitlines():
+            line = line.strip()
+            if line:
+                archive['ids'].add(line)
+        return archive['ids']
+
     def in_download_archive(self, info_dict):
         fn = self.params.get('download_archive')
         if fn is None:
@@ -2112,15 +2773,8 @@ class YoutubeDL(object):
         if not vid_id:
             return False  # Incomplete video information
 
-        try:
-            with locked_file(fn, 'r', encoding='utf-8') as archive_file:
-                for line in archive_file:
-                    if line.strip() == vid_id:
-                        return True
-        except IOError as ioe:
-            if ioe.errno != errno.ENOENT:
-                raise
-        return False
+        with self._lock:
+            return vid_id in self._load_download_archive(fn)
 
     def record_download_archive(self, info_dict):
         fn = self.params.get('download_archive')
@@ -2128,8 +2782,11 @@ class YoutubeDL(object):
             return
         vid_id = self._make_archive_id(info_dict)
         assert vid_id
-        with locked_file(fn, 'a', encoding='utf-8') as archive_file:
-            archive_file.write(vid_id + '\n')
+        with self._lock:
+            with locked_file(fn, 'a', encoding='utf-8') as archive_file:
+                archive_file.write(vid_id + '\n')
+            # Also picks up the entries appended by other processes meanwhile
+            self._load_download_archive(fn)
 
     @staticmethod
     def format_resolution(format, default='unknown'):
@@ -2352,8 +3009,11 @@ class YoutubeDL(object):
         proxy_handler = PerRequestProxyHandler(proxies)
 
         debuglevel = 1 if self.params.get('debug_printtraffic') else 0
-        https_handler = make_HTTPS_handler(self.params, debuglevel=debuglevel)
-        ydlh = YoutubeDLHandler(self.params, debuglevel=debuglevel)
+        self._connection_pool = HTTPConnectionPool()
+        https_handler = make_HTTPS_handler(
+            self.params, connection_pool=self._connection_pool, debuglevel=debuglevel)
+        ydlh = YoutubeDLHandler(
+            self.params, connection_pool=self._connection_pool, debuglevel=debuglevel)
         redirect_handler = YoutubeDLRedirectHandler()
         data_handler = compat_urllib_request_DataHandler()
 
@@ -1,8 +1,13 @@
 from __future__ import unicode_literals
 
+import binascii
 from math import ceil
 
-from .compat import compat_b64decode
+from .compat import (
+    compat_b64decode,
+    compat_struct_pack,
+    compat_struct_unpack,
+)
 from .utils import bytes_to_intlist, intlist_to_bytes
 
 BLOCK_SIZE_BYTES = 16
@@ -18,20 +23,8 @@ def aes_ctr_decrypt(data, key, counter):
                                returns the next counter block
     @returns {int[]}           decrypted data
     """
-    expanded_key = key_expansion(key)
-    block_count = int(ceil(float(len(data)) / BLOCK_SIZE_BYTES))
-
-    decrypted_data = []
-    for i in range(block_count):
-        counter_block = counter.next_value()
-        block = data[i * BLOCK_SIZE_BYTES: (i + 1) * BLOCK_SIZE_BYTES]
-        block += [0] * (BLOCK_SIZE_BYTES - len(block))
-
-        cipher_counter_block = aes_encrypt(counter_block, expanded_key)
-        decrypted_data += xor(block, cipher_counter_block)
-    decrypted_data = decrypted_data[:len(data)]
-
-    return decrypted_data
+    return bytes_to_intlist(aes_ctr_decrypt_bytes(
+        intlist_to_bytes(data), intlist_to_bytes(key), counter))
 
 
 def aes_cbc_decrypt(data, key, iv):
@@ -43,21 +36,45 @@ def aes_cbc_decrypt(data, key, iv):
     @param {int[]} iv          16-Byte IV
     @returns {int[]}           decrypted data
     """
-    expanded_key = key_expansion(key)
+    return bytes_to_intlist(aes_cbc_decrypt_bytes(
+        intlist_to_bytes(data), intlist_to_bytes(key), intlist_to_bytes(iv)))
+
+
+def aes_ctr_decrypt_bytes(data, key, counter):
+    """
+    Decrypt with aes in counter mode, using the fastest available backend
+
+    @param {bytes} data        cipher (bytes, bytearray or memoryview)
+    @param {bytes} key         16/24/32-Byte cipher key
+    @param {instance} counter  Instance whose next_value function (@returns {int[]}  16-Byte block)
+                               returns the next counter block
+    @returns {bytes}           decrypted data
+    """
+    data = _as_bytes(data)
+    if not data:
+        return b''
     block_count = int(ceil(float(len(data)) / BLOCK_SIZE_BYTES))
+    counter_blocks = b''.join(
+        intlist_to_bytes(counter.next_value()) for _ in range(block_count))
+    return _xor_bytes(data, _ecb_encrypt(counter_blocks, _as_bytes(key)))
 
-    decrypted_data = []
-    previous_cipher_block = iv
-    for i in range(block_count):
-        block = data[i * BLOCK_SIZE_BYTES: (i + 1) * BLOCK_SIZE_BYTES]
-        block += [0] * (BLOCK_SIZE_BYTES - len(block))
 
-        decrypted_block = aes_decrypt(block, expanded_key)
-        decrypted_data += xor(decrypted_block, previous_cipher_block)
-        previous_cipher_block = block
-    decrypted_data = decrypted_data[:len(data)]
+def aes_cbc_decrypt_bytes(data, key, iv):
+    """
+    Decrypt with aes in CBC mode, using the fastest available backend
+
+    An incomplete last block is filled with 0's, no padding is removed.
 
-    return decrypted_data
+    @param {bytes} data        cipher (bytes, bytearray or memoryview)
+    @param {bytes} key         16/24/32-Byte cipher key
+    @param {bytes} iv          16-Byte IV
+    @returns {bytes}           decrypted data, as long as the cipher
+    """
+    data = _as_bytes(data)
+    length = len(data)
+    if length % BLOCK_SIZE_BYTES:
+        data += b'\0' * (BLOCK_SIZE_BYTES - length % BLOCK_SIZE_BYTES)
+    return _cbc_decrypt(data, _as_bytes(key), _as_bytes(iv))[:length]
 
 
 def aes_cbc_encrypt(data, key, iv):
@@ -358,4 +375,203 @@ def inc(data):
     return data
 
 
-__all__ = ['aes_encrypt', 'key_expansion', 'aes_ctr_decrypt', 'aes_cbc_decrypt', 'aes_decrypt_text']
+def _as_bytes(data):
+    return data.tobytes() if hasattr(data, 'tobytes') else bytes(data)
+
+
+def _xor_bytes(data1, data2):
+    """ xor data1 with the first len(data1) Bytes of data2 """
+    length = len(data1)
+    mixed = (int(binascii.hexlify(data1), 16)
+             ^ int(binascii.hexlify(data2[:length]), 16))
+    return binascii.unhexlify('%0*x' % (2 * length, mixed))
+
+
+def _rotate_table(table, bits):
+    return tuple(((x >> bits) | (x << (32 - bits))) & 0xFFFFFFFF for x in table)
+
+
+# Lookup tables of the pure python implementation: each one combines the
+# (inverse) S-box with one column of the (inverse) MixColumns step, so that a
+# round of a column only costs four lookups on 32-bit words
+_TE0 = tuple(
+    (rijndael_mul(s, 2) << 24) | (s << 16) | (s << 8) | rijndael_mul(s, 3)
+    for s in SBOX)
+_TE1, _TE2, _TE3 = (_rotate_table(_TE0, bits) for bits in (8, 16, 24))
+_TD0 = tuple(
+    (rijndael_mul(s, 14) << 24) | (rijndael_mul(s, 9) << 16)
+    | (rijndael_mul(s, 13) << 8) | rijndael_mul(s, 11)
+    for s in SBOX_INV)
+_TD1, _TD2, _TD3 = (_rotate_table(_TD0, bits) for bits in (8, 16, 24))
+
+
+def _sub_word(w):
+    return ((SBOX[w >> 24] << 24) | (SBOX[(w >> 16) & 0xFF] << 16)
+            | (SBOX[(w >> 8) & 0xFF] << 8) | SBOX[w & 0xFF])
+
+
+def _encryption_round_keys(key):
+    """
+    Generate the key schedule as 32-bit words
+
+    @param {bytes} key  16/24/32-Byte cipher key
+    @returns {(int[], int)}  44/52/60 round key words and the number of rounds
+    """
+    key_size_words = len(key) // 4
+    rounds = key_size_words + 6
+    words = list(compat_struct_unpack('>%dI' % key_size_words, key))
+    for i in range(key_size_words, 4 * (rounds + 1)):
+        temp = words[i - 1]
+        if i % key_size_words == 0:
+            temp = _sub_word(((temp << 8) | (temp >> 24)) & 0xFFFFFFFF) ^ (RCON[i // key_size_words] << 24)
+        elif key_size_words > 6 and i % key_size_words == 4:
+            temp = _sub_word(temp)
+        words.append(words[i - key_size_words] ^ temp)
+    return words, rounds
+
+
+def _decryption_round_keys(key):
+    """
+    Generate the key schedule of the equivalent inverse cipher: the round
+    keys in reverse order, with InvMixColumns applied to the inner ones
+    """
+    words, rounds = _encryption_round_keys(key)
+    dec_words = []
+    for i in range(rounds, -1, -1):
+        round_key = words[4 * i:4 * i + 4]
+        if 0 < i < rounds:
+            round_key = [
+                _TD0[SBOX[w >> 24]] ^ _TD1[SBOX[(w >> 16) & 0xFF]]
+                ^ _TD2[SBOX[(w >> 8) & 0xFF]] ^ _TD3[SBOX[w & 0xFF]]
+                for w in round_key]
+        dec_words.extend(round_key)
+    return dec_words, rounds
+
+
+def _encrypt_block(s0, s1, s2, s3, rk, rounds):
+    te0, te1, te2, te3, sbox = _TE0, _TE1, _TE2, _TE3, SBOX
+    s0 ^= rk[0]
+    s1 ^= rk[1]
+    s2 ^= rk[2]
+    s3 ^= rk[3]
+    for k in range(4, 4 * rounds, 4):
+        s0, s1, s2, s3 = (
+            te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xFF] ^ te2[(s2 >> 8) & 0xFF] ^ te3[s3 & 0xFF] ^ rk[k],
+            te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xFF] ^ te2[(s3 >> 8) & 0xFF] ^ te3[s0 & 0xFF] ^ rk[k + 1],
+            te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xFF] ^ te2[(s0 >> 8) & 0xFF] ^ te3[s1 & 0xFF] ^ rk[k + 2],
+            te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xFF] ^ te2[(s1 >> 8) & 0xFF] ^ te3[s2 & 0xFF] ^ rk[k + 3])
+    k = 4 * rounds
+    return (
+        ((sbox[s0 >> 24] << 24) | (sbox[(s1 >> 16) & 0xFF] << 16)
+         | (sbox[(s2 >> 8) & 0xFF] << 8) | sbox[s3 & 0xFF]) ^ rk[k],
+        ((sbox[s1 >> 24] << 24) | (sbox[(s2 >> 16) & 0xFF] << 16)
+         | (sbox[(s3 >> 8) & 0xFF] << 8) | sbox[s0 & 0xFF]) ^ rk[k + 1],
+        ((sbox[s2 >> 24] << 24) | (sbox[(s3 >> 16) & 0xFF] << 16)
+         | (sbox[(s0 >> 8) & 0xFF] << 8) | sbox[s1 & 0xFF]) ^ rk[k + 2],
+        ((sbox[s3 >> 24] << 24) | (sbox[(s0 >> 16) & 0xFF] << 16)
+         | (sbox[(s1 >> 8) & 0xFF] << 8) | sbox[s2 & 0xFF]) ^ rk[k + 3])
+
+
+def _decrypt_block(s0, s1, s2, s3, rk, rounds):
+    td0, td1, td2, td3, sbox_inv = _TD0, _TD1, _TD2, _TD3, SBOX_INV
+    s0 ^= rk[0]
+    s1 ^= rk[1]
+    s2 ^= rk[2]
+    s3 ^= rk[3]
+    for k in range(4, 4 * rounds, 4):
+        s0, s1, s2, s3 = (
+            td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xFF] ^ td2[(s2 >> 8) & 0xFF] ^ td3[s1 & 0xFF] ^ rk[k],
+            td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xFF] ^ td2[(s3 >> 8) & 0xFF] ^ td3[s2 & 0xFF] ^ rk[k + 1],
+            td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xFF] ^ td2[(s0 >> 8) & 0xFF] ^ td3[s3 & 0xFF] ^ rk[k + 2],
+            td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xFF] ^ td2[(s1 >> 8) & 0xFF] ^ td3[s0 & 0xFF] ^ rk[k + 3])
+    k = 4 * rounds
+    return (
+        ((sbox_inv[s0 >> 24] << 24) | (sbox_inv[(s3 >> 16) & 0xFF] << 16)
+         | (sbox_inv[(s2 >> 8) & 0xFF] << 8) | sbox_inv[s1 & 0xFF]) ^ rk[k],
+        ((sbox_inv[s1 >> 24] << 24) | (sbox_inv[(s0 >> 16) & 0xFF] << 16)
+         | (sbox_inv[(s3 >> 8) & 0xFF] << 8) | sbox_inv[s2 & 0xFF]) ^ rk[k + 1],
+        ((sbox_inv[s2 >> 24] << 24) | (sbox_inv[(s1 >> 16) & 0xFF] << 16)
+         | (sbox_inv[(s0 >> 8) & 0xFF] << 8) | sbox_inv[s3 & 0xFF]) ^ rk[k + 2],
+        ((sbox_inv[s3 >> 24] << 24) | (sbox_inv[(s2 >> 16) & 0xFF] << 16)
+         | (sbox_inv[(s1 >> 8) & 0xFF] << 8) | sbox_inv[s0 & 0xFF]) ^ rk[k + 3])
+
+
+def _ecb_encrypt_python(data, key):
+    rk, rounds = _encryption_round_keys(key)
+    words = compat_struct_unpack('>%dI' % (len(data) // 4), data)
+    encrypted = []
+    for i in range(0, len(words), 4):
+        encrypted.extend(_encrypt_block(
+            words[i], words[i + 1], words[i + 2], words[i + 3], rk, rounds))
+    return compat_struct_pack('>%dI' % len(encrypted), *encrypted)
+
+
+def _cbc_decrypt_python(data, key, iv):
+    rk, rounds = _decryption_round_keys(key)
+    words = compat_struct_unpack('>%dI' % (len(data) // 4), data)
+    p0, p1, p2, p3 = compat_struct_unpack('>4I', iv)
+    decrypted = []
+    for i in range(0, len(words), 4):
+        c0, c1, c2, c3 = words[i:i + 4]
+        d0, d1, d2, d3 = _decrypt_block(c0, c1, c2, c3, rk, rounds)
+        decrypted.extend((d0 ^ p0, d1 ^ p1, d2 ^ p2, d3 ^ p3))
+        p0, p1, p2, p3 = c0, c1, c2, c3
+    return compat_struct_pack('>%dI' % len(decrypted), *decrypted)
+
+
+def _ecb_encrypt_cryptodome(data, key):
+    return _Cryptodome_AES.new(key, _Cryptodome_AES.MODE_ECB).encrypt(data)
+
+
+def _cbc_decrypt_cryptodome(data, key, iv):
+    return _Cryptodome_AES.new(key, _Cryptodome_AES.MODE_CBC, iv).decrypt(data)
+
+
+def _cryptography_cipher(key, mode):
+    return _cryptography_ciphers.Cipher(
+        _cryptography_ciphers.algorithms.AES(key), mode,
+        backend=_cryptography_default_backend())
+
+
+def _ecb_encrypt_cryptography(data, key):
+    encryptor = _cryptography_cipher(
+        key, _cryptography_ciphers.modes.ECB()).encryptor()
+    return encryptor.update(data) + encryptor.finalize()
+
+
+def _cbc_decrypt_cryptography(data, key, iv):
+    decryptor = _cryptography_cipher(
+        key, _cryptography_ciphers.modes.CBC(iv)).decryptor()
+    return decryptor.update(data) + decryptor.finalize()
+
+
+# Prefer a native implementation when one is installed, the pure python one
+# is always available
+try:
+    try:
+        from Cryptodome.Cipher import AES as _Cryptodome_AES
+    except ImportError:
+        from Crypto.Cipher import AES as _Cryptodome_AES
+    AES_BACKEND = 'pycryptodome'
+    _ecb_encrypt, _cbc_decrypt = _ecb_encrypt_cryptodome, _cbc_decrypt_cryptodome
+except ImportError:
+    try:
+        from cryptography.hazmat.primitives import ciphers as _cryptography_ciphers
+        from cryptography.hazmat.backends import default_backend as _cryptography_default_backend
+        AES_BACKEND = 'cryptography'
+        _ecb_encrypt, _cbc_decrypt = _ecb_encrypt_cryptography, _cbc_decrypt_cryptography
+    except ImportError:
+        AES_BACKEND = 'python'
+        _ecb_encrypt, _cbc_decrypt = _ecb_encrypt_python, _cbc_decrypt_python
+
+
+__all__ = [
+    'AES_BACKEND',
+    'aes_encrypt',
+    'key_expansion',
+    'aes_ctr_decrypt',
+    'aes_cbc_decrypt',
+    'aes_ctr_decrypt_bytes',
+    'aes_cbc_decrypt_bytes',
+    'aes_decrypt_text',
+]
@@ -1,23 +1,72 @@
 from __future__ import unicode_literals
 
+import copy
 import errno
 import io
 import json
 import os
 import re
 import shutil
+import threading
+import time
 import traceback
 
 from .compat import compat_getenv
 from .utils import (
     expand_path,
+    format_bytes,
     write_json_file,
 )
 
 
 class Cache(object):
+    """Two-level cache: an in-process LRU in front of JSON files on disk
+
+    Entries of the sections listed in _SECTION_TTL expire after the given
+    number of seconds (based on the modification time of the cache file).
+    When the cache files grow beyond cache_max_size bytes, the oldest ones
+    are removed. Only the files the cache writes itself are considered,
+    and only in a directory that looks like a cache dir.
+    """
+
+    # Maximum number of entries kept in memory
+    _MEMORY_SIZE = 256
+
+    # Default maximum size of the cache directory, in bytes
+    _MAX_SIZE = 50 * 1024 * 1024
+
+    # Time to live of the entries of a section, in seconds
+    _SECTION_TTL = {
+        # Player versions come and go, keep only recent ones around
+        'youtube-sigfuncs': 30 * 24 * 60 * 60,
+        'brightcove': 7 * 24 * 60 * 60,
+    }
+
+    # Time a miss is remembered for, in seconds: the entry may be stored
+    # by another process meanwhile
+    _MISS_TTL = 10
+
+    _SECTION_RE = re.compile(r'^[a-zA-Z0-9_.-]+$')
+    _CACHE_FILE_RE = re.compile(r'^[a-zA-Z0-9_.-]+\.json$')
+
+    _MISSING = object()
+    _UNKNOWN = object()
+
     def __init__(self, ydl):
         self._ydl = ydl
+        self._lock = threading.RLock()
+        # (section, key, dtype) -> [last use, expiry time or None, data]
+        self._memory = {}
+        self._tick = 0
+        # Total size of the cache directory, None until it has been scanned
+        self._disk_size = None
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
 
     def _get_root_dir(self):
         res = self._ydl.params.get('cachedir')
@@ -26,10 +75,13 @@ class Cache(object):
             res = os.path.join(cache_root, 'youtube-dl')
         return expand_path(res)
 
+    @staticmethod
+    def _looks_like_cache_dir(cachedir):
+        return any((term in cachedir) for term in ('cache', 'tmp'))
+
     def _get_cache_fn(self, section, key, dtype):
-        assert re.match(r'^[a-zA-Z0-9_.-]+$', section), \
-            'invalid section %r' % section
-        assert re.match(r'^[a-zA-Z0-9_.-]+$', key), 'invalid key %r' % key
+        assert self._SECTION_RE.match(section), 'invalid section %r' % section
+        assert self._SECTION_RE.match(key), 'invalid key %r' % key
         return os.path.join(
             self._get_root_dir(), section, '%s.%s' % (key, dtype))
 
@@ -37,6 +89,30 @@ class Cache(object):
     def enabled(self):
         return self._ydl.params.get('cachedir') is not False
 
+    def _expiry(self, section, mtime):
+        ttl = self._SECTION_TTL.get(section)
+        return None if ttl is None else mtime + ttl
+
+    def _remember(self, mkey, expiry, data):
+        with self._lock:
+            self._tick += 1
+            self._memory[mkey] = [self._tick, expiry, data]
+            if len(self._memory) > self._MEMORY_SIZE:
+                lru = min(self._memory, key=lambda k: self._memory[k][0])
+                del self._memory[lru]
+
+    def _recall(self, mkey):
+        with self._lock:
+            entry = self._memory.get(mkey)
+            if entry is None:
+                return self._UNKNOWN
+            if entry[1] is not None and entry[1] < time.time():
+                del self._memory[mkey]
+                return self._UNKNOWN
+            self._tick += 1
+            entry[0] = self._tick
+            return entry[2]
+
     def store(self, section, key, data, dtype='json'):
         assert dtype in ('json',)
 
@@ -50,11 +126,25 @@ class Cache(object):
             except OSError as ose:
                 if ose.errno != errno.EEXIST:
                     raise
+            # write_json_file replaces the cache file atomically
             write_json_file(data, fn)
         except Exception:
             tb = traceback.format_exc()
             self._ydl.report_warning(
                 'Writing cache to %r failed: %s' % (fn, tb))
+            return
+
+        self._remember(
+            (section, key, dtype), self._expiry(section, time.time()),
+            copy.deepcopy(data))
+        with self._lock:
+            self.stats['stores'] += 1
+            if self._disk_size is not None:
+                try:
+                    self._disk_size += os.path.getsize(fn)
+                except OSError:
+                    pass
+        self._evict()
 
     def load(self, section, key, dtype='json', default=None):
         assert dtype in ('json',)
@@ -62,11 +152,28 @@ class Cache(object):
         if not self.enabled:
             return default
 
+        mkey = (section, key, dtype)
+        data = self._recall(mkey)
+        if data is not self._UNKNOWN:
+            with self._lock:
+                if data is self._MISSING:
+                    self.stats['misses'] += 1
+                    return default
+                self.stats['memory_hits'] += 1
+            return copy.deepcopy(data)
+
+        data = expiry = self._MISSING
         cache_fn = self._get_cache_fn(section, key, dtype)
         try:
             try:
                 with io.open(cache_fn, 'r', encoding='utf-8') as cachef:
-                    return json.load(cachef)
+                    expiry = self._expiry(
+                        section, os.fstat(cachef.fileno()).st_mtime)
+                    if expiry is None or expiry >= time.time():
+                        data = json.load(cachef)
+                if data is self._MISSING:
+                    # Expired
+                    os.remove(cache_fn)
             except ValueError:
                 try:
                     file_size = os.path.getsize(cache_fn)
@@ -74,10 +181,86 @@ class Cache(object):
                     file_size = str(oe)
                 self._ydl.report_warning(
                     'Cache retrieval from %s failed (%s)' % (cache_fn, file_size))
-        except IOError:
+        except (IOError, OSError):
             pass  # No cache available
 
-        return default
+        with self._lock:
+            if data is self._MISSING:
+                self.stats['misses'] += 1
+                # Remember the miss for a while as well so that the file
+                # is not looked up again right away
+                self._remember(mkey, time.time() + self._MISS_TTL, self._MISSING)
+                return default
+            self.stats['disk_hits'] += 1
+            self._remember(mkey, expiry, data)
+        return copy.deepcopy(data)
+
+    def _evict(self):
+        max_size = self._ydl.params.get('cache_max_size', self._MAX_SIZE)
+        if max_size is None:
+            return
+
+        with self._lock:
+            if self._disk_size is not None and self._disk_size <= max_size:
+                return
+
+            root_dir = self._get_root_dir()
+            if not self._looks_like_cache_dir(root_dir):
+                return
+            files = []
+            for fn in self._cache_files(root_dir):
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, fn))
+            self._disk_size = sum(f[1] for f in files)
+            if self._disk_size <= max_size:
+                return
+
+            # Remove the oldest files first
+            files.sort()
+            for _, size, fn in files:
+                if self._disk_size <= max_size:
+                    break
+                try:
+                    os.remove(fn)
+                except OSError:
+                    continue
+                self._disk_size -= size
+                self.stats['evictions'] += 1
+            # The evicted files may have been remembered as well
+            self._memory = {}
+
+    def _cache_files(self, root_dir):
+        """Yield the <root_dir>/<section>/<key>.json files store() writes"""
+        try:
+            sections = os.listdir(root_dir)
+        except OSError:
+            return
+        for section in sections:
+            section_dir = os.path.join(root_dir, section)
+            if not self._SECTION_RE.match(section) or not os.path.isdir(section_dir):
+                continue
+            try:
+                filenames = os.listdir(section_dir)
+            except OSError:
+                continue
+            for filename in filenames:
+                if self._CACHE_FILE_RE.match(filename):
+                    yield os.path.join(section_dir, filename)
+
+    def report_stats(self):
+        if not self.enabled or not any(self.stats.values()):
+            return
+        stats = dict(self.stats)
+        stats['disk_size'] = (
+            format_bytes(self._disk_size) if self._disk_size is not None
+            else 'not scanned')
+        self._ydl.to_screen(
+            '[debug] Cache: %(memory_hits)d memory hits, %(disk_hits)d disk hits, '
+            '%(misses)d misses, %(stores)d stores, %(evictions)d evictions '
+            '(cache size: %(disk_size)s)' % stats)
 
     def remove(self):
         if not self.enabled:
@@ -85,9 +268,13 @@ class Cache(object):
             return
 
         cachedir = self._get_root_dir()
-        if not any((term in cachedir) for term in ('cache', 'tmp')):
+        if not self._looks_like_cache_dir(cachedir):
             raise Exception('Not removing directory %s - this does not look like a cache dir' % cachedir)
 
+        with self._lock:
+            self._memory = {}
+            self._disk_size = None
+
         self._ydl.to_screen(
             'Removing cache dir %s .' % cachedir, skip_eol=True)
         if os.path.exists(cachedir):
@@ -2953,6 +2953,21 @@ else:
         compat_Struct = struct.Struct
 
 
+try:
+    from re import _parser as compat_sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as compat_sre_parse
+
+
+try:
+    import brotli as compat_brotli
+except ImportError:
+    try:
+        import brotlicffi as compat_brotli
+    except ImportError:
+        compat_brotli = None
+
+
 try:
     from future_builtins import zip as compat_zip
 except ImportError:  # not 2.6+ or is 3.x
@@ -2996,6 +3011,7 @@ __all__ = [
     'compat_Struct',
     'compat_b64decode',
     'compat_basestring',
+    'compat_brotli',
     'compat_chr',
     'compat_cookiejar',
     'compat_cookiejar_Cookie',
@@ -3026,6 +3042,7 @@ __all__ = [
     'compat_shlex_quote',
     'compat_shlex_split',
     'compat_socket_create_connection',
+    'compat_sre_parse',
     'compat_str',
     'compat_struct_pack',
     'compat_struct_unpack',
@@ -44,6 +44,8 @@ def get_suitable_downloader(info_dict, params={}):
             return ed
 
     if protocol.startswith('m3u8') and info_dict.get('is_live'):
+        if params.get('live_from_start') or params.get('live_window'):
+            return HlsFD
         return FFmpegFD
 
     if protocol == 'm3u8' and params.get('hls_prefer_native') is True:
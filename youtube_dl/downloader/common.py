@@ -48,9 +48,17 @@ class FileDownloader(object):
     external_downloader_args:  A list of additional command-line arguments for the
                         external downloader.
     hls_use_mpegts:     Use the mpegts container for HLS videos.
+    live_from_start:    Download live HLS streams natively, starting with the
+                        oldest segment of the playlist (HlsFD only).
+    live_window:        Download live HLS streams natively, starting with this
+                        number of most recent segments (HlsFD only).
     http_chunk_size:    Size of a chunk for chunk-based HTTP downloading. May be
                         useful for bypassing bandwidth throttling imposed by
                         a webserver (experimental)
+    http_chunks:        Number of connections used to download a file in byte
+                        ranges (HttpFD only).
+    preallocate:        Reserve the disk space of the file before downloading
+                        it when its size is known (HttpFD only).
 
     Subclasses of this one must re-define the real_download method.
     """
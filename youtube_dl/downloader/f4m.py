@@ -1,18 +1,18 @@
 from __future__ import division, unicode_literals
 
-import io
+import collections
 import itertools
 import time
 
 from .fragment import FragmentFD
 from ..compat import (
+    compat_Struct,
     compat_b64decode,
     compat_etree_fromstring,
     compat_urlparse,
     compat_urllib_error,
     compat_urllib_parse_urlparse,
     compat_struct_pack,
-    compat_struct_unpack,
 )
 from ..utils import (
     fix_xml_ampersands,
@@ -24,56 +24,88 @@ class DataTruncatedError(Exception):
     pass
 
 
-class FlvReader(io.BytesIO):
+_u8 = compat_Struct('!B')
+_u32 = compat_Struct('!I')
+_u64 = compat_Struct('!Q')
+_afrt_entry = compat_Struct('!IQI')
+
+# Entries of the segment run table (asrt) and of the fragment run table (afrt)
+SegmentRun = collections.namedtuple(
+    'SegmentRun', ['first_segment', 'fragments_per_segment'])
+FragmentRun = collections.namedtuple(
+    'FragmentRun', ['first', 'ts', 'duration', 'discontinuity_indicator'])
+
+
+class FlvReader(object):
     """
     Reader for Flv files
     The file format is documented in https://www.adobe.com/devnet/f4v.html
+
+    Fields are read at offsets of data (between start and end) without
+    copying it, boxes being read as (box_type, payload_start, payload_end).
     """
 
-    def read_bytes(self, n):
-        data = self.read(n)
-        if len(data) < n:
+    def __init__(self, data, start=0, end=None):
+        self.data = data
+        self.pos = start
+        self.end = len(data) if end is None else end
+
+    def _advance(self, n):
+        pos = self.pos
+        if pos + n > self.end:
             raise DataTruncatedError(
                 'FlvReader error: need %d bytes while only %d bytes got' % (
-                    n, len(data)))
-        return data
+                    n, self.end - pos))
+        self.pos = pos + n
+        return pos
+
+    def skip(self, n):
+        self._advance(n)
+
+    def read_bytes(self, n):
+        pos = self._advance(n)
+        return self.data[pos:pos + n]
 
     # Utility functions for reading numbers and strings
     def read_unsigned_long_long(self):
-        return compat_struct_unpack('!Q', self.read_bytes(8))[0]
+        return _u64.unpack_from(self.data, self._advance(8))[0]
 
     def read_unsigned_int(self):
-        return compat_struct_unpack('!I', self.read_bytes(4))[0]
+        return _u32.unpack_from(self.data, self._advance(4))[0]
 
     def read_unsigned_char(self):
-        return compat_struct_unpack('!B', self.read_bytes(1))[0]
+        return _u8.unpack_from(self.data, self._advance(1))[0]
 
     def read_string(self):
-        res = b''
-        while True:
-            char = self.read_bytes(1)
-            if char == b'\x00':
-                break
-            res += char
+        string_end = self.data.find(b'\x00', self.pos, self.end)
+        if string_end == -1:
+            raise DataTruncatedError('FlvReader error: unterminated string')
+        res = self.data[self.pos:string_end]
+        self.pos = string_end + 1
         return res
 
     def read_box_info(self):
         """
-        Read a box and return the info as a tuple: (box_size, box_type, box_data)
+        Read a box header and return (box_type, payload_start, payload_end)
         """
-        real_size = size = self.read_unsigned_int()
+        box_start = self.pos
+        size = self.read_unsigned_int()
         box_type = self.read_bytes(4)
-        header_end = 8
         if size == 1:
-            real_size = self.read_unsigned_long_long()
-            header_end = 16
-        return real_size, box_type, self.read_bytes(real_size - header_end)
+            size = self.read_unsigned_long_long()
+        payload_start = self.pos
+        self.pos = box_start
+        self._advance(size)
+        return box_type, payload_start, box_start + size
+
+    def read_box(self, expected_type):
+        box_type, payload_start, payload_end = self.read_box_info()
+        assert box_type == expected_type
+        return FlvReader(self.data, payload_start, payload_end)
 
     def read_asrt(self):
-        # version
-        self.read_unsigned_char()
-        # flags
-        self.read_bytes(3)
+        # version, flags
+        self.skip(4)
         quality_entry_count = self.read_unsigned_char()
         # QualityEntryCount
         for i in range(quality_entry_count):
@@ -84,19 +116,15 @@ class FlvReader(io.BytesIO):
         for i in range(segment_run_count):
             first_segment = self.read_unsigned_int()
             fragments_per_segment = self.read_unsigned_int()
-            segments.append((first_segment, fragments_per_segment))
+            segments.append(SegmentRun(first_segment, fragments_per_segment))
 
         return {
             'segment_run': segments,
         }
 
     def read_afrt(self):
-        # version
-        self.read_unsigned_char()
-        # flags
-        self.read_bytes(3)
-        # time scale
-        self.read_unsigned_int()
+        # version, flags, time scale
+        self.skip(8)
 
         quality_entry_count = self.read_unsigned_char()
         # QualitySegmentUrlModifiers
@@ -106,40 +134,25 @@ class FlvReader(io.BytesIO):
         fragments_count = self.read_unsigned_int()
         fragments = []
         for i in range(fragments_count):
-            first = self.read_unsigned_int()
-            first_ts = self.read_unsigned_long_long()
-            duration = self.read_unsigned_int()
+            first, first_ts, duration = _afrt_entry.unpack_from(self.data, self._advance(16))
             if duration == 0:
                 discontinuity_indicator = self.read_unsigned_char()
             else:
                 discontinuity_indicator = None
-            fragments.append({
-                'first': first,
-                'ts': first_ts,
-                'duration': duration,
-                'discontinuity_indicator': discontinuity_indicator,
-            })
+            fragments.append(FragmentRun(first, first_ts, duration, discontinuity_indicator))
 
         return {
             'fragments': fragments,
         }
 
     def read_abst(self):
-        # version
-        self.read_unsigned_char()
-        # flags
-        self.read_bytes(3)
-
-        self.read_unsigned_int()  # BootstrapinfoVersion
+        # version, flags, BootstrapinfoVersion
+        self.skip(8)
         # Profile,Live,Update,Reserved
         flags = self.read_unsigned_char()
         live = flags & 0x20 != 0
-        # time scale
-        self.read_unsigned_int()
-        # CurrentMediaTime
-        self.read_unsigned_long_long()
-        # SmpteTimeCodeOffset
-        self.read_unsigned_long_long()
+        # time scale, CurrentMediaTime, SmpteTimeCodeOffset
+        self.skip(20)
 
         self.read_string()  # MovieIdentifier
         server_count = self.read_unsigned_char()
@@ -158,16 +171,11 @@ class FlvReader(io.BytesIO):
         segments_count = self.read_unsigned_char()
         segments = []
         for i in range(segments_count):
-            box_size, box_type, box_data = self.read_box_info()
-            assert box_type == b'asrt'
-            segment = FlvReader(box_data).read_asrt()
-            segments.append(segment)
+            segments.append(self.read_box(b'asrt').read_asrt())
         fragments_run_count = self.read_unsigned_char()
         fragments = []
         for i in range(fragments_run_count):
-            box_size, box_type, box_data = self.read_box_info()
-            assert box_type == b'afrt'
-            fragments.append(FlvReader(box_data).read_afrt())
+            fragments.append(self.read_box(b'afrt').read_afrt())
 
         return {
             'segments': segments,
@@ -176,35 +184,57 @@ class FlvReader(io.BytesIO):
         }
 
     def read_bootstrap_info(self):
-        total_size, box_type, box_data = self.read_box_info()
-        assert box_type == b'abst'
-        return FlvReader(box_data).read_abst()
+        return self.read_box(b'abst').read_abst()
 
 
 def read_bootstrap_info(bootstrap_bytes):
     return FlvReader(bootstrap_bytes).read_bootstrap_info()
 
 
-def build_fragments_list(boot_info):
-    """ Return a list of (segment, fragment) for each fragment in the video """
-    res = []
-    segment_run_table = boot_info['segments'][0]
-    fragment_run_entry_table = boot_info['fragments'][0]['fragments']
-    first_frag_number = fragment_run_entry_table[0]['first']
-    fragments_counter = itertools.count(first_frag_number)
-    for segment, fragments_count in segment_run_table['segment_run']:
+def _segment_runs(boot_info):
+    for segment, fragments_count in boot_info['segments'][0]['segment_run']:
         # In some live HDS streams (for example Rai), `fragments_count` is
         # abnormal and causing out-of-memory errors. It's OK to change the
         # number of fragments for live streams as they are updated periodically
         if fragments_count == 4294967295 and boot_info['live']:
             fragments_count = 2
-        for _ in range(fragments_count):
-            res.append((segment, next(fragments_counter)))
+        yield segment, fragments_count
+
+
+def count_fragments(boot_info):
+    """ Return the number of fragments iter_fragments yields """
+    total = sum(count for _, count in _segment_runs(boot_info))
+    return min(total, 2) if boot_info['live'] else total
 
+
+def iter_fragments(boot_info, after=None):
+    """
+    Yield (segment, fragment) for each fragment in the video, without
+    building the whole list: only the last two fragments of live streams,
+    and only the fragments numbered above after if given
+    """
+    first_frag_number = boot_info['fragments'][0]['fragments'][0].first
+    skip = 0
     if boot_info['live']:
-        res = res[-2:]
+        skip = sum(count for _, count in _segment_runs(boot_info)) - 2
+    if after is not None:
+        skip = max(skip, after + 1 - first_frag_number)
+    skip = max(skip, 0)
+    frag_number = first_frag_number
+    for segment, fragments_count in _segment_runs(boot_info):
+        if skip >= fragments_count:
+            # Whole runs are skipped without enumerating their fragments
+            skip -= fragments_count
+        else:
+            for i in range(skip, fragments_count):
+                yield segment, frag_number + i
+            skip = 0
+        frag_number += fragments_count
 
-    return res
+
+def build_fragments_list(boot_info):
+    """ Return a list of (segment, fragment) for each fragment in the video """
+    return list(iter_fragments(boot_info))
 
 
 def write_unsigned_int(stream, val):
@@ -263,6 +293,10 @@ class F4mFD(FragmentFD):
 
     FD_NAME = 'f4m'
 
+    # The latest bootstrap downloaded from the bootstrap URL, raw and parsed
+    _last_bootstrap = None
+    _last_boot_info = None
+
     def _get_unencrypted_media(self, doc):
         media = doc.findall(_add_ns('media'))
         if not media:
@@ -280,15 +314,23 @@ class F4mFD(FragmentFD):
 
     def _get_bootstrap_from_url(self, bootstrap_url):
         bootstrap = self.ydl.urlopen(bootstrap_url).read()
-        return read_bootstrap_info(bootstrap)
+        self._last_bootstrap = bootstrap
+        self._last_boot_info = read_bootstrap_info(bootstrap)
+        return self._last_boot_info
 
     def _update_live_fragments(self, bootstrap_url, latest_fragment):
         fragments_list = []
         retries = 30
         while (not fragments_list) and (retries > 0):
-            boot_info = self._get_bootstrap_from_url(bootstrap_url)
-            fragments_list = build_fragments_list(boot_info)
-            fragments_list = [f for f in fragments_list if f[1] > latest_fragment]
+            bootstrap = self.ydl.urlopen(bootstrap_url).read()
+            # An unchanged bootstrap is not parsed again. It may still list
+            # fragments after the latest one, e.g. when a fragment was
+            # unavailable and the following ones have not been downloaded
+            if bootstrap != self._last_bootstrap:
+                self._last_bootstrap = bootstrap
+                self._last_boot_info = read_bootstrap_info(bootstrap)
+            fragments_list = list(iter_fragments(
+                self._last_boot_info, after=latest_fragment))
             if not fragments_list:
                 # Retry after a while
                 time.sleep(5.0)
@@ -353,12 +395,13 @@ class F4mFD(FragmentFD):
         else:
             metadata = None
 
-        fragments_list = build_fragments_list(boot_info)
+        fragments_list = iter_fragments(boot_info)
+        total_frags = count_fragments(boot_info)
         test = self.params.get('test', False)
         if test:
             # We only download the first fragment
-            fragments_list = fragments_list[:1]
-        total_frags = len(fragments_list)
+            fragments_list = itertools.islice(fragments_list, 1)
+            total_frags = min(total_frags, 1)
         # For some akamai manifests we'll need to add a query to the fragment url
         akamai_pv = xpath_text(doc, _add_ns('pv-2.0'))
 
@@ -381,12 +424,7 @@ class F4mFD(FragmentFD):
 
         self._start_frag_download(ctx)
 
-        frag_index = 0
-        while fragments_list:
-            seg_i, frag_i = fragments_list.pop(0)
-            frag_index += 1
-            if frag_index <= ctx['fragment_index']:
-                continue
+        def fragment_url(seg_i, frag_i):
             name = 'Seg%d-Frag%d' % (seg_i, frag_i)
             query = []
             if base_url_parsed.query:
@@ -396,26 +434,48 @@ class F4mFD(FragmentFD):
             if info_dict.get('extra_param_to_segment_url'):
                 query.append(info_dict['extra_param_to_segment_url'])
             url_parsed = base_url_parsed._replace(path=base_url_parsed.path + name, query='&'.join(query))
+            return url_parsed.geturl()
+
+        def extract_mdat(down_data, fragment=None):
+            reader = FlvReader(down_data)
+            while True:
+                try:
+                    box_type, payload_start, payload_end = reader.read_box_info()
+                except DataTruncatedError:
+                    if test:
+                        # In tests, segments may be truncated, and thus
+                        # FlvReader may not be able to parse the whole
+                        # chunk. If so, write the segment as is
+                        # See https://github.com/ytdl-org/youtube-dl/issues/9214
+                        return down_data
+                    raise
+                if box_type == b'mdat':
+                    return down_data[payload_start:payload_end]
+
+        if not live:
+            fragments = ({
+                'frag_index': frag_index,
+                'url': fragment_url(seg_i, frag_i),
+                # A missing fragment would leave a hole in the FLV stream
+                'fatal': True,
+            } for frag_index, (seg_i, frag_i) in enumerate(fragments_list, 1))
+            if not self.download_and_append_fragments(ctx, fragments, info_dict, extract_mdat):
+                return False
+            fragments_list = []
+        else:
+            fragments_list = list(fragments_list)
+
+        frag_index = 0
+        while fragments_list:
+            seg_i, frag_i = fragments_list.pop(0)
+            frag_index += 1
+            if frag_index <= ctx['fragment_index']:
+                continue
             try:
-                success, down_data = self._download_fragment(ctx, url_parsed.geturl(), info_dict)
+                success, down_data = self._download_fragment(ctx, fragment_url(seg_i, frag_i), info_dict)
                 if not success:
                     return False
-                reader = FlvReader(down_data)
-                while True:
-                    try:
-                        _, box_type, box_data = reader.read_box_info()
-                    except DataTruncatedError:
-                        if test:
-                            # In tests, segments may be truncated, and thus
-                            # FlvReader may not be able to parse the whole
-                            # chunk. If so, write the segment as is
-                            # See https://github.com/ytdl-org/youtube-dl/issues/9214
-                            dest_stream.write(down_data)
-                            break
-                        raise
-                    if box_type == b'mdat':
-                        self._append_fragment(ctx, box_data)
-                        break
+                self._append_fragment(ctx, extract_mdat(down_data))
             except (compat_urllib_error.HTTPError, ) as err:
                 if live and (err.code == 404 or err.code == 410):
                     # We didn't keep up with the live window. Continue
@@ -1,14 +1,19 @@
 from __future__ import division, unicode_literals
 
+import io
 import os
+import threading
 import time
 import json
 
 from .common import FileDownloader
 from .http import HttpFD
+from ..compat import compat_urllib_error
 from ..utils import (
+    DownloadError,
     error_to_compat_str,
     encodeFilename,
+    format_bytes,
     sanitize_open,
     sanitized_Request,
 )
@@ -25,12 +30,18 @@ class FragmentFD(FileDownloader):
 
     Available options:
 
-    fragment_retries:   Number of times to retry a fragment for HTTP error (DASH
-                        and hlsnative only)
+    fragment_retries:   Number of times to retry a fragment for HTTP error (DASH,
+                        hlsnative, ISM and f4m, except for f4m live streams)
     skip_unavailable_fragments:
-                        Skip unavailable fragments (DASH and hlsnative only)
+                        Skip unavailable fragments (DASH, hlsnative and ISM;
+                        f4m downloads are aborted instead)
     keep_fragments:     Keep downloaded fragments on disk after downloading is
-                        finished
+                        finished (otherwise fragments are downloaded to memory
+                        and never written to disk on their own)
+    concurrent_fragment_downloads:
+                        Number of fragments to download in parallel (DASH,
+                        hlsnative, ISM and f4m; live streams are always
+                        downloaded sequentially)
 
     For each incomplete fragment download youtube-dl keeps on disk a special
     bookkeeping file with download state and metadata (in future such files will
@@ -49,6 +60,9 @@ class FragmentFD(FileDownloader):
                 index:  0-based index of current fragment among all fragments
             fragment_count:
                 Total count of fragments
+            extra:
+                Dictionary of data specific to the downloader (e.g. whether
+                the ISM downloader already wrote the PIFF header)
 
     This feature is experimental and file format may change in future.
     """
@@ -77,7 +91,9 @@ class FragmentFD(FileDownloader):
         assert 'ytdl_corrupt' not in ctx
         stream, _ = sanitize_open(self.ytdl_filename(ctx['filename']), 'r')
         try:
-            ctx['fragment_index'] = json.loads(stream.read())['downloader']['current_fragment']['index']
+            downloader = json.loads(stream.read())['downloader']
+            ctx['fragment_index'] = downloader['current_fragment']['index']
+            ctx['ytdl_extra'] = downloader.get('extra') or {}
         except Exception:
             ctx['ytdl_corrupt'] = True
         finally:
@@ -92,24 +108,35 @@ class FragmentFD(FileDownloader):
         }
         if ctx.get('fragment_count') is not None:
             downloader['fragment_count'] = ctx['fragment_count']
+        if ctx.get('ytdl_extra'):
+            downloader['extra'] = ctx['ytdl_extra']
         frag_index_stream.write(json.dumps({'downloader': downloader}))
         frag_index_stream.close()
 
     def _download_fragment(self, ctx, frag_url, info_dict, headers=None):
-        fragment_filename = '%s-Frag%d' % (ctx['tmpfilename'], ctx['fragment_index'])
         fragment_info_dict = {
             'url': frag_url,
             'http_headers': headers or info_dict.get('http_headers'),
         }
-        success = ctx['dl'].download(fragment_filename, fragment_info_dict)
-        if not success:
-            return False, None
+        if self.params.get('keep_fragments', False):
+            fragment_filename = '%s-Frag%d' % (ctx['tmpfilename'], ctx['fragment_index'])
+            success = ctx['dl'].download(fragment_filename, fragment_info_dict)
+            if not success:
+                return False, None
+            down, frag_sanitized = sanitize_open(fragment_filename, 'rb')
+            ctx['fragment_filename_sanitized'] = frag_sanitized
+            frag_content = down.read()
+            down.close()
+        else:
+            # Fragments that are not to be kept are never written to disk
+            frag_stream = io.BytesIO()
+            success = ctx['dl'].download(frag_stream, fragment_info_dict)
+            if not success:
+                return False, None
+            ctx['fragment_filename_sanitized'] = None
+            frag_content = frag_stream.getvalue()
         if fragment_info_dict.get('filetime'):
             ctx['fragment_filetime'] = fragment_info_dict.get('filetime')
-        down, frag_sanitized = sanitize_open(fragment_filename, 'rb')
-        ctx['fragment_filename_sanitized'] = frag_sanitized
-        frag_content = down.read()
-        down.close()
         return True, frag_content
 
     def _append_fragment(self, ctx, frag_content):
@@ -119,10 +146,25 @@ class FragmentFD(FileDownloader):
         finally:
             if self.__do_ytdl_file(ctx):
                 self._write_ytdl_file(ctx)
-            if not self.params.get('keep_fragments', False):
-                os.remove(encodeFilename(ctx['fragment_filename_sanitized']))
+            if ctx['fragment_filename_sanitized'] is None:
+                ctx['in_memory_frags'] = ctx.get('in_memory_frags', 0) + 1
+                ctx['in_memory_frags_bytes'] = ctx.get('in_memory_frags_bytes', 0) + len(frag_content)
             del ctx['fragment_filename_sanitized']
 
+    def _make_frag_downloader(self):
+        return HttpQuietDownloader(
+            self.ydl,
+            {
+                'continuedl': True,
+                'quiet': True,
+                'noprogress': True,
+                'ratelimit': self.params.get('ratelimit'),
+                'retries': self.params.get('retries', 0),
+                'nopart': self.params.get('nopart', False),
+                'test': self.params.get('test', False),
+            }
+        )
+
     def _prepare_frag_download(self, ctx):
         if 'live' not in ctx:
             ctx['live'] = False
@@ -136,18 +178,7 @@ class FragmentFD(FileDownloader):
         self.to_screen(
             '[%s] Total fragments: %s' % (self.FD_NAME, total_frags_str))
         self.report_destination(ctx['filename'])
-        dl = HttpQuietDownloader(
-            self.ydl,
-            {
-                'continuedl': True,
-                'quiet': True,
-                'noprogress': True,
-                'ratelimit': self.params.get('ratelimit'),
-                'retries': self.params.get('retries', 0),
-                'nopart': self.params.get('nopart', False),
-                'test': self.params.get('test', False),
-            }
-        )
+        dl = self._make_frag_downloader()
         tmpfilename = self.temp_name(ctx['filename'])
         open_mode = 'wb'
         resume_len = 0
@@ -161,6 +192,7 @@ class FragmentFD(FileDownloader):
         ctx.update({
             'tmpfilename': tmpfilename,
             'fragment_index': 0,
+            'ytdl_extra': {},
         })
 
         if self.__do_ytdl_file(ctx):
@@ -175,6 +207,7 @@ class FragmentFD(FileDownloader):
                     self.report_warning(
                         '%s. Restarting from the beginning...' % message)
                     ctx['fragment_index'] = resume_len = 0
+                    ctx['ytdl_extra'] = {}
                     if 'ytdl_corrupt' in ctx:
                         del ctx['ytdl_corrupt']
                     self._write_ytdl_file(ctx)
@@ -209,48 +242,62 @@ class FragmentFD(FileDownloader):
         start = time.time()
         ctx.update({
             'started': start,
-            # Amount of fragment's bytes downloaded by the time of the previous
-            # frag progress hook invocation
-            'prev_frag_downloaded_bytes': 0,
+            # Amount of each fragment's bytes downloaded by the time of the
+            # previous frag progress hook invocation, keyed by fragment filename
+            'prev_frag_downloaded_bytes': {},
         })
+        # Fragments may be downloaded by several threads at once
+        progress_lock = threading.Lock()
 
         def frag_progress_hook(s):
             if s['status'] not in ('downloading', 'finished'):
                 return
 
-            time_now = time.time()
-            state['elapsed'] = time_now - start
-            frag_total_bytes = s.get('total_bytes') or 0
-            if not ctx['live']:
-                estimated_size = (
-                    (ctx['complete_frags_downloaded_bytes'] + frag_total_bytes)
-                    / (state['fragment_index'] + 1) * total_frags)
-                state['total_bytes_estimate'] = estimated_size
-
-            if s['status'] == 'finished':
-                state['fragment_index'] += 1
-                ctx['fragment_index'] = state['fragment_index']
-                state['downloaded_bytes'] += frag_total_bytes - ctx['prev_frag_downloaded_bytes']
-                ctx['complete_frags_downloaded_bytes'] = state['downloaded_bytes']
-                ctx['prev_frag_downloaded_bytes'] = 0
-            else:
-                frag_downloaded_bytes = s['downloaded_bytes']
-                state['downloaded_bytes'] += frag_downloaded_bytes - ctx['prev_frag_downloaded_bytes']
+            with progress_lock:
+                time_now = time.time()
+                state['elapsed'] = time_now - start
+                frag_total_bytes = s.get('total_bytes') or 0
+                prev_frag_downloaded_bytes = ctx['prev_frag_downloaded_bytes'].get(s['filename'], 0)
                 if not ctx['live']:
-                    state['eta'] = self.calc_eta(
-                        start, time_now, estimated_size - resume_len,
-                        state['downloaded_bytes'] - resume_len)
-                state['speed'] = s.get('speed') or ctx.get('speed')
-                ctx['speed'] = state['speed']
-                ctx['prev_frag_downloaded_bytes'] = frag_downloaded_bytes
-            self._hook_progress(state)
+                    estimated_size = (
+                        (ctx['complete_frags_downloaded_bytes'] + frag_total_bytes)
+                        / (state['fragment_index'] + 1) * total_frags)
+                    state['total_bytes_estimate'] = estimated_size
+
+                if s['status'] == 'finished':
+                    state['fragment_index'] += 1
+                    if not ctx.get('concurrent'):
+                        ctx['fragment_index'] = state['fragment_index']
+                    state['downloaded_bytes'] += frag_total_bytes - prev_frag_downloaded_bytes
+                    ctx['complete_frags_downloaded_bytes'] = state['downloaded_bytes']
+                    ctx['prev_frag_downloaded_bytes'].pop(s['filename'], None)
+                else:
+                    frag_downloaded_bytes = s['downloaded_bytes']
+                    state['downloaded_bytes'] += frag_downloaded_bytes - prev_frag_downloaded_bytes
+                    if not ctx['live']:
+                        state['eta'] = self.calc_eta(
+                            start, time_now, estimated_size - resume_len,
+                            state['downloaded_bytes'] - resume_len)
+                    state['speed'] = s.get('speed') or ctx.get('speed')
+                    ctx['speed'] = state['speed']
+                    ctx['prev_frag_downloaded_bytes'][s['filename']] = frag_downloaded_bytes
+                self._hook_progress(state)
 
         ctx['dl'].add_progress_hook(frag_progress_hook)
+        ctx['frag_progress_hook'] = frag_progress_hook
 
         return start
 
     def _finish_frag_download(self, ctx):
         ctx['dest_stream'].close()
+        if self.params.get('verbose', False) and ctx.get('in_memory_frags'):
+            # Each on-disk fragment costs creating, renaming, reopening and
+            # removing a temporary file, and writing its data one extra time
+            self.to_screen(
+                '[debug] %s: %d fragments were kept in memory, avoided %d '
+                'temporary file operations and %s of extra disk I/O' % (
+                    self.FD_NAME, ctx['in_memory_frags'], ctx['in_memory_frags'] * 4,
+                    format_bytes(ctx['in_memory_frags_bytes'] * 2)))
         if self.__do_ytdl_file(ctx):
             ytdl_filename = encodeFilename(self.ytdl_filename(ctx['filename']))
             if os.path.isfile(ytdl_filename):
@@ -277,3 +324,184 @@ class FragmentFD(FileDownloader):
             'status': 'finished',
             'elapsed': elapsed,
         })
+
+    def download_and_append_fragments(self, ctx, fragments, info_dict, pack_func=None, prefetch=0):
+        """
+        Download fragments and append them to the destination in order.
+
+        fragments is an iterable of dicts with the following keys:
+        frag_index: 1-based index of the fragment (used for resuming)
+        url:        URL of the fragment
+        headers:    (optional) HTTP headers to use instead of the ones
+                    from info_dict
+        fatal:      (optional) Abort the download if this fragment is
+                    unavailable regardless of skip_unavailable_fragments
+
+        pack_func(frag_content, fragment), if given, is called in the
+        appending thread and its return value is appended instead of the
+        raw fragment content.
+
+        prefetch is the number of fragments that may be downloaded ahead of
+        the one being appended. If it is not 0, fragments are downloaded in
+        another thread even without concurrent_fragment_downloads so that
+        downloading and appending overlap.
+
+        Returns True on success and False otherwise.
+        """
+        fragment_retries = self.params.get('fragment_retries', 0)
+        skip_unavailable_fragments = self.params.get('skip_unavailable_fragments', True)
+
+        def download_fragment(fragment, frag_ctx):
+            """Returns (status, frag_content), status being one of 'ok',
+            'skip' (unavailable and skipped), 'giveup' (unavailable and
+            fatal) and 'fail'"""
+            frag_index = fragment['frag_index']
+            fatal = fragment.get('fatal') or not skip_unavailable_fragments
+            count = 0
+            while count <= fragment_retries:
+                try:
+                    success, frag_content = self._download_fragment(
+                        frag_ctx, fragment['url'], info_dict, fragment.get('headers'))
+                    if not success:
+                        return 'fail', None
+                    return 'ok', frag_content
+                except compat_urllib_error.HTTPError as err:
+                    # Unavailable (possibly temporary) fragments may be served.
+                    # First we try to retry then either skip or abort.
+                    # See https://github.com/ytdl-org/youtube-dl/issues/10165,
+                    # https://github.com/ytdl-org/youtube-dl/issues/10448).
+                    count += 1
+                    if count <= fragment_retries:
+                        self.report_retry_fragment(err, frag_index, count, fragment_retries)
+                except DownloadError:
+                    # Don't retry fragment if error occurred during HTTP downloading
+                    # itself since it has own retry settings
+                    if fatal:
+                        raise
+                    break
+            if fatal:
+                return 'giveup', None
+            self.report_skip_fragment(frag_index)
+            return 'skip', None
+
+        def append_fragment(fragment, frag_ctx, status, frag_content):
+            if status == 'giveup':
+                self.report_error(
+                    'giving up after %s fragment retries' % fragment_retries)
+                return False
+            if status != 'ok':
+                return status == 'skip'
+            if frag_ctx.get('fragment_filetime'):
+                ctx['fragment_filetime'] = frag_ctx['fragment_filetime']
+            if pack_func:
+                frag_content = pack_func(frag_content, fragment)
+            ctx['fragment_index'] = fragment['frag_index']
+            ctx['fragment_filename_sanitized'] = frag_ctx['fragment_filename_sanitized']
+            self._append_fragment(ctx, frag_content)
+            return True
+
+        max_workers = self.params.get('concurrent_fragment_downloads') or 1
+        if (max_workers > 1 or prefetch) and not ctx['live']:
+            return self._download_fragments_concurrently(
+                ctx, fragments, download_fragment, append_fragment, max_workers,
+                max(prefetch, max_workers * 2))
+
+        for fragment in fragments:
+            if fragment['frag_index'] <= ctx['fragment_index']:
+                continue
+            status, frag_content = download_fragment(fragment, ctx)
+            if not append_fragment(fragment, ctx, status, frag_content):
+                return False
+        return True
+
+    def _download_fragments_concurrently(self, ctx, fragments, download_fragment, append_fragment, max_workers, buffer_size):
+        # Workers download fragments ahead of the one being appended. At most
+        # buffer_size fragments may be downloaded and waiting to be appended
+        # so that memory usage stays bounded.
+        cond = threading.Condition()
+        fragments_iter = iter(fragments)
+        results = {}
+        sched = {
+            'next': 0,  # Position of the next fragment to be scheduled
+            'appended': 0,  # Position of the next fragment to be appended
+            'total': None,  # Total number of fragments once known
+            'stop': False,
+        }
+        ctx['concurrent'] = True
+
+        def next_fragment():
+            with cond:
+                while True:
+                    if sched['stop'] or sched['total'] is not None:
+                        return None, None
+                    if sched['next'] < sched['appended'] + buffer_size:
+                        break
+                    cond.wait()
+                for fragment in fragments_iter:
+                    if fragment['frag_index'] > ctx['fragment_index']:
+                        break
+                else:
+                    sched['total'] = sched['next']
+                    cond.notify_all()
+                    return None, None
+                pos = sched['next']
+                sched['next'] += 1
+                return pos, fragment
+
+        def worker():
+            frag_ctx = dict(ctx)
+            frag_ctx['dl'] = self._make_frag_downloader()
+            frag_ctx['dl'].add_progress_hook(ctx['frag_progress_hook'])
+            while True:
+                pos, fragment = next_fragment()
+                if fragment is None:
+                    return
+                frag_ctx['fragment_index'] = fragment['frag_index'] - 1
+                try:
+                    status, frag_content = download_fragment(fragment, frag_ctx)
+                    result = (fragment, dict(frag_ctx), status, frag_content, None)
+                except Exception as err:
+                    result = (fragment, None, 'error', None, err)
+                with cond:
+                    results[pos] = result
+                    cond.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(max_workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        def stop_workers():
+            with cond:
+                sched['stop'] = True
+                cond.notify_all()
+            ctx['concurrent'] = False
+
+        try:
+            while True:
+                with cond:
+                    pos = sched['appended']
+                    while pos not in results and pos != sched['total']:
+                        # Waiting with a timeout keeps the main thread
+                        # interruptible on Python 2
+                        cond.wait(1)
+                    if pos == sched['total']:
+                        break
+                    fragment, frag_ctx, status, frag_content, err = results.pop(pos)
+                if err is not None:
+                    raise err
+                if not append_fragment(fragment, frag_ctx, status, frag_content):
+                    stop_workers()
+                    return False
+                with cond:
+                    sched['appended'] += 1
+                    cond.notify_all()
+        except BaseException:
+            # Do not wait for the fragments being downloaded, worker threads
+            # are daemonic
+            stop_workers()
+            raise
+        stop_workers()
+        for t in threads:
+            t.join()
+        return True
@@ -1,23 +1,26 @@
 from __future__ import unicode_literals
 
-import re
-import binascii
-try:
-    from Crypto.Cipher import AES
-    can_decrypt_frag = True
-except ImportError:
-    can_decrypt_frag = False
+import socket
+import time
 
 from .fragment import FragmentFD
 from .external import FFmpegFD
 
+from ..aes import (
+    AES_BACKEND,
+    aes_cbc_decrypt_bytes,
+)
 from ..compat import (
     compat_urllib_error,
     compat_urlparse,
     compat_struct_pack,
 )
+from ..m3u8 import (
+    M3U8Playlist,
+    parse_m3u8_playlist,
+)
 from ..utils import (
-    parse_m3u8_attributes,
+    error_to_compat_str,
     update_url_query,
 )
 
@@ -27,45 +30,99 @@ class HlsFD(FragmentFD):
 
     FD_NAME = 'hlsnative'
 
-    @staticmethod
-    def can_download(manifest, info_dict):
-        UNSUPPORTED_FEATURES = (
-            r'#EXT-X-KEY:METHOD=(?!NONE|AES-128)',  # encrypted streams [1]
-            # r'#EXT-X-BYTERANGE',  # playlists composed of byte ranges of media files [2]
-
-            # Live streams heuristic does not always work (e.g. geo restricted to Germany
-            # http://hls-geo.daserste.de/i/videoportal/Film/c_620000/622873/format,716451,716457,716450,716458,716459,.mp4.csmil/index_4_av.m3u8?null=0)
-            # r'#EXT-X-MEDIA-SEQUENCE:(?!0$)',  # live streams [3]
-
-            # This heuristic also is not correct since segments may not be appended as well.
-            # Twitch vods of finished streams have EXT-X-PLAYLIST-TYPE:EVENT despite
-            # no segments will definitely be appended to the end of the playlist.
-            # r'#EXT-X-PLAYLIST-TYPE:EVENT',  # media segments may be appended to the end of
-            #                                 # event media playlists [4]
-
-            # 1. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.2.4
-            # 2. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.2.2
-            # 3. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.3.2
-            # 4. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.3.5
-        )
-        check_results = [not re.search(feature, manifest) for feature in UNSUPPORTED_FEATURES]
-        is_aes128_enc = '#EXT-X-KEY:METHOD=AES-128' in manifest
-        check_results.append(can_decrypt_frag or not is_aes128_enc)
-        check_results.append(not (is_aes128_enc and r'#EXT-X-BYTERANGE' in manifest))
-        check_results.append(not info_dict.get('is_live'))
-        return all(check_results)
-
-    def real_download(self, filename, info_dict):
-        man_url = info_dict['url']
-        self.to_screen('[%s] Downloading m3u8 manifest' % self.FD_NAME)
+    # Number of the most recent segments a live download starts with
+    _LIVE_WINDOW = 3
+    # Playlist reload interval of live streams without #EXT-X-TARGETDURATION
+    _LIVE_TARGET_DURATION = 10
 
+    @staticmethod
+    def can_download(manifest, info_dict, allow_live=False):
+        # Live streams heuristic does not always work (e.g. geo restricted to Germany
+        # http://hls-geo.daserste.de/i/videoportal/Film/c_620000/622873/format,716451,716457,716450,716458,716459,.mp4.csmil/index_4_av.m3u8?null=0)
+        # thus the media sequence number is not checked [1], nor the playlist
+        # type, since segments may not be appended as well: Twitch vods of
+        # finished streams have EXT-X-PLAYLIST-TYPE:EVENT despite no segments
+        # will definitely be appended to the end of the playlist [2].
+        # Encrypted streams are supported for AES-128 only [3], and not
+        # when the segments are byte ranges [4].
+        # 1. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.3.2
+        # 2. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.3.5
+        # 3. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.2.4
+        # 4. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.2.2
+        if not isinstance(manifest, M3U8Playlist):
+            manifest = parse_m3u8_playlist(manifest, info_dict.get('url') or '')
+        key_methods = manifest.key_methods - set(['NONE'])
+        return (
+            key_methods <= set(['AES-128'])
+            and not (key_methods and manifest.has_byte_range)
+            and (allow_live or not info_dict.get('is_live')))
+
+    def _live_enabled(self):
+        return bool(self.params.get('live_from_start') or self.params.get('live_window'))
+
+    def _fetch_playlist(self, info_dict, man_url):
         urlh = self.ydl.urlopen(self._prepare_url(info_dict, man_url))
-        man_url = urlh.geturl()
-        s = urlh.read().decode('utf-8', 'ignore')
+        return parse_m3u8_playlist(urlh.read().decode('utf-8', 'ignore'), urlh.geturl())
 
-        if not self.can_download(s, info_dict):
+    @staticmethod
+    def _extra_query(info_dict):
+        extra_param_to_segment_url = info_dict.get('extra_param_to_segment_url')
+        if extra_param_to_segment_url:
+            return compat_urlparse.parse_qs(extra_param_to_segment_url)
+
+    def _build_fragments(self, playlist, info_dict):
+        """Returns the fragments of the non-ad segments of the playlist"""
+        extra_query = self._extra_query(info_dict)
+        fragments = []
+        headers = info_dict.get('http_headers')
+        for segment in playlist.segments:
+            if segment.ad:
+                continue
+            frag_url = segment.url
+            if extra_query:
+                frag_url = update_url_query(frag_url, extra_query)
+            frag_headers = headers
+            if segment.byte_range:
+                frag_headers = dict(headers or {})
+                frag_headers['Range'] = 'bytes=%d-%d' % (segment.byte_range[0], segment.byte_range[1] - 1)
+            fragments.append({
+                'frag_index': len(fragments) + 1,
+                'url': frag_url,
+                'headers': frag_headers,
+                'decrypt_info': segment.key,
+                'media_sequence': segment.media_sequence,
+            })
+        return fragments
+
+    def _decrypt_fragment_func(self, info_dict):
+        extra_query = self._extra_query(info_dict)
+
+        def decrypt_fragment(frag_content, fragment):
+            decrypt_info = fragment['decrypt_info']
+            if decrypt_info['METHOD'] != 'AES-128':
+                return frag_content
+            iv = decrypt_info.get('IV') or compat_struct_pack('>8xq', fragment['media_sequence'])
+            if not decrypt_info.get('KEY'):
+                key_url = info_dict.get('_decryption_key_url') or decrypt_info['URI']
+                if extra_query:
+                    key_url = update_url_query(key_url, extra_query)
+                decrypt_info['KEY'] = self.ydl.urlopen(self._prepare_url(info_dict, key_url)).read()
+            return aes_cbc_decrypt_bytes(frag_content, decrypt_info['KEY'], iv)
+        return decrypt_fragment
+
+    def real_download(self, filename, info_dict):
+        # The extractor may have already downloaded and parsed the playlist,
+        # it can only be reused if it is complete: by now the segments of a
+        # live stream may have left its window or their URLs have expired
+        playlist = info_dict.get('m3u8_playlist')
+        if playlist is None or info_dict.get('is_live') or not playlist.endlist:
+            self.to_screen('[%s] Downloading m3u8 manifest' % self.FD_NAME)
+            playlist = self._fetch_playlist(info_dict, info_dict['url'])
+
+        if not self.can_download(playlist, info_dict, allow_live=self._live_enabled()):
             if info_dict.get('extra_param_to_segment_url') or info_dict.get('_decryption_key_url'):
-                self.report_error('pycrypto not found. Please install it.')
+                self.report_error('hlsnative does not support the features of this stream '
+                                  'and they cannot be delegated to ffmpeg')
                 return False
             self.report_warning(
                 'hlsnative has detected features it does not support, '
@@ -75,135 +132,103 @@ class HlsFD(FragmentFD):
                 fd.add_progress_hook(ph)
             return fd.real_download(filename, info_dict)
 
-        def is_ad_fragment_start(s):
-            return (s.startswith('#ANVATO-SEGMENT-INFO') and 'type=ad' in s
-                    or s.startswith('#UPLYNK-SEGMENT') and s.endswith(',ad'))
+        if self.params.get('verbose', False) and 'AES-128' in playlist.key_methods:
+            self.to_screen(
+                '[debug] %s: decrypting fragments with the %s AES implementation'
+                % (self.FD_NAME, AES_BACKEND))
 
-        def is_ad_fragment_end(s):
-            return (s.startswith('#ANVATO-SEGMENT-INFO') and 'type=master' in s
-                    or s.startswith('#UPLYNK-SEGMENT') and s.endswith(',segment'))
+        if info_dict.get('is_live'):
+            return self._download_live(filename, info_dict, playlist)
 
-        media_frags = 0
-        ad_frags = 0
-        ad_frag_next = False
-        for line in s.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith('#'):
-                if is_ad_fragment_start(line):
-                    ad_frag_next = True
-                elif is_ad_fragment_end(line):
-                    ad_frag_next = False
-                continue
-            if ad_frag_next:
-                ad_frags += 1
-                continue
-            media_frags += 1
+        fragments = self._build_fragments(playlist, info_dict)
 
         ctx = {
             'filename': filename,
-            'total_frags': media_frags,
-            'ad_frags': ad_frags,
+            'total_frags': len(fragments),
+            'ad_frags': playlist.ad_segment_count,
         }
 
         self._prepare_and_start_frag_download(ctx)
 
+        # We only download the first fragment during the test
+        if self.params.get('test', False):
+            fragments = fragments[:1]
+
+        if not self.download_and_append_fragments(
+                ctx, fragments, info_dict, self._decrypt_fragment_func(info_dict)):
+            return False
+
+        self._finish_frag_download(ctx)
+
+        return True
+
+    def _download_live(self, filename, info_dict, playlist):
+        """Follow a live media playlist until #EXT-X-ENDLIST or until the
+        download is interrupted, downloading the segments as they appear"""
+        live_from_start = self.params.get('live_from_start', False)
+        live_window = self.params.get('live_window') or self._LIVE_WINDOW
         fragment_retries = self.params.get('fragment_retries', 0)
-        skip_unavailable_fragments = self.params.get('skip_unavailable_fragments', True)
-        test = self.params.get('test', False)
+        decrypt_fragment = self._decrypt_fragment_func(info_dict)
 
-        extra_query = None
-        extra_param_to_segment_url = info_dict.get('extra_param_to_segment_url')
-        if extra_param_to_segment_url:
-            extra_query = compat_urlparse.parse_qs(extra_param_to_segment_url)
-        i = 0
-        media_sequence = 0
-        decrypt_info = {'METHOD': 'NONE'}
-        byte_range = {}
+        ctx = {
+            'filename': filename,
+            'total_frags': None,
+            'live': True,
+        }
+        self._prepare_and_start_frag_download(ctx)
+
+        # Segments are identified by their media sequence number, which
+        # only grows: only the last downloaded one needs to be remembered
+        last_sequence = None
         frag_index = 0
-        ad_frag_next = False
-        for line in s.splitlines():
-            line = line.strip()
-            if line:
-                if not line.startswith('#'):
-                    if ad_frag_next:
-                        continue
+        try:
+            while True:
+                fetched = time.time()
+                fragments = self._build_fragments(playlist, info_dict)
+                if last_sequence is None:
+                    if not live_from_start:
+                        fragments = fragments[-live_window:]
+                else:
+                    fragments = [f for f in fragments if f['media_sequence'] > last_sequence]
+                if self.params.get('test', False):
+                    fragments = fragments[:1]
+                for fragment in fragments:
                     frag_index += 1
-                    if frag_index <= ctx['fragment_index']:
-                        continue
-                    frag_url = (
-                        line
-                        if re.match(r'^https?://', line)
-                        else compat_urlparse.urljoin(man_url, line))
-                    if extra_query:
-                        frag_url = update_url_query(frag_url, extra_query)
-                    count = 0
-                    headers = info_dict.get('http_headers', {})
-                    if byte_range:
-                        headers['Range'] = 'bytes=%d-%d' % (byte_range['start'], byte_range['end'] - 1)
-                    while count <= fragment_retries:
-                        try:
-                            success, frag_content = self._download_fragment(
-                                ctx, frag_url, info_dict, headers)
-                            if not success:
-                                return False
-                            break
-                        except compat_urllib_error.HTTPError as err:
-                            # Unavailable (possibly temporary) fragments may be served.
-                            # First we try to retry then either skip or abort.
-                            # See https://github.com/ytdl-org/youtube-dl/issues/10165,
-                            # https://github.com/ytdl-org/youtube-dl/issues/10448).
-                            count += 1
-                            if count <= fragment_retries:
-                                self.report_retry_fragment(err, frag_index, count, fragment_retries)
-                    if count > fragment_retries:
-                        if skip_unavailable_fragments:
-                            i += 1
-                            media_sequence += 1
-                            self.report_skip_fragment(frag_index)
-                            continue
-                        self.report_error(
-                            'giving up after %s fragment retries' % fragment_retries)
+                    fragment['frag_index'] = frag_index
+                if fragments:
+                    if not self.download_and_append_fragments(ctx, fragments, info_dict, decrypt_fragment):
                         return False
-                    if decrypt_info['METHOD'] == 'AES-128':
-                        iv = decrypt_info.get('IV') or compat_struct_pack('>8xq', media_sequence)
-                        decrypt_info['KEY'] = decrypt_info.get('KEY') or self.ydl.urlopen(
-                            self._prepare_url(info_dict, info_dict.get('_decryption_key_url') or decrypt_info['URI'])).read()
-                        frag_content = AES.new(
-                            decrypt_info['KEY'], AES.MODE_CBC, iv).decrypt(frag_content)
-                    self._append_fragment(ctx, frag_content)
-                    # We only download the first fragment during the test
-                    if test:
+                    last_sequence = fragments[-1]['media_sequence']
+                if playlist.endlist or self.params.get('test', False):
+                    break
+
+                target_duration = playlist.target_duration
+                if target_duration is None:
+                    target_duration = self._LIVE_TARGET_DURATION
+                # When the playlist has not changed, it should be reloaded
+                # after half the target duration (RFC 8216, section 6.3.4)
+                delay = target_duration if fragments else target_duration / 2
+                time.sleep(max(0, fetched + delay - time.time()))
+
+                count = 0
+                while True:
+                    try:
+                        playlist = self._fetch_playlist(info_dict, playlist.url)
                         break
-                    i += 1
-                    media_sequence += 1
-                elif line.startswith('#EXT-X-KEY'):
-                    decrypt_url = decrypt_info.get('URI')
-                    decrypt_info = parse_m3u8_attributes(line[11:])
-                    if decrypt_info['METHOD'] == 'AES-128':
-                        if 'IV' in decrypt_info:
-                            decrypt_info['IV'] = binascii.unhexlify(decrypt_info['IV'][2:].zfill(32))
-                        if not re.match(r'^https?://', decrypt_info['URI']):
-                            decrypt_info['URI'] = compat_urlparse.urljoin(
-                                man_url, decrypt_info['URI'])
-                        if extra_query:
-                            decrypt_info['URI'] = update_url_query(decrypt_info['URI'], extra_query)
-                        if decrypt_url != decrypt_info['URI']:
-                            decrypt_info['KEY'] = None
-                elif line.startswith('#EXT-X-MEDIA-SEQUENCE'):
-                    media_sequence = int(line[22:])
-                elif line.startswith('#EXT-X-BYTERANGE'):
-                    splitted_byte_range = line[17:].split('@')
-                    sub_range_start = int(splitted_byte_range[1]) if len(splitted_byte_range) == 2 else byte_range['end']
-                    byte_range = {
-                        'start': sub_range_start,
-                        'end': sub_range_start + int(splitted_byte_range[0]),
-                    }
-                elif is_ad_fragment_start(line):
-                    ad_frag_next = True
-                elif is_ad_fragment_end(line):
-                    ad_frag_next = False
+                    except (compat_urllib_error.URLError, socket.error) as err:
+                        count += 1
+                        if count > fragment_retries:
+                            self.report_warning(
+                                'Unable to refresh the playlist (%s), stopping the download'
+                                % error_to_compat_str(err))
+                            playlist = None
+                            break
+                        self.report_retry_fragment(err, frag_index + 1, count, fragment_retries)
+                if playlist is None:
+                    break
+        except KeyboardInterrupt:
+            # Keep what has been recorded so far
+            self.to_screen('\n[%s] Interrupted by user, stopping the download' % self.FD_NAME)
 
         self._finish_frag_download(ctx)
 
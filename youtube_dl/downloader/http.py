@@ -1,8 +1,10 @@
 from __future__ import unicode_literals
 
 import errno
+import json
 import os
 import socket
+import threading
 import time
 import random
 import re
@@ -18,6 +20,7 @@ from ..utils import (
     int_or_none,
     sanitize_open,
     sanitized_Request,
+    timeconvert,
     write_xattr,
     XAttrMetadataError,
     XAttrUnavailableError,
@@ -25,6 +28,317 @@ from ..utils import (
 
 
 class HttpFD(FileDownloader):
+    # Minimum time between two progress reports while downloading, in seconds
+    _PROGRESS_INTERVAL = 0.1
+    # Minimum time between two records of the amount of data written to a
+    # preallocated file, in seconds
+    _PREALLOCATION_STATE_INTERVAL = 1
+
+    def _preallocate(self, stream, size):
+        """Reserve the space of the file on disk, returns whether it succeeded"""
+        if not hasattr(os, 'posix_fallocate'):
+            return False
+        try:
+            os.posix_fallocate(stream.fileno(), 0, size)
+        except (IOError, OSError) as err:
+            self.report_warning('unable to preallocate %d bytes: %s' % (size, err))
+            return False
+        return True
+
+    def _read_state(self, filename, key):
+        """Returns the state of kind key of an interrupted download or None"""
+        ytdl_filename = self.ytdl_filename(filename)
+        if not os.path.isfile(encodeFilename(ytdl_filename)):
+            return None
+        try:
+            stream, _ = sanitize_open(ytdl_filename, 'r')
+            try:
+                return json.loads(stream.read())['downloader'][key]
+            finally:
+                stream.close()
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_state(self, filename, key, state):
+        stream, _ = sanitize_open(self.ytdl_filename(filename), 'w')
+        try:
+            stream.write(json.dumps({'downloader': {key: state}}))
+        finally:
+            stream.close()
+
+    def _remove_state(self, filename):
+        try:
+            os.remove(encodeFilename(self.ytdl_filename(filename)))
+        except OSError:
+            pass
+
+    def _read_chunks_state(self, filename):
+        """Returns the state of an interrupted segmented download or None"""
+        state = self._read_state(filename, 'http_chunks')
+        try:
+            if isinstance(state['total'], int) and all(len(c) == 3 for c in state['chunks']):
+                return state
+        except (KeyError, TypeError):
+            pass
+        return None
+
+    def _write_chunks_state(self, filename, state):
+        self._write_state(filename, 'http_chunks', state)
+
+    def _read_preallocation_state(self, filename):
+        """Returns the number of bytes written to the preallocated file of an
+        interrupted download or None"""
+        state = self._read_state(filename, 'http_preallocated')
+        try:
+            written = state['written']
+        except (KeyError, TypeError):
+            return None
+        return written if isinstance(written, int) and written >= 0 else None
+
+    def _write_preallocation_state(self, filename, stream):
+        """Record the amount of data written to the preallocated stream,
+        once it is on disk"""
+        stream.flush()
+        os.fsync(stream.fileno())
+        self._write_state(filename, 'http_preallocated', {'written': stream.tell()})
+
+    def _probe_ranges(self, url, headers):
+        """Returns (total size, response headers) if byte ranges of url can
+        be requested, None otherwise"""
+        request = sanitized_Request(url, None, headers)
+        request.add_header('Range', 'bytes=0-0')
+        try:
+            data = self.ydl.urlopen(request)
+        except (compat_urllib_error.URLError, socket.error):
+            # Let the single connection download handle (and retry) errors
+            return None
+        try:
+            mobj = re.match(r'bytes 0-0/(\d+)$', data.headers.get('Content-Range') or '')
+            if not mobj:
+                return None
+            return int(mobj.group(1)), data.info()
+        finally:
+            data.close()
+
+    def _download_chunk(self, url, headers, stream, chunk, status, cond):
+        """Download the missing part of chunk ([start, end, downloaded bytes])
+        and write it at its position in stream"""
+        retries = self.params.get('retries', 0)
+        count = 0
+        block_size = self.params.get('buffersize', 1024)
+        while True:
+            offset = chunk[0] + chunk[2]
+            end = chunk[1]
+            request = sanitized_Request(url, None, headers)
+            request.add_header('Range', 'bytes=%d-%d' % (offset, end))
+            try:
+                data = self.ydl.urlopen(request)
+                try:
+                    content_range = data.headers.get('Content-Range') or ''
+                    if not re.match(r'bytes %d-' % offset, content_range):
+                        raise ContentTooShortError(0, end - offset + 1)
+                    stream.seek(offset)
+                    while offset <= end:
+                        if status['stop']:
+                            return
+                        before = time.time()
+                        data_block = data.read(min(block_size, end - offset + 1))
+                        if not data_block:
+                            raise ContentTooShortError(
+                                offset - chunk[0], end - chunk[0] + 1)
+                        written = 0
+                        while written < len(data_block):
+                            # Unbuffered writes may be partial on Python 3
+                            n = stream.write(data_block[written:])
+                            written += len(data_block) if n is None else n
+                        offset += len(data_block)
+                        with cond:
+                            chunk[2] += len(data_block)
+                            status['downloaded'] += len(data_block)
+                        self.slow_down(status['start'], None, status['downloaded'] - status['resumed'])
+                        if not self.params.get('noresizebuffer', False):
+                            block_size = self.best_block_size(time.time() - before, len(data_block))
+                finally:
+                    data.close()
+                return
+            except compat_urllib_error.HTTPError as err:
+                if err.code < 500 or err.code >= 600:
+                    raise
+                retry_err = err
+            except compat_urllib_error.URLError as err:
+                if not isinstance(getattr(err, 'reason', None), socket.timeout):
+                    raise
+                retry_err = err
+            except socket.timeout as err:
+                retry_err = err
+            except socket.error as err:
+                if err.errno not in (errno.ECONNRESET, errno.ETIMEDOUT):
+                    raise
+                retry_err = err
+            except ContentTooShortError as err:
+                retry_err = err
+            count += 1
+            if count > retries:
+                raise retry_err
+            self.report_retry(retry_err, count, retries)
+
+    def _download_in_chunks(self, filename, tmpfilename, info_dict, headers, http_chunks):
+        """Download info_dict's URL over several connections, each of them
+        fetching a range of bytes written at its offset in tmpfilename.
+
+        The ranges and how much of them has been downloaded are saved in the
+        .ytdl file so that an interrupted download can be resumed.
+
+        Returns None if the server does not support byte ranges, the
+        download then has to be done over a single connection."""
+        url = info_dict['url']
+        continuedl = self.params.get('continuedl', True)
+        state = self._read_chunks_state(filename) if continuedl else None
+
+        probe = self._probe_ranges(url, headers)
+        if probe is None:
+            if state is not None:
+                # The .part file has the size of the whole file and can not
+                # be resumed over a single connection
+                self.report_unable_to_resume()
+                os.remove(encodeFilename(self.ytdl_filename(filename)))
+                if os.path.isfile(encodeFilename(tmpfilename)):
+                    os.remove(encodeFilename(tmpfilename))
+            return None
+        total, response_info = probe
+
+        min_data_len = self.params.get('min_filesize')
+        max_data_len = self.params.get('max_filesize')
+        if min_data_len is not None and total < min_data_len:
+            self.to_screen('\r[download] File is smaller than min-filesize (%s bytes < %s bytes). Aborting.' % (total, min_data_len))
+            return False
+        if max_data_len is not None and total > max_data_len:
+            self.to_screen('\r[download] File is larger than max-filesize (%s bytes > %s bytes). Aborting.' % (total, max_data_len))
+            return False
+
+        if state is not None and (state['total'] != total or not os.path.isfile(encodeFilename(tmpfilename))):
+            self.report_unable_to_resume()
+            state = None
+        if state is None:
+            # Data downloaded over a single connection is kept
+            start = 0
+            if continuedl and os.path.isfile(encodeFilename(tmpfilename)):
+                start = os.path.getsize(encodeFilename(tmpfilename))
+                if start >= total:
+                    return None
+            chunk_len = -(-(total - start) // http_chunks)
+            state = {
+                'total': total,
+                'chunks': [
+                    [chunk_start, min(chunk_start + chunk_len, total) - 1, 0]
+                    for chunk_start in range(start, total, chunk_len)],
+            }
+            stream, tmpfilename = sanitize_open(tmpfilename, 'ab' if start else 'wb')
+            stream.truncate(total)
+            stream.close()
+            self._write_chunks_state(filename, state)
+
+        self.report_destination(filename)
+        if self.params.get('xattr_set_filesize', False):
+            try:
+                write_xattr(tmpfilename, 'user.ytdl.filesize', str(total).encode('utf-8'))
+            except (XAttrUnavailableError, XAttrMetadataError) as err:
+                self.report_error('unable to set filesize xattr: %s' % str(err))
+
+        chunks = state['chunks']
+        pending = [c for c in chunks if c[0] + c[2] <= c[1]]
+        downloaded = total - sum(c[1] - c[0] + 1 - c[2] for c in chunks)
+        if downloaded:
+            self.report_resuming_byte(downloaded)
+        cond = threading.Condition()
+        status = {
+            'downloaded': downloaded,
+            'resumed': downloaded,
+            'start': time.time(),
+            'stop': False,
+            'error': None,
+            'workers': min(http_chunks, len(pending)),
+        }
+
+        def worker():
+            try:
+                # Unbuffered, so that the data counted in the state is on disk
+                stream = open(encodeFilename(tmpfilename), 'r+b', 0)
+                try:
+                    while True:
+                        with cond:
+                            if status['stop'] or not pending:
+                                return
+                            chunk = pending.pop(0)
+                        self._download_chunk(url, headers, stream, chunk, status, cond)
+                finally:
+                    stream.close()
+            except Exception as err:
+                with cond:
+                    if status['error'] is None:
+                        status['error'] = err
+                    status['stop'] = True
+            finally:
+                with cond:
+                    status['workers'] -= 1
+                    cond.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(status['workers'])]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        last_state_write = time.time()
+        try:
+            while True:
+                with cond:
+                    # Waiting with a timeout keeps the main thread
+                    # interruptible on Python 2
+                    cond.wait(self._PROGRESS_INTERVAL)
+                    workers = status['workers']
+                    downloaded = status['downloaded']
+                if status['error'] is not None:
+                    raise status['error']
+                now = time.time()
+                if not workers:
+                    break
+                if now - last_state_write >= 1:
+                    with cond:
+                        self._write_chunks_state(filename, state)
+                    last_state_write = now
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': downloaded,
+                    'total_bytes': total,
+                    'tmpfilename': tmpfilename,
+                    'filename': filename,
+                    'eta': self.calc_eta(status['start'], now, total - status['resumed'], downloaded - status['resumed']),
+                    'speed': self.calc_speed(status['start'], now, downloaded - status['resumed']),
+                    'elapsed': now - status['start'],
+                })
+        finally:
+            with cond:
+                status['stop'] = True
+                self._write_chunks_state(filename, state)
+        for t in threads:
+            t.join()
+
+        if downloaded != total:
+            self.report_error('Did not get all the data (%d of %d bytes)' % (downloaded, total))
+            return False
+        os.remove(encodeFilename(self.ytdl_filename(filename)))
+        self.try_rename(tmpfilename, filename)
+        if self.params.get('updatetime', True):
+            info_dict['filetime'] = self.try_utime(filename, response_info.get('last-modified', None))
+        self._hook_progress({
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'status': 'finished',
+            'elapsed': time.time() - status['start'],
+        })
+        return True
+
     def real_download(self, filename, info_dict):
         url = info_dict['url']
 
@@ -34,8 +348,11 @@ class HttpFD(FileDownloader):
             __delattr__ = dict.__delitem__
 
         ctx = DownloadContext()
+        # filename may also be a writable file-like object (e.g. an in-memory
+        # buffer), data is then written to it as is
+        to_stream = hasattr(filename, 'write')
         ctx.filename = filename
-        ctx.tmpfilename = self.temp_name(filename)
+        ctx.tmpfilename = filename if to_stream else self.temp_name(filename)
         ctx.stream = None
 
         # Do not include the Accept-Encoding header
@@ -49,18 +366,38 @@ class HttpFD(FileDownloader):
             info_dict.get('downloader_options', {}).get('http_chunk_size')
             or self.params.get('http_chunk_size') or 0)
 
+        http_chunks = self.params.get('http_chunks') or 1
+        if (not to_stream and not is_test and filename != '-'
+                and (http_chunks > 1 or self._read_chunks_state(filename) is not None)):
+            result = self._download_in_chunks(
+                filename, ctx.tmpfilename, info_dict, headers, http_chunks)
+            if result is not None:
+                return result
+
         ctx.open_mode = 'wb'
         ctx.resume_len = 0
         ctx.data_len = None
         ctx.block_size = self.params.get('buffersize', 1024)
         ctx.start_time = time.time()
         ctx.chunk_size = None
+        # Whether the destination file extends beyond the downloaded data
+        ctx.preallocated = False
 
-        if self.params.get('continuedl', True):
+        if self.params.get('continuedl', True) and not to_stream:
             # Establish possible resume length
             if os.path.isfile(encodeFilename(ctx.tmpfilename)):
                 ctx.resume_len = os.path.getsize(
                     encodeFilename(ctx.tmpfilename))
+        written = None if to_stream else self._read_preallocation_state(filename)
+        if written is not None:
+            if ctx.resume_len > written:
+                # The download was stopped before the space reserved but
+                # not written could be dropped (e.g. it was killed): only
+                # the data recorded as written can be trusted
+                with open(encodeFilename(ctx.tmpfilename), 'r+b') as stream:
+                    stream.truncate(written)
+                ctx.resume_len = written
+            self._remove_state(filename)
 
         ctx.is_resume = ctx.resume_len > 0
 
@@ -77,6 +414,26 @@ class HttpFD(FileDownloader):
         class NextFragment(Exception):
             pass
 
+        def trim_preallocation():
+            # Drop the space that has been reserved but not written so that
+            # the size of the file is the resume position
+            if ctx.preallocated and ctx.stream is not None and not ctx.stream.closed:
+                ctx.stream.flush()
+                ctx.stream.truncate(ctx.stream.tell())
+                self._remove_state(ctx.filename)
+            ctx.preallocated = False
+
+        def preallocate():
+            # Until the space reserved but not written is dropped, the size
+            # of the file is meaningless: the amount of data written is
+            # recorded along so that the download can be resumed from it
+            # if it is interrupted without trim_preallocation() being run
+            self._write_preallocation_state(ctx.filename, ctx.stream)
+            ctx.preallocation_state_time = time.time()
+            ctx.preallocated = self._preallocate(ctx.stream, ctx.data_len)
+            if not ctx.preallocated:
+                self._remove_state(ctx.filename)
+
         def set_range(req, start, end):
             range_header = 'bytes=%d-' % start
             if end:
@@ -222,9 +579,16 @@ class HttpFD(FileDownloader):
             # measure time over whole while-loop, so slow_down() and best_block_size() work together properly
             now = None  # needed for slow_down() in the first loop run
             before = start  # start measuring
+            last_progress = None
+
+            # Read into a reusable buffer rather than allocating a new bytes
+            # object for every block when the response supports it
+            readinto = getattr(ctx.data, 'readinto', None)
+            buf = view = None
 
             def retry(e):
-                to_stdout = ctx.tmpfilename == '-'
+                to_stdout = ctx.tmpfilename == '-' or to_stream
+                trim_preallocation()
                 if ctx.stream is not None:
                     if not to_stdout:
                         ctx.stream.close()
@@ -235,7 +599,14 @@ class HttpFD(FileDownloader):
             while True:
                 try:
                     # Download and write
-                    data_block = ctx.data.read(block_size if data_len is None else min(block_size, data_len - byte_counter))
+                    read_size = block_size if data_len is None else min(block_size, data_len - byte_counter)
+                    if readinto is None:
+                        data_block = ctx.data.read(read_size)
+                    else:
+                        if buf is None or len(buf) < read_size:
+                            buf = bytearray(max(read_size, block_size))
+                            view = memoryview(buf)
+                        data_block = view[:readinto(view[:read_size])]
                 # socket.timeout is a subclass of socket.error but may not have
                 # errno set
                 except socket.timeout as e:
@@ -254,7 +625,13 @@ class HttpFD(FileDownloader):
                     break
 
                 # Open destination file just in time
-                if ctx.stream is None:
+                if ctx.stream is None and to_stream:
+                    ctx.stream = filename
+                    if ctx.open_mode == 'wb':
+                        # Discard data from the attempts that could not be resumed
+                        ctx.stream.seek(0)
+                        ctx.stream.truncate()
+                elif ctx.stream is None:
                     try:
                         ctx.stream, ctx.tmpfilename = sanitize_open(
                             ctx.tmpfilename, ctx.open_mode)
@@ -271,8 +648,16 @@ class HttpFD(FileDownloader):
                         except (XAttrUnavailableError, XAttrMetadataError) as err:
                             self.report_error('unable to set filesize xattr: %s' % str(err))
 
+                    if (self.params.get('preallocate', False) and ctx.open_mode == 'wb'
+                            and ctx.tmpfilename != '-' and ctx.data_len):
+                        preallocate()
+
                 try:
                     ctx.stream.write(data_block)
+                    if (ctx.preallocated and time.time() - ctx.preallocation_state_time
+                            >= self._PREALLOCATION_STATE_INTERVAL):
+                        self._write_preallocation_state(ctx.filename, ctx.stream)
+                        ctx.preallocation_state_time = time.time()
                 except (IOError, OSError) as err:
                     self.to_stderr('\n')
                     self.report_error('unable to write data: %s' % str(err))
@@ -291,25 +676,30 @@ class HttpFD(FileDownloader):
 
                 before = after
 
-                # Progress message
-                speed = self.calc_speed(start, now, byte_counter - ctx.resume_len)
-                if ctx.data_len is None:
-                    eta = None
-                else:
-                    eta = self.calc_eta(start, time.time(), ctx.data_len - ctx.resume_len, byte_counter - ctx.resume_len)
-
-                self._hook_progress({
-                    'status': 'downloading',
-                    'downloaded_bytes': byte_counter,
-                    'total_bytes': ctx.data_len,
-                    'tmpfilename': ctx.tmpfilename,
-                    'filename': ctx.filename,
-                    'eta': eta,
-                    'speed': speed,
-                    'elapsed': now - ctx.start_time,
-                })
+                is_last_block = data_len is not None and byte_counter == data_len
 
-                if data_len is not None and byte_counter == data_len:
+                # Progress message, at most every _PROGRESS_INTERVAL seconds
+                if (last_progress is None or is_last_block
+                        or now - last_progress >= self._PROGRESS_INTERVAL):
+                    last_progress = now
+                    speed = self.calc_speed(start, now, byte_counter - ctx.resume_len)
+                    if ctx.data_len is None:
+                        eta = None
+                    else:
+                        eta = self.calc_eta(start, now, ctx.data_len - ctx.resume_len, byte_counter - ctx.resume_len)
+
+                    self._hook_progress({
+                        'status': 'downloading',
+                        'downloaded_bytes': byte_counter,
+                        'total_bytes': ctx.data_len,
+                        'tmpfilename': ctx.tmpfilename,
+                        'filename': ctx.filename,
+                        'eta': eta,
+                        'speed': speed,
+                        'elapsed': now - ctx.start_time,
+                    })
+
+                if is_last_block:
                     break
 
             if not is_test and ctx.chunk_size and ctx.data_len is not None and byte_counter < ctx.data_len:
@@ -321,7 +711,8 @@ class HttpFD(FileDownloader):
                 self.to_stderr('\n')
                 self.report_error('Did not get any data blocks')
                 return False
-            if ctx.tmpfilename != '-':
+            if ctx.tmpfilename != '-' and not to_stream:
+                trim_preallocation()
                 ctx.stream.close()
 
             if data_len is not None and byte_counter != data_len:
@@ -330,11 +721,15 @@ class HttpFD(FileDownloader):
                     retry(err)
                 raise err
 
-            self.try_rename(ctx.tmpfilename, ctx.filename)
+            if to_stream:
+                last_modified = ctx.data.info().get('last-modified', None)
+                info_dict['filetime'] = timeconvert(last_modified) if last_modified else None
+            else:
+                self.try_rename(ctx.tmpfilename, ctx.filename)
 
-            # Update file modification time
-            if self.params.get('updatetime', True):
-                info_dict['filetime'] = self.try_utime(ctx.filename, ctx.data.info().get('last-modified', None))
+                # Update file modification time
+                if self.params.get('updatetime', True):
+                    info_dict['filetime'] = self.try_utime(ctx.filename, ctx.data.info().get('last-modified', None))
 
             self._hook_progress({
                 'downloaded_bytes': byte_counter,
@@ -346,19 +741,23 @@ class HttpFD(FileDownloader):
 
             return True
 
-        while count <= retries:
-            try:
-                establish_connection()
-                return download()
-            except RetryDownload as e:
-                count += 1
-                if count <= retries:
-                    self.report_retry(e.source_error, count, retries)
-                continue
-            except NextFragment:
-                continue
-            except SucceedDownload:
-                return True
+        try:
+            while count <= retries:
+                try:
+                    establish_connection()
+                    return download()
+                except RetryDownload as e:
+                    count += 1
+                    if count <= retries:
+                        self.report_retry(e.source_error, count, retries)
+                    continue
+                except NextFragment:
+                    continue
+                except SucceedDownload:
+                    return True
+        finally:
+            # Also when interrupted, so that the download can be resumed
+            trim_preallocation()
 
         self.report_error('giving up after %s retries' % retries)
         return False
@@ -2,13 +2,9 @@ from __future__ import unicode_literals
 
 import time
 import binascii
-import io
 
 from .fragment import FragmentFD
-from ..compat import (
-    compat_Struct,
-    compat_urllib_error,
-)
+from ..compat import compat_Struct
 
 
 u8 = compat_Struct('>B')
@@ -190,17 +186,49 @@ def write_piff_header(stream, params):
     stream.write(box(b'moov', moov_payload))  # Movie Box
 
 
-def extract_box_data(data, box_sequence):
-    data_reader = io.BytesIO(data)
-    while True:
-        box_size = u32.unpack(data_reader.read(4))[0]
-        box_type = data_reader.read(4)
+def iter_boxes(data, start=0, end=None):
+    """
+    Iterate over the boxes in data[start:end] without copying any of them
+
+    data may be a bytes object or (on Python 3) a memoryview. Yields
+    (box type, payload start, payload end) tuples, the offsets being
+    relative to the beginning of data.
+    """
+    if end is None:
+        end = len(data)
+    while start + 8 <= end:
+        box_size = u32.unpack_from(data, start)[0]
+        box_type = bytes(data[start + 4:start + 8])
+        header_size = 8
+        if box_size == 1:  # 64-bit size
+            if start + 16 > end:
+                return
+            box_size = u64.unpack_from(data, start + 8)[0]
+            header_size = 16
+        elif box_size == 0:  # box extends to the end
+            box_size = end - start
+        if box_size < header_size or start + box_size > end:
+            return
+        yield box_type, start + header_size, start + box_size
+        start += box_size
+
+
+def find_box(data, box_sequence, start=0, end=None):
+    """
+    Returns the (start, end) offsets of the payload of the box found by
+    following the box types of box_sequence, None if there is no such box
+    """
+    for box_type, payload_start, payload_end in iter_boxes(data, start, end):
         if box_type == box_sequence[0]:
-            box_data = data_reader.read(box_size - 8)
             if len(box_sequence) == 1:
-                return box_data
-            return extract_box_data(box_data, box_sequence[1:])
-        data_reader.seek(box_size - 8, 1)
+                return payload_start, payload_end
+            return find_box(data, box_sequence[1:], payload_start, payload_end)
+    return None
+
+
+def extract_box_data(data, box_sequence):
+    payload = find_box(data, box_sequence)
+    return data[payload[0]:payload[1]] if payload else None
 
 
 class IsmFD(FragmentFD):
@@ -210,6 +238,9 @@ class IsmFD(FragmentFD):
 
     FD_NAME = 'ism'
 
+    # Number of fragments downloaded ahead of the one being written
+    _PREFETCH_FRAGMENTS = 4
+
     def real_download(self, filename, info_dict):
         segments = info_dict['fragments'][:1] if self.params.get(
             'test', False) else info_dict['fragments']
@@ -221,38 +252,34 @@ class IsmFD(FragmentFD):
 
         self._prepare_and_start_frag_download(ctx)
 
-        fragment_retries = self.params.get('fragment_retries', 0)
-        skip_unavailable_fragments = self.params.get('skip_unavailable_fragments', True)
-
-        track_written = False
-        frag_index = 0
-        for i, segment in enumerate(segments):
-            frag_index += 1
-            if frag_index <= ctx['fragment_index']:
-                continue
-            count = 0
-            while count <= fragment_retries:
-                try:
-                    success, frag_content = self._download_fragment(ctx, segment['url'], info_dict)
-                    if not success:
-                        return False
-                    if not track_written:
-                        tfhd_data = extract_box_data(frag_content, [b'moof', b'traf', b'tfhd'])
-                        info_dict['_download_params']['track_id'] = u32.unpack(tfhd_data[4:8])[0]
-                        write_piff_header(ctx['dest_stream'], info_dict['_download_params'])
-                        track_written = True
-                    self._append_fragment(ctx, frag_content)
-                    break
-                except compat_urllib_error.HTTPError as err:
-                    count += 1
-                    if count <= fragment_retries:
-                        self.report_retry_fragment(err, frag_index, count, fragment_retries)
-            if count > fragment_retries:
-                if skip_unavailable_fragments:
-                    self.report_skip_fragment(frag_index)
-                    continue
-                self.report_error('giving up after %s fragment retries' % fragment_retries)
-                return False
+        # The PIFF header is written before the first fragment, it must not
+        # be written again when resuming (.ytdl files written by older
+        # versions do not record it but then some fragments were appended)
+        piff_header = ctx['ytdl_extra'].get('piff_header')
+        if piff_header:
+            info_dict['_download_params']['track_id'] = piff_header['track_id']
+        if piff_header or ctx['fragment_index'] > 0:
+            ctx['track_written'] = True
+
+        fragments = [{
+            'frag_index': i + 1,
+            'url': segment['url'],
+        } for i, segment in enumerate(segments)]
+
+        def write_track(frag_content, fragment):
+            if not ctx.get('track_written'):
+                tfhd_start, _ = find_box(frag_content, [b'moof', b'traf', b'tfhd'])
+                track_id = u32.unpack_from(frag_content, tfhd_start + 4)[0]
+                info_dict['_download_params']['track_id'] = track_id
+                write_piff_header(ctx['dest_stream'], info_dict['_download_params'])
+                ctx['track_written'] = True
+                # Saved in the .ytdl file along with the fragment
+                ctx['ytdl_extra']['piff_header'] = {'track_id': track_id}
+            return frag_content
+
+        if not self.download_and_append_fragments(
+                ctx, fragments, info_dict, write_track, prefetch=self._PREFETCH_FRAGMENTS):
+            return False
 
         self._finish_frag_download(ctx)
 
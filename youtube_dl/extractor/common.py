@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import base64
+import bisect
 import datetime
 import hashlib
 import json
@@ -36,6 +37,7 @@ from ..downloader.f4m import (
     get_base_url,
     remove_encrypted_media,
 )
+from ..m3u8 import parse_m3u8_playlist
 from ..utils import (
     NO_DEFAULT,
     age_restricted,
@@ -44,7 +46,7 @@ from ..utils import (
     clean_html,
     compiled_regex_type,
     determine_ext,
-    determine_protocol,
+    formats_sort_key,
     dict_get,
     error_to_compat_str,
     ExtractorError,
@@ -54,6 +56,7 @@ from ..utils import (
     GeoRestrictedError,
     GeoUtils,
     int_or_none,
+    LazyFragmentList,
     js_to_json,
     JSON_LD_RE,
     mimetype2ext,
@@ -123,6 +126,11 @@ class InfoExtractor(object):
                                        is parsed from a string (in case of
                                        fragmented media)
                                    for MSS - URL of the ISM manifest.
+                    * m3u8_playlist  The parsed HLS media playlist at url
+                                 (youtube_dl.m3u8.M3U8Playlist), when it has
+                                 already been downloaded. Only reused for
+                                 playlists with #EXT-X-ENDLIST of streams
+                                 that are not live. Not serialized to JSON.
                     * manifest_url
                                  The URL of the manifest file in case of
                                  fragmented media:
@@ -1364,71 +1372,8 @@ class InfoExtractor(object):
             if 'tbr' not in f and f.get('abr') is not None and f.get('vbr') is not None:
                 f['tbr'] = f['abr'] + f['vbr']
 
-        def _formats_key(f):
-            # TODO remove the following workaround
-            from ..utils import determine_ext
-            if not f.get('ext') and 'url' in f:
-                f['ext'] = determine_ext(f['url'])
-
-            if isinstance(field_preference, (list, tuple)):
-                return tuple(
-                    f.get(field)
-                    if f.get(field) is not None
-                    else ('' if field == 'format_id' else -1)
-                    for field in field_preference)
-
-            preference = f.get('preference')
-            if preference is None:
-                preference = 0
-                if f.get('ext') in ['f4f', 'f4m']:  # Not yet supported
-                    preference -= 0.5
-
-            protocol = f.get('protocol') or determine_protocol(f)
-            proto_preference = 0 if protocol in ['http', 'https'] else (-0.5 if protocol == 'rtsp' else -0.1)
-
-            if f.get('vcodec') == 'none':  # audio only
-                preference -= 50
-                if self._downloader.params.get('prefer_free_formats'):
-                    ORDER = ['aac', 'mp3', 'm4a', 'webm', 'ogg', 'opus']
-                else:
-                    ORDER = ['webm', 'opus', 'ogg', 'mp3', 'aac', 'm4a']
-                ext_preference = 0
-                try:
-                    audio_ext_preference = ORDER.index(f['ext'])
-                except ValueError:
-                    audio_ext_preference = -1
-            else:
-                if f.get('acodec') == 'none':  # video only
-                    preference -= 40
-                if self._downloader.params.get('prefer_free_formats'):
-                    ORDER = ['flv', 'mp4', 'webm']
-                else:
-                    ORDER = ['webm', 'flv', 'mp4']
-                try:
-                    ext_preference = ORDER.index(f['ext'])
-                except ValueError:
-                    ext_preference = -1
-                audio_ext_preference = 0
-
-            return (
-                preference,
-                f.get('language_preference') if f.get('language_preference') is not None else -1,
-                f.get('quality') if f.get('quality') is not None else -1,
-                f.get('tbr') if f.get('tbr') is not None else -1,
-                f.get('filesize') if f.get('filesize') is not None else -1,
-                f.get('vbr') if f.get('vbr') is not None else -1,
-                f.get('height') if f.get('height') is not None else -1,
-                f.get('width') if f.get('width') is not None else -1,
-                proto_preference,
-                ext_preference,
-                f.get('abr') if f.get('abr') is not None else -1,
-                audio_ext_preference,
-                f.get('fps') if f.get('fps') is not None else -1,
-                f.get('filesize_approx') if f.get('filesize_approx') is not None else -1,
-                f.get('source_preference') if f.get('source_preference') is not None else -1,
-                f.get('format_id') if f.get('format_id') is not None else '',
-            )
-        formats.sort(key=_formats_key)
+        formats.sort(key=formats_sort_key(
+            self._downloader.params.get('prefer_free_formats'), field_preference))
 
     def _check_formats(self, formats, video_id):
         if formats:
@@ -1676,6 +1621,8 @@ class InfoExtractor(object):
                 'ext': ext,
                 'protocol': entry_protocol,
                 'preference': preference,
+                # Spare the downloader from downloading and parsing it again
+                'm3u8_playlist': parse_m3u8_playlist(m3u8_doc, m3u8_url),
             }]
 
         groups = {}
@@ -2150,6 +2097,75 @@ class InfoExtractor(object):
                         extract_Initialization(segment_template)
             return ms_info
 
+        def location_key(location):
+            return 'url' if re.match(r'^https?://', location) else 'path'
+
+        # Fragments are only generated when accessed, representations of
+        # long DVR manifests may have hundreds of thousands of them
+
+        def media_template_fragment(media_template, bandwidth, start_number):
+            media_location_key = location_key(media_template)
+
+            def fragment(index, segment_time, duration):
+                return {
+                    media_location_key: media_template % {
+                        'Time': segment_time,
+                        'Bandwidth': bandwidth,
+                        'Number': start_number + index,
+                    },
+                    'duration': duration,
+                }
+            return fragment
+
+        def segment_url_fragment(segment_urls):
+            def fragment(index, segment_time, duration):
+                segment_url = segment_urls[index]
+                fragment = {
+                    location_key(segment_url): segment_url,
+                }
+                if duration is not None:
+                    fragment['duration'] = duration
+                return fragment
+            return fragment
+
+        def fixed_duration_fragments(make_fragment, count, duration):
+            return LazyFragmentList(
+                count, lambda index: make_fragment(index, None, duration))
+
+        # Timelines are usually shared by all the representations of an
+        # adaptation set, they are indexed once
+        timelines = {}
+
+        def index_timeline(s_list):
+            """Returns the index of the first segment of every S element,
+            with its time and duration, and the number of segments"""
+            if id(s_list) in timelines:
+                return timelines[id(s_list)][1]
+            first_indexes, times, durations = [], [], []
+            index = segment_time = 0
+            for s in s_list:
+                segment_time = s.get('t') or segment_time
+                first_indexes.append(index)
+                times.append(segment_time)
+                durations.append(s['d'])
+                repeat = max(s.get('r', 0), 0) + 1
+                index += repeat
+                segment_time += repeat * s['d']
+            # s_list is kept referenced so that its id is not reused
+            timelines[id(s_list)] = s_list, (first_indexes, times, durations, index)
+            return timelines[id(s_list)][1]
+
+        def timeline_fragments(make_fragment, s_list, timescale):
+            first_indexes, times, durations, count = index_timeline(s_list)
+
+            def fragment(index):
+                s_index = bisect.bisect_right(first_indexes, index) - 1
+                segment_d = durations[s_index]
+                return make_fragment(
+                    index, times[s_index] + (index - first_indexes[s_index]) * segment_d,
+                    float_or_none(segment_d, timescale))
+            return LazyFragmentList(count, fragment)
+
         mpd_duration = parse_duration(mpd_doc.get('mediaPresentationDuration'))
         formats = []
         for period in mpd_doc.findall(_add_ns('Period')):
@@ -2243,13 +2259,11 @@ class InfoExtractor(object):
                                 'Bandwidth': bandwidth,
                             }
 
-                        def location_key(location):
-                            return 'url' if re.match(r'^https?://', location) else 'path'
-
                         if 'segment_urls' not in representation_ms_info and 'media' in representation_ms_info:
 
                             media_template = prepare_template('media', ('Number', 'Bandwidth', 'Time'))
-                            media_location_key = location_key(media_template)
+                            make_fragment = media_template_fragment(
+                                media_template, bandwidth, representation_ms_info['start_number'])
 
                             # As per [1, 5.3.9.4.4, Table 16, page 55] $Number$ and $Time$
                             # can't be used at the same time
@@ -2258,78 +2272,32 @@ class InfoExtractor(object):
                                 if 'total_number' not in representation_ms_info and 'segment_duration' in representation_ms_info:
                                     segment_duration = float_or_none(representation_ms_info['segment_duration'], representation_ms_info['timescale'])
                                     representation_ms_info['total_number'] = int(math.ceil(float(period_duration) / segment_duration))
-                                representation_ms_info['fragments'] = [{
-                                    media_location_key: media_template % {
-                                        'Number': segment_number,
-                                        'Bandwidth': bandwidth,
-                                    },
-                                    'duration': segment_duration,
-                                } for segment_number in range(
-                                    representation_ms_info['start_number'],
-                                    representation_ms_info['total_number'] + representation_ms_info['start_number'])]
+                                representation_ms_info['fragments'] = fixed_duration_fragments(
+                                    make_fragment, representation_ms_info['total_number'], segment_duration)
                             else:
                                 # $Number*$ or $Time$ in media template with S list available
                                 # Example $Number*$: http://www.svtplay.se/klipp/9023742/stopptid-om-bjorn-borg
                                 # Example $Time$: https://play.arkena.com/embed/avp/v2/player/media/b41dda37-d8e7-4d3f-b1b5-9a9db578bdfe/1/129411
-                                representation_ms_info['fragments'] = []
-                                segment_time = 0
-                                segment_d = None
-                                segment_number = representation_ms_info['start_number']
-
-                                def add_segment_url():
-                                    segment_url = media_template % {
-                                        'Time': segment_time,
-                                        'Bandwidth': bandwidth,
-                                        'Number': segment_number,
-                                    }
-                                    representation_ms_info['fragments'].append({
-                                        media_location_key: segment_url,
-                                        'duration': float_or_none(segment_d, representation_ms_info['timescale']),
-                                    })
-
-                                for num, s in enumerate(representation_ms_info['s']):
-                                    segment_time = s.get('t') or segment_time
-                                    segment_d = s['d']
-                                    add_segment_url()
-                                    segment_number += 1
-                                    for r in range(s.get('r', 0)):
-                                        segment_time += segment_d
-                                        add_segment_url()
-                                        segment_number += 1
-                                    segment_time += segment_d
+                                representation_ms_info['fragments'] = timeline_fragments(
+                                    make_fragment, representation_ms_info['s'],
+                                    representation_ms_info['timescale'])
                         elif 'segment_urls' in representation_ms_info and 's' in representation_ms_info:
                             # No media template
                             # Example: https://www.youtube.com/watch?v=iXZV5uAYMJI
                             # or any YouTube dashsegments video
-                            fragments = []
-                            segment_index = 0
-                            timescale = representation_ms_info['timescale']
-                            for s in representation_ms_info['s']:
-                                duration = float_or_none(s['d'], timescale)
-                                for r in range(s.get('r', 0) + 1):
-                                    segment_uri = representation_ms_info['segment_urls'][segment_index]
-                                    fragments.append({
-                                        location_key(segment_uri): segment_uri,
-                                        'duration': duration,
-                                    })
-                                    segment_index += 1
-                            representation_ms_info['fragments'] = fragments
+                            representation_ms_info['fragments'] = timeline_fragments(
+                                segment_url_fragment(representation_ms_info['segment_urls']),
+                                representation_ms_info['s'], representation_ms_info['timescale'])
                         elif 'segment_urls' in representation_ms_info:
                             # Segment URLs with no SegmentTimeline
                             # Example: https://www.seznam.cz/zpravy/clanek/cesko-zasahne-vitr-o-sile-vichrice-muze-byt-i-zivotu-nebezpecny-39091
                             # https://github.com/ytdl-org/youtube-dl/pull/14844
-                            fragments = []
                             segment_duration = float_or_none(
                                 representation_ms_info['segment_duration'],
                                 representation_ms_info['timescale']) if 'segment_duration' in representation_ms_info else None
-                            for segment_url in representation_ms_info['segment_urls']:
-                                fragment = {
-                                    location_key(segment_url): segment_url,
-                                }
-                                if segment_duration:
-                                    fragment['duration'] = segment_duration
-                                fragments.append(fragment)
-                            representation_ms_info['fragments'] = fragments
+                            representation_ms_info['fragments'] = fixed_duration_fragments(
+                                segment_url_fragment(representation_ms_info['segment_urls']),
+                                len(representation_ms_info['segment_urls']), segment_duration or None)
                         # If there is a fragments key available then we correctly recognized fragmented media.
                         # Otherwise we will assume unfragmented media with direct access. Technically, such
                         # assumption is not necessarily correct since we may simply have no support for
@@ -2339,15 +2307,17 @@ class InfoExtractor(object):
                                 # NB: mpd_url may be empty when MPD manifest is parsed from a string
                                 'url': mpd_url or base_url,
                                 'fragment_base_url': base_url,
-                                'fragments': [],
                                 'protocol': 'http_dash_segments',
                             })
+                            fragments = representation_ms_info['fragments']
+                            initialization = None
                             if 'initialization_url' in representation_ms_info:
                                 initialization_url = representation_ms_info['initialization_url']
                                 if not f.get('url'):
                                     f['url'] = initialization_url
-                                f['fragments'].append({location_key(initialization_url): initialization_url})
-                            f['fragments'].extend(representation_ms_info['fragments'])
+                                initialization = {location_key(initialization_url): initialization_url}
+                            f['fragments'] = LazyFragmentList(
+                                len(fragments), fragments.__getitem__, initialization)
                         else:
                             # Assuming direct URL to unfragmented media.
                             f['url'] = base_url
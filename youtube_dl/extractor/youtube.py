@@ -1139,7 +1139,7 @@ class YoutubeIE(YoutubeBaseInfoExtractor):
 
         cache_spec = self._downloader.cache.load('youtube-sigfuncs', func_id)
         if cache_spec is not None:
-            return lambda s: ''.join(s[i] for i in cache_spec)
+            return self._compile_signature_spec(cache_spec)
 
         download_note = (
             'Downloading player %s' % player_url
@@ -1167,7 +1167,30 @@ class YoutubeIE(YoutubeBaseInfoExtractor):
         cache_spec = [ord(c) for c in cache_res]
 
         self._downloader.cache.store('youtube-sigfuncs', func_id, cache_spec)
-        return res
+        # Signature functions only shuffle characters around, so once the
+        # permutation is known the player code is not needed anymore
+        return self._compile_signature_spec(cache_spec)
+
+    @staticmethod
+    def _compile_signature_spec(cache_spec):
+        """
+        Turn a signature permutation spec (the index of the source character
+        of every output character) into a function that applies it with a
+        minimal number of slices.
+        """
+        slices = []
+        start, n = 0, len(cache_spec)
+        while start < n:
+            end, step = start + 1, 1
+            if end < n and cache_spec[end] - cache_spec[start] in (-1, 1):
+                step = cache_spec[end] - cache_spec[start]
+                while end < n and cache_spec[end] - cache_spec[end - 1] == step:
+                    end += 1
+            stop = cache_spec[end - 1] + step
+            slices.append(slice(
+                cache_spec[start], stop if stop >= 0 else None, step))
+            start = end
+        return lambda s: ''.join([s[sl] for sl in slices])
 
     def _print_sig_code(self, func, example_sig):
         def gen_sig_code(idxs):
@@ -1,9 +1,9 @@
 from __future__ import unicode_literals
 
-import json
 import operator
 import re
 
+from .compat import compat_chr
 from .utils import (
     ExtractorError,
     remove_quotes,
@@ -26,6 +26,268 @@ _ASSIGN_OPERATORS.append(('=', lambda cur, right: right))
 
 _NAME_RE = r'[a-zA-Z_$][a-zA-Z_$0-9]*'
 
+_BINARY_OPERATORS = dict(_OPERATORS)
+_BINARY_OPERATORS.update({
+    '>>>': lambda x, y: (x % 0x100000000) >> y,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '===': operator.eq,
+    '!==': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+})
+
+# Binding power of the binary operators, higher binds tighter
+_PRECEDENCE = {
+    '||': 1,
+    '&&': 2,
+    '|': 3,
+    '^': 4,
+    '&': 5,
+    '==': 6, '!=': 6, '===': 6, '!==': 6,
+    '<': 7, '<=': 7, '>': 7, '>=': 7,
+    '<<': 8, '>>': 8, '>>>': 8,
+    '+': 9, '-': 9,
+    '*': 10, '/': 10, '%': 10,
+}
+
+_UNARY_OPERATORS = {
+    '-': operator.neg,
+    '+': operator.pos,
+    '!': operator.not_,
+    '~': operator.invert,
+}
+
+_LITERALS = {
+    'true': True,
+    'false': False,
+    'null': None,
+    'undefined': None,
+}
+
+_TOKEN_RE = re.compile(r'''(?xs)
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)|
+    (?P<num>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|
+    (?P<name>%s)|
+    (?P<op>>>>=|>>>|===|!==|>>=|<<=|&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%%&|^]=|
+        [-+*/%%&|^<>=!~?:.,;()\[\]{}])
+''' % _NAME_RE)
+
+_STRING_ESCAPES = {
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+    '0': '\0',
+}
+
+
+_STRING_ESCAPE_RE = re.compile(r'\\(?:u([0-9a-fA-F]{4})|x([0-9a-fA-F]{2})|(.))', re.S)
+
+
+def _unescape_string(s):
+    def unescape(m):
+        if m.group(3) is not None:
+            return _STRING_ESCAPES.get(m.group(3), m.group(3))
+        return compat_chr(int(m.group(1) or m.group(2), 16))
+    return _STRING_ESCAPE_RE.sub(unescape, s[1:-1])
+
+
+def _tokenize(code):
+    tokens = []
+    pos = 0
+    while pos < len(code):
+        m = _TOKEN_RE.match(code, pos)
+        if not m:
+            raise ExtractorError(
+                'Unexpected character %r in JS code %r' % (code[pos], code))
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'space':
+            continue
+        if kind == 'num':
+            value = (
+                int(value, 16) if value[:2] in ('0x', '0X')
+                else float(value) if re.search(r'[.eE]', value)
+                else int(value))
+        elif kind == 'str':
+            value = _unescape_string(value)
+        tokens.append((kind, value))
+    tokens.append(('end', None))
+    return tokens
+
+
+class _JSParser(object):
+    """Recursive descent parser producing the AST of a JS statement list
+
+    The AST is made of tuples, the first item being the node type."""
+
+    def __init__(self, code):
+        self.code = code
+        self._tokens = _tokenize(code)
+        self._pos = 0
+
+    def _peek(self):
+        return self._tokens[self._pos]
+
+    def _next(self):
+        tok = self._tokens[self._pos]
+        self._pos += 1
+        return tok
+
+    def _is_op(self, *ops):
+        kind, value = self._tokens[self._pos]
+        return kind == 'op' and value in ops
+
+    def _expect(self, op):
+        kind, value = self._next()
+        if kind != 'op' or value != op:
+            raise ExtractorError(
+                'Expected %r instead of %r in JS code %r' % (op, value, self.code))
+
+    def parse_statements(self):
+        stmts = []
+        while self._peek()[0] != 'end':
+            if self._is_op(';'):
+                self._next()
+                continue
+            stmts.append(self._statement())
+            if self._peek()[0] != 'end':
+                self._expect(';')
+        return stmts
+
+    def parse_expression(self):
+        expr = self._expression()
+        if self._peek()[0] != 'end':
+            raise ExtractorError(
+                'Unexpected %r in JS expression %r' % (self._peek()[1], self.code))
+        return expr
+
+    def _statement(self):
+        kind, value = self._peek()
+        if kind == 'name' and value == 'var':
+            self._next()
+            decls = []
+            while True:
+                kind, name = self._next()
+                if kind != 'name':
+                    raise ExtractorError('Invalid variable declaration in %r' % self.code)
+                init = None
+                if self._is_op('='):
+                    self._next()
+                    init = self._assignment()
+                decls.append((name, init))
+                if not self._is_op(','):
+                    break
+                self._next()
+            return ('var', decls)
+        if kind == 'name' and value == 'return':
+            self._next()
+            if self._peek()[0] == 'end' or self._is_op(';'):
+                return ('return', None)
+            return ('return', self._expression())
+        return ('expr', self._expression())
+
+    def _expression(self):
+        exprs = [self._assignment()]
+        while self._is_op(','):
+            self._next()
+            exprs.append(self._assignment())
+        return exprs[0] if len(exprs) == 1 else ('seq', exprs)
+
+    def _assignment(self):
+        left = self._conditional()
+        kind, op = self._peek()
+        if kind == 'op' and op.endswith('=') and op not in ('==', '!=', '===', '!==', '<=', '>='):
+            if left[0] not in ('name', 'member'):
+                raise ExtractorError('Invalid assignment target in %r' % self.code)
+            self._next()
+            return ('assign', op, left, self._assignment())
+        return left
+
+    def _conditional(self):
+        test = self._binary(1)
+        if not self._is_op('?'):
+            return test
+        self._next()
+        if_true = self._assignment()
+        self._expect(':')
+        return ('cond', test, if_true, self._assignment())
+
+    def _binary(self, min_precedence):
+        left = self._unary()
+        while True:
+            kind, op = self._peek()
+            precedence = _PRECEDENCE.get(op) if kind == 'op' else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            self._next()
+            right = self._binary(precedence + 1)
+            left = ('logical' if op in ('&&', '||') else 'binary', op, left, right)
+
+    def _unary(self):
+        kind, op = self._peek()
+        if kind == 'op' and op in _UNARY_OPERATORS:
+            self._next()
+            return ('unary', op, self._unary())
+        return self._postfix()
+
+    def _postfix(self):
+        expr = self._primary()
+        while True:
+            if self._is_op('.'):
+                self._next()
+                kind, name = self._next()
+                if kind != 'name':
+                    raise ExtractorError('Invalid member access in %r' % self.code)
+                expr = ('member', expr, ('literal', name))
+            elif self._is_op('['):
+                self._next()
+                key = self._expression()
+                self._expect(']')
+                expr = ('member', expr, key)
+            elif self._is_op('('):
+                self._next()
+                args = []
+                while not self._is_op(')'):
+                    args.append(self._assignment())
+                    if not self._is_op(')'):
+                        self._expect(',')
+                self._next()
+                expr = ('call', expr, args)
+            else:
+                return expr
+
+    def _primary(self):
+        kind, value = self._next()
+        if kind in ('num', 'str'):
+            return ('literal', value)
+        if kind == 'name':
+            if value in _LITERALS:
+                return ('literal', _LITERALS[value])
+            return ('name', value)
+        if kind == 'op' and value == '(':
+            expr = self._expression()
+            self._expect(')')
+            return expr
+        if kind == 'op' and value == '[':
+            elts = []
+            while not self._is_op(']'):
+                elts.append(self._assignment())
+                if not self._is_op(']'):
+                    self._expect(',')
+            self._next()
+            return ('array', elts)
+        raise ExtractorError(
+            'Unsupported JS expression %r' % self.code if kind == 'end' else
+            'Unexpected %r in JS code %r' % (value, self.code))
+
 
 class JSInterpreter(object):
     def __init__(self, code, objects=None):
@@ -34,181 +296,212 @@ class JSInterpreter(object):
         self.code = code
         self._functions = {}
         self._objects = objects
-
-    def interpret_statement(self, stmt, local_vars, allow_recursion=100):
-        if allow_recursion < 0:
-            raise ExtractorError('Recursion limit reached')
-
-        should_abort = False
-        stmt = stmt.lstrip()
-        stmt_m = re.match(r'var\s', stmt)
-        if stmt_m:
-            expr = stmt[len(stmt_m.group(0)):]
-        else:
-            return_m = re.match(r'return(?:\s+|$)', stmt)
-            if return_m:
-                expr = stmt[len(return_m.group(0)):]
-                should_abort = True
-            else:
-                # Try interpreting it as an expression
-                expr = stmt
-
-        v = self.interpret_expression(expr, local_vars, allow_recursion)
-        return v, should_abort
-
-    def interpret_expression(self, expr, local_vars, allow_recursion):
-        expr = expr.strip()
-        if expr == '':  # Empty expression
-            return None
-
-        if expr.startswith('('):
-            parens_count = 0
-            for m in re.finditer(r'[()]', expr):
-                if m.group(0) == '(':
-                    parens_count += 1
-                else:
-                    parens_count -= 1
-                    if parens_count == 0:
-                        sub_expr = expr[1:m.start()]
-                        sub_result = self.interpret_expression(
-                            sub_expr, local_vars, allow_recursion)
-                        remaining_expr = expr[m.end():].strip()
-                        if not remaining_expr:
-                            return sub_result
-                        else:
-                            expr = json.dumps(sub_result) + remaining_expr
-                        break
-            else:
-                raise ExtractorError('Premature end of parens in %r' % expr)
-
-        for op, opfunc in _ASSIGN_OPERATORS:
-            m = re.match(r'''(?x)
-                (?P<out>%s)(?:\[(?P<index>[^\]]+?)\])?
-                \s*%s
-                (?P<expr>.*)$''' % (_NAME_RE, re.escape(op)), expr)
-            if not m:
-                continue
-            right_val = self.interpret_expression(
-                m.group('expr'), local_vars, allow_recursion - 1)
-
-            if m.groupdict().get('index'):
-                lvar = local_vars[m.group('out')]
-                idx = self.interpret_expression(
-                    m.group('index'), local_vars, allow_recursion)
-                assert isinstance(idx, int)
-                cur = lvar[idx]
-                val = opfunc(cur, right_val)
-                lvar[idx] = val
-                return val
-            else:
-                cur = local_vars.get(m.group('out'))
-                val = opfunc(cur, right_val)
-                local_vars[m.group('out')] = val
-                return val
-
-        if expr.isdigit():
-            return int(expr)
-
-        var_m = re.match(
-            r'(?!if|return|true|false)(?P<name>%s)$' % _NAME_RE,
-            expr)
-        if var_m:
-            return local_vars[var_m.group('name')]
-
-        try:
-            return json.loads(expr)
-        except ValueError:
-            pass
-
-        m = re.match(
-            r'(?P<in>%s)\[(?P<idx>.+)\]$' % _NAME_RE, expr)
-        if m:
-            val = local_vars[m.group('in')]
-            idx = self.interpret_expression(
-                m.group('idx'), local_vars, allow_recursion - 1)
-            return val[idx]
-
-        m = re.match(
-            r'(?P<var>%s)(?:\.(?P<member>[^(]+)|\[(?P<member2>[^]]+)\])\s*(?:\(+(?P<args>[^()]*)\))?$' % _NAME_RE,
-            expr)
-        if m:
-            variable = m.group('var')
-            member = remove_quotes(m.group('member') or m.group('member2'))
-            arg_str = m.group('args')
-
-            if variable in local_vars:
-                obj = local_vars[variable]
-            else:
-                if variable not in self._objects:
-                    self._objects[variable] = self.extract_object(variable)
-                obj = self._objects[variable]
-
-            if arg_str is None:
-                # Member access
-                if member == 'length':
-                    return len(obj)
-                return obj[member]
-
-            assert expr.endswith(')')
-            # Function call
-            if arg_str == '':
-                argvals = tuple()
-            else:
-                argvals = tuple([
-                    self.interpret_expression(v, local_vars, allow_recursion)
-                    for v in arg_str.split(',')])
-
+        # Compiled statements and expressions, by source code
+        self._compiled = {}
+
+    def _get_object(self, objname):
+        if objname not in self._objects:
+            self._objects[objname] = self.extract_object(objname)
+        return self._objects[objname]
+
+    def _get_function(self, funcname):
+        if funcname not in self._functions:
+            self._functions[funcname] = self.extract_function(funcname)
+        return self._functions[funcname]
+
+    def _compile_statements(self, stmts):
+        """Turn a statement list AST into a function of the local variables
+        returning a (value, should_abort) tuple"""
+        compiled = [self._compile_statement(stmt) for stmt in stmts]
+
+        def run(local_vars):
+            res = None
+            for stmt in compiled:
+                res, abort = stmt(local_vars)
+                if abort:
+                    return res, True
+            return res, False
+        return run
+
+    def _compile_statement(self, stmt):
+        if stmt[0] == 'var':
+            decls = [
+                (name, None if init is None else self._compile_expression(init))
+                for name, init in stmt[1]]
+
+            def run(local_vars):
+                res = None
+                for name, init in decls:
+                    res = local_vars[name] = None if init is None else init(local_vars)
+                return res, False
+            return run
+        if stmt[0] == 'return':
+            if stmt[1] is None:
+                return lambda local_vars: (None, True)
+            expr = self._compile_expression(stmt[1])
+            return lambda local_vars: (expr(local_vars), True)
+        expr = self._compile_expression(stmt[1])
+        return lambda local_vars: (expr(local_vars), False)
+
+    def _compile_expression(self, node):
+        """Turn an expression AST into a function of the local variables"""
+        kind = node[0]
+        if kind == 'literal':
+            value = node[1]
+            return lambda local_vars: value
+        if kind == 'name':
+            name = node[1]
+            return lambda local_vars: local_vars[name]
+        if kind == 'array':
+            elts = [self._compile_expression(elt) for elt in node[1]]
+            return lambda local_vars: [elt(local_vars) for elt in elts]
+        if kind == 'seq':
+            exprs = [self._compile_expression(expr) for expr in node[1]]
+
+            def seq(local_vars):
+                for expr in exprs:
+                    res = expr(local_vars)
+                return res
+            return seq
+        if kind == 'unary':
+            opfunc = _UNARY_OPERATORS[node[1]]
+            operand = self._compile_expression(node[2])
+            return lambda local_vars: opfunc(operand(local_vars))
+        if kind == 'binary':
+            opfunc = _BINARY_OPERATORS[node[1]]
+            left = self._compile_expression(node[2])
+            right = self._compile_expression(node[3])
+            return lambda local_vars: opfunc(left(local_vars), right(local_vars))
+        if kind == 'logical':
+            left = self._compile_expression(node[2])
+            right = self._compile_expression(node[3])
+            if node[1] == '&&':
+                return lambda local_vars: left(local_vars) and right(local_vars)
+            return lambda local_vars: left(local_vars) or right(local_vars)
+        if kind == 'cond':
+            test, if_true, if_false = [
+                self._compile_expression(n) for n in node[1:]]
+            return lambda local_vars: (
+                if_true(local_vars) if test(local_vars) else if_false(local_vars))
+        if kind == 'member':
+            obj = self._compile_object(node[1])
+            key = self._compile_expression(node[2])
+
+            def member(local_vars):
+                o, k = obj(local_vars), key(local_vars)
+                if k == 'length':
+                    return len(o)
+                return o[k]
+            return member
+        if kind == 'call':
+            return self._compile_call(node[1], node[2])
+        if kind == 'assign':
+            return self._compile_assignment(node[1], node[2], node[3])
+        assert False, 'Invalid JS AST node %r' % (node, )
+
+    def _compile_object(self, node):
+        # Bare names that are not local variables refer to global objects
+        if node[0] == 'name':
+            name = node[1]
+            return lambda local_vars: (
+                local_vars[name] if name in local_vars
+                else self._get_object(name))
+        return self._compile_expression(node)
+
+    def _compile_call(self, callee, arg_nodes):
+        args = [self._compile_expression(arg) for arg in arg_nodes]
+
+        if callee[0] == 'name':
+            funcname = callee[1]
+            return lambda local_vars: self._get_function(funcname)(
+                tuple([arg(local_vars) for arg in args]))
+
+        if callee[0] != 'member':
+            raise ExtractorError('Unsupported JS function call %r' % (callee, ))
+        obj = self._compile_object(callee[1])
+        key = self._compile_expression(callee[2])
+
+        def call(local_vars):
+            o, member = obj(local_vars), key(local_vars)
+            argvals = tuple([arg(local_vars) for arg in args])
             if member == 'split':
-                assert argvals == ('',)
-                return list(obj)
+                if argvals == ('', ):
+                    return list(o)
+                return o.split(*argvals)
             if member == 'join':
                 assert len(argvals) == 1
-                return argvals[0].join(obj)
+                return argvals[0].join(o)
             if member == 'reverse':
                 assert len(argvals) == 0
-                obj.reverse()
-                return obj
+                o.reverse()
+                return o
             if member == 'slice':
-                assert len(argvals) == 1
-                return obj[argvals[0]:]
+                return o[slice(*argvals)] if len(argvals) > 1 else o[argvals[0]:]
             if member == 'splice':
-                assert isinstance(obj, list)
+                assert isinstance(o, list)
                 index, howMany = argvals
                 res = []
-                for i in range(index, min(index + howMany, len(obj))):
-                    res.append(obj.pop(index))
+                for i in range(index, min(index + howMany, len(o))):
+                    res.append(o.pop(index))
                 return res
+            return o[member](argvals)
+        return call
+
+    def _compile_assignment(self, op, target, value_node):
+        opfunc = dict(_ASSIGN_OPERATORS).get(op)
+        if opfunc is None:
+            opfunc = _BINARY_OPERATORS[op[:-1]]
+        value = self._compile_expression(value_node)
+
+        if target[0] == 'name':
+            name = target[1]
+            if op == '=':
+                def assign(local_vars):
+                    val = local_vars[name] = value(local_vars)
+                    return val
+            else:
+                def assign(local_vars):
+                    val = local_vars[name] = opfunc(
+                        local_vars.get(name), value(local_vars))
+                    return val
+            return assign
+
+        obj = self._compile_object(target[1])
+        key = self._compile_expression(target[2])
+
+        def assign_member(local_vars):
+            o, k = obj(local_vars), key(local_vars)
+            right_val = value(local_vars)
+            val = o[k] = right_val if op == '=' else opfunc(o[k], right_val)
+            return val
+        return assign_member
+
+    def _compile(self, code, expression=False):
+        """Parse and compile code once, reusing the result afterwards"""
+        cache_key = (code, expression)
+        compiled = self._compiled.get(cache_key)
+        if compiled is None:
+            parser = _JSParser(code)
+            if expression:
+                compiled = self._compile_expression(parser.parse_expression())
+            else:
+                compiled = self._compile_statements(parser.parse_statements())
+            self._compiled[cache_key] = compiled
+        return compiled
+
+    def interpret_statement(self, stmt, local_vars, allow_recursion=100):
+        if allow_recursion < 0:
+            raise ExtractorError('Recursion limit reached')
 
-            return obj[member](argvals)
+        return self._compile(stmt)(local_vars)
 
-        for op, opfunc in _OPERATORS:
-            m = re.match(r'(?P<x>.+?)%s(?P<y>.+)' % re.escape(op), expr)
-            if not m:
-                continue
-            x, abort = self.interpret_statement(
-                m.group('x'), local_vars, allow_recursion - 1)
-            if abort:
-                raise ExtractorError(
-                    'Premature left-side return of %s in %r' % (op, expr))
-            y, abort = self.interpret_statement(
-                m.group('y'), local_vars, allow_recursion - 1)
-            if abort:
-                raise ExtractorError(
-                    'Premature right-side return of %s in %r' % (op, expr))
-            return opfunc(x, y)
-
-        m = re.match(
-            r'^(?P<func>%s)\((?P<args>[a-zA-Z0-9_$,]*)\)$' % _NAME_RE, expr)
-        if m:
-            fname = m.group('func')
-            argvals = tuple([
-                int(v) if v.isdigit() else local_vars[v]
-                for v in m.group('args').split(',')]) if len(m.group('args')) > 0 else tuple()
-            if fname not in self._functions:
-                self._functions[fname] = self.extract_function(fname)
-            return self._functions[fname](argvals)
-
-        raise ExtractorError('Unsupported JS expression %r' % expr)
+    def interpret_expression(self, expr, local_vars, allow_recursion):
+        if allow_recursion < 0:
+            raise ExtractorError('Recursion limit reached')
+
+        if expr.strip() == '':  # Empty expression
+            return None
+        return self._compile(expr, expression=True)(local_vars)
 
     def extract_object(self, objname):
         _FUNC_NAME_RE = r'''(?:[a-zA-Z$0-9]+|"[a-zA-Z$0-9]+"|'[a-zA-Z$0-9]+')'''
@@ -248,15 +541,14 @@ class JSInterpreter(object):
         return self.build_function(argnames, func_m.group('code'))
 
     def call_function(self, funcname, *args):
-        f = self.extract_function(funcname)
-        return f(args)
+        return self._get_function(funcname)(args)
 
     def build_function(self, argnames, code):
+        argnames = [argname.strip() for argname in argnames if argname.strip()]
+        # The function body is parsed once, calls only run the compiled code
+        body = self._compile(code)
+
         def resf(args):
             local_vars = dict(zip(argnames, args))
-            for stmt in code.split(';'):
-                res, abort = self.interpret_statement(stmt, local_vars)
-                if abort:
-                    break
-            return res
+            return body(local_vars)[0]
         return resf
@@ -0,0 +1,182 @@
+from __future__ import unicode_literals
+
+import binascii
+import re
+
+from .compat import compat_urlparse
+from .utils import parse_m3u8_attributes
+
+
+# Relative URIs without a scheme, dot segments, query-only or fragment-only
+# references, which can be resolved by prepending the playlist directory
+_SIMPLE_RELATIVE_URI_RE = re.compile(r'(?:[\w~-][^/?#:]*/)*[\w~-][^/?#:]*(?:\?[^#]*)?$')
+
+
+def _uri_resolver(base_url):
+    """Returns a function resolving the URIs of the playlist at base_url,
+    equivalent to compat_urlparse.urljoin(base_url, uri) but much faster
+    for the common case of segments living next to the playlist"""
+    parsed = compat_urlparse.urlparse(base_url)
+    if parsed.scheme and parsed.netloc and parsed.path.startswith('/'):
+        prefix = '%s://%s%s' % (
+            parsed.scheme, parsed.netloc, parsed.path[:parsed.path.rfind('/') + 1])
+    else:
+        prefix = None
+
+    def resolve(uri):
+        if uri.startswith(('http://', 'https://')):
+            return uri
+        if prefix is not None and _SIMPLE_RELATIVE_URI_RE.match(uri):
+            return prefix + uri
+        return compat_urlparse.urljoin(base_url, uri)
+    return resolve
+
+
+class M3U8Segment(object):
+    """A media segment of an M3U8 media playlist
+
+    url:            Absolute URL of the segment
+    duration:       Duration from #EXTINF, in seconds (float or None)
+    media_sequence: Media sequence number
+    byte_range:     (start, end) tuple of the sub-range of the resource to
+                    download, end excluded, or None for the whole resource
+    key:            Attributes of the #EXT-X-KEY tag applying to the segment,
+                    as a dict with the IV as bytes and an absolute URI. It's
+                    shared by all the segments of the same key, so that the
+                    key itself can be cached in it (as "KEY")
+    discontinuity:  Whether the segment is preceded by #EXT-X-DISCONTINUITY
+    ad:             Whether the segment has been marked as an ad
+    """
+
+    __slots__ = ('url', 'duration', 'media_sequence', 'byte_range', 'key',
+                 'discontinuity', 'ad')
+
+    def __init__(self, url, duration, media_sequence, byte_range, key,
+                 discontinuity, ad):
+        self.url = url
+        self.duration = duration
+        self.media_sequence = media_sequence
+        self.byte_range = byte_range
+        self.key = key
+        self.discontinuity = discontinuity
+        self.ad = ad
+
+    def __repr__(self):
+        return '<M3U8Segment %d %s>' % (self.media_sequence, self.url)
+
+
+class M3U8Playlist(object):
+    """A parsed M3U8 media playlist
+
+    url:             URL of the playlist, the segment URLs are relative to it
+    segments:        List of M3U8Segment, ad segments included
+    target_duration: Value of #EXT-X-TARGETDURATION (float or None)
+    media_sequence:  Media sequence number of the first segment
+    endlist:         Whether #EXT-X-ENDLIST is present, i.e. no segment
+                     will be added to the playlist any more
+    key_methods:     Set of the METHODs of the #EXT-X-KEY tags
+    has_byte_range:  Whether some segments are byte ranges
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.segments = []
+        self.target_duration = None
+        self.media_sequence = 0
+        self.endlist = False
+        self.key_methods = set()
+        self.has_byte_range = False
+
+    @property
+    def ad_segment_count(self):
+        return sum(1 for segment in self.segments if segment.ad)
+
+    def __deepcopy__(self, memo):
+        # Playlists are never modified once parsed, and format dicts
+        # holding one get deep-copied during format selection
+        return self
+
+    def __repr__(self):
+        return '<M3U8Playlist %s (%d segments)>' % (self.url, len(self.segments))
+
+
+def _is_ad_segment_start(line):
+    return (line.startswith('#ANVATO-SEGMENT-INFO') and 'type=ad' in line
+            or line.startswith('#UPLYNK-SEGMENT') and line.endswith(',ad'))
+
+
+def _is_ad_segment_end(line):
+    return (line.startswith('#ANVATO-SEGMENT-INFO') and 'type=master' in line
+            or line.startswith('#UPLYNK-SEGMENT') and line.endswith(',segment'))
+
+
+def parse_m3u8_playlist(m3u8_doc, m3u8_url):
+    """Parse the M3U8 media playlist m3u8_doc, downloaded from m3u8_url,
+    in a single pass and return a M3U8Playlist"""
+    playlist = M3U8Playlist(m3u8_url)
+    segments = playlist.segments
+    resolve = _uri_resolver(m3u8_url)
+    media_sequence = 0
+    duration = None
+    no_key = key = {'METHOD': 'NONE'}
+    # #EXT-X-KEY tags are usually repeated with the same attributes, every
+    # distinct tag is parsed once and its dict shared by its segments
+    keys = {}
+    byte_range = None
+    byte_range_end = 0
+    discontinuity = False
+    ad = False
+    for line in m3u8_doc.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('#'):
+            segments.append(M3U8Segment(
+                resolve(line), duration, media_sequence, byte_range, key,
+                discontinuity, ad))
+            media_sequence += 1
+            duration = None
+            byte_range = None
+            discontinuity = False
+        elif line.startswith('#EXTINF:'):
+            try:
+                duration = float(line[8:].split(',', 1)[0])
+            except ValueError:
+                duration = None
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length, _, offset = line[17:].partition('@')
+            start = int(offset) if offset else byte_range_end
+            byte_range_end = start + int(length)
+            byte_range = (start, byte_range_end)
+            playlist.has_byte_range = True
+        elif line.startswith('#EXT-X-KEY:'):
+            attributes = line[11:]
+            key = keys.get(attributes)
+            if key is None:
+                key = parse_m3u8_attributes(attributes)
+                method = key.get('METHOD', 'NONE')
+                playlist.key_methods.add(method)
+                if method == 'NONE':
+                    key = no_key
+                else:
+                    if 'IV' in key:
+                        key['IV'] = binascii.unhexlify(key['IV'][2:].zfill(32))
+                    if 'URI' in key:
+                        key['URI'] = resolve(key['URI'])
+                keys[attributes] = key
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-'):
+            discontinuity = True
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            media_sequence = playlist.media_sequence = int(line[22:])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            try:
+                playlist.target_duration = float(line[22:])
+            except ValueError:
+                pass
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist.endlist = True
+        elif _is_ad_segment_start(line):
+            ad = True
+        elif _is_ad_segment_end(line):
+            ad = False
+    return playlist
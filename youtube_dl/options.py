@@ -319,7 +319,8 @@ def parseOpts(overrideArguments=None):
             '>=, <, <=, !=, =) to compare against a number, '
             'key = \'LITERAL\' (like "uploader = \'Mike Smith\'", also works with !=) '
             'to match against a string literal '
-            'and & to require multiple matches. '
+            'and & to require multiple matches, '
+            '|| to accept any of several alternatives (& takes precedence). '
             'Values which are not known are excluded unless you '
             'put a question mark (?) after the operator. '
             'For example, to only match videos that have been liked more than '
@@ -328,6 +329,14 @@ def parseOpts(overrideArguments=None):
             'also have a description, use --match-filter '
             '"like_count > 100 & dislike_count <? 50 & description" .'
         ))
+    selection.add_option(
+        '--match-filter-early',
+        action='store_true', dest='match_filter_early', default=False,
+        help=(
+            'Also apply --match-filter to the playlist entries before '
+            'extracting them, when they have all the fields the filter tests '
+            '(the fields of the entries may not be as accurate as the ones of '
+            'the extracted videos)'))
     selection.add_option(
         '--no-playlist',
         action='store_true', dest='noplaylist', default=False,
@@ -344,6 +353,13 @@ def parseOpts(overrideArguments=None):
         '--download-archive', metavar='FILE',
         dest='download_archive',
         help='Download only videos not listed in the archive file. Record the IDs of all downloaded videos in it.')
+    selection.add_option(
+        '--break-on-archived',
+        metavar='NUMBER', dest='break_on_archived', default=None, type=int,
+        help=(
+            'Stop looking for playlist entries after NUMBER consecutive entries '
+            'already listed in the download archive file, e.g. for channels '
+            'listing their newest videos first'))
     selection.add_option(
         '--include-ads',
         dest='include_ads', action='store_true',
@@ -474,6 +490,10 @@ def parseOpts(overrideArguments=None):
         '--keep-fragments',
         action='store_true', dest='keep_fragments', default=False,
         help='Keep downloaded fragments on disk after downloading is finished; fragments are erased by default')
+    downloader.add_option(
+        '--concurrent-fragments',
+        dest='concurrent_fragment_downloads', metavar='N', default=1, type=int,
+        help='Number of fragments to download concurrently (default is %default) (DASH, hlsnative, ISM and f4m)')
     downloader.add_option(
         '--buffer-size',
         dest='buffersize', metavar='SIZE', default='1024',
@@ -487,6 +507,16 @@ def parseOpts(overrideArguments=None):
         dest='http_chunk_size', metavar='SIZE', default=None,
         help='Size of a chunk for chunk-based HTTP downloading (e.g. 10485760 or 10M) (default is disabled). '
              'May be useful for bypassing bandwidth throttling imposed by a webserver (experimental)')
+    downloader.add_option(
+        '--http-chunks',
+        dest='http_chunks', metavar='N', default=1, type=int,
+        help='Number of connections used to download a file in byte ranges when the server supports it '
+             '(default is %default) (native HTTP downloader only)')
+    downloader.add_option(
+        '--preallocate',
+        action='store_true', dest='preallocate', default=False,
+        help='Reserve the disk space of a file before downloading it when its size is known '
+             '(only for the native HTTP downloader on systems supporting posix_fallocate)')
     downloader.add_option(
         '--test',
         action='store_true', dest='test', default=False,
@@ -499,6 +529,10 @@ def parseOpts(overrideArguments=None):
         '--playlist-random',
         action='store_true',
         help='Download playlist videos in random order')
+    downloader.add_option(
+        '--parallel-entries',
+        dest='parallel_entries', metavar='N', default=1, type=int,
+        help='Number of playlist videos to extract and download concurrently (default is %default)')
     downloader.add_option(
         '--xattr-set-filesize',
         dest='xattr_set_filesize', action='store_true',
@@ -511,6 +545,17 @@ def parseOpts(overrideArguments=None):
         '--hls-prefer-ffmpeg',
         dest='hls_prefer_native', action='store_false', default=None,
         help='Use ffmpeg instead of the native HLS downloader')
+    downloader.add_option(
+        '--live-from-start',
+        action='store_true', dest='live_from_start', default=False,
+        help='Download live HLS streams with the native HLS downloader, starting with '
+             'the oldest segment of the playlist. Without this option and --live-window, live HLS '
+             'streams are downloaded with ffmpeg')
+    downloader.add_option(
+        '--live-window',
+        dest='live_window', metavar='N', default=None, type=int,
+        help='Download live HLS streams with the native HLS downloader, starting with '
+             'the N most recent segments of the playlist')
     downloader.add_option(
         '--hls-use-mpegts',
         dest='hls_use_mpegts', action='store_true',
@@ -854,6 +899,11 @@ def parseOpts(overrideArguments=None):
         '--exec',
         metavar='CMD', dest='exec_cmd',
         help='Execute a command on the file after downloading and post-processing, similar to find\'s -exec syntax. Example: --exec \'adb push {} /sdcard/Music/ && rm {}\'')
+    postproc.add_option(
+        '--postprocessor-workers',
+        dest='postprocessor_workers', metavar='N', default=0, type=int,
+        help='Post-process up to N videos in the background while the next ones are downloaded '
+             '(default is %default: post-process every video before downloading the next one)')
     postproc.add_option(
         '--convert-subs', '--convert-subtitles',
         metavar='FORMAT', dest='convertsubtitles', default=None,
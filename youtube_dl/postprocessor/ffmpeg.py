@@ -245,6 +245,167 @@ class FFmpegPostProcessor(PostProcessor):
         # Also leave '-' intact in order not to break streaming to stdout.
         return 'file:' + fn if fn != '-' else fn
 
+    def _run_command(self, command, filename):
+        """Run the ffmpeg command planned by one or more fusable
+        postprocessors and replace filename with its output"""
+        for message in command.messages:
+            self._downloader.to_screen(message)
+        temp_filename = prepend_extension(filename, 'temp')
+        self.run_ffmpeg_multiple_files(command.input_paths, temp_filename, command.opts())
+        for temp_file in command.temp_files:
+            os.remove(temp_file)
+        # There is no file yet when the formats have just been merged
+        if os.path.exists(encodeFilename(filename)):
+            os.remove(encodeFilename(filename))
+        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+
+
+class _FFmpegCommand(object):
+    """An ffmpeg invocation rewriting the downloaded file, to which several
+    postprocessors can add their step so that the file is rewritten once"""
+
+    def __init__(self):
+        self.input_paths = []
+        self.maps = []
+        self.codec_options = ['-c', 'copy']
+        self.options = []
+        self.temp_files = []
+        self.messages = []
+
+    @property
+    def steps(self):
+        return len(self.messages)
+
+    def add_input(self, path):
+        """Add an input file and return its index"""
+        self.input_paths.append(path)
+        return len(self.input_paths) - 1
+
+    def opts(self):
+        # Per stream codec options must come after the global '-c copy'
+        return self.maps + self.codec_options + self.options
+
+
+class FFmpegFusablePostProcessor(FFmpegPostProcessor):
+    """Base class of the postprocessors which can share an ffmpeg invocation
+
+    Subclasses implement _plan(info, command), which adds the step of the
+    postprocessor to the _FFmpegCommand and returns (files_to_delete, info)
+    like run(), or returns None if the step cannot be added to a command
+    already holding other steps. A step with nothing to do must leave the
+    command untouched.
+    """
+
+    def run(self, info):
+        command = _FFmpegCommand()
+        files_to_delete, info = self._plan(info, command)
+        if command.steps:
+            self._run_command(command, info['filepath'])
+        return files_to_delete, info
+
+    def _plan(self, info, command):
+        raise NotImplementedError('This method must be implemented by subclasses')
+
+
+class FFmpegFusedPP(PostProcessor):
+    """Run consecutive fusable postprocessors with as few ffmpeg
+    invocations as possible, a new one being started whenever a step
+    cannot be added to the current command
+
+    When a step fails, the PostProcessingError raised has a files_to_delete
+    attribute listing the files left to delete by the steps done before.
+    """
+
+    def __init__(self, downloader, pps):
+        PostProcessor.__init__(self, downloader)
+        self._pps = pps
+
+    def run(self, info):
+        files_to_delete = []
+        # The state of the command being planned: the info it has been
+        # started from, its steps and the files they leave to delete
+        command = _FFmpegCommand()
+        start_info, steps, command_files = info, [], []
+        try:
+            for pp in self._pps:
+                num_steps = command.steps
+                planned = pp._plan(info, command)
+                if planned is None:
+                    command_files, info = self._run_fused_command(
+                        command, steps, start_info, command_files, info)
+                    files_to_delete.extend(command_files)
+                    command = _FFmpegCommand()
+                    start_info, steps, command_files = info, [], []
+                    num_steps = 0
+                    planned = pp._plan(info, command)
+                step_files, info = planned
+                command_files.extend(step_files)
+                if command.steps > num_steps:
+                    steps.append(pp)
+            command_files, info = self._run_fused_command(
+                command, steps, start_info, command_files, info)
+        except PostProcessingError as err:
+            err.files_to_delete = files_to_delete + getattr(err, 'files_to_delete', [])
+            raise
+        files_to_delete.extend(command_files)
+        return files_to_delete, info
+
+    def _run_fused_command(self, command, steps, start_info, files_to_delete, info):
+        """Run command, planned by the postprocessors in steps from
+        start_info, or each of these postprocessors on its own if ffmpeg
+        rejects the command: a step failing (e.g. because of a subtitles
+        file ffmpeg can not read) must not prevent the others (e.g. the
+        merge of the formats) from being done"""
+        if not command.steps:
+            return files_to_delete, info
+        try:
+            self._pps[0]._run_command(command, info['filepath'])
+            return files_to_delete, info
+        except PostProcessingError as err:
+            if len(steps) < 2:
+                raise
+            self._downloader.report_warning(
+                'Unable to run the postprocessors in a single ffmpeg invocation (%s), '
+                'running them one by one' % err.msg)
+        for temp_file in command.temp_files:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        files_to_delete, info = [], start_info
+        for pp in steps:
+            try:
+                step_files, info = pp.run(info)
+            except PostProcessingError as err:
+                # As if the steps had been run by postprocessors of their own
+                err.files_to_delete = files_to_delete
+                raise
+            files_to_delete.extend(step_files)
+        return files_to_delete, info
+
+
+def _is_fusable(pp):
+    # Subclasses overriding run() have to be run on their own
+    return (isinstance(pp, FFmpegFusablePostProcessor)
+            and type(pp).run == FFmpegFusablePostProcessor.run)
+
+
+def fuse_ffmpeg_postprocessors(pps):
+    """Return the postprocessor chain pps with each run of consecutive
+    fusable postprocessors replaced by a FFmpegFusedPP"""
+    chain = []
+    group = []
+    for pp in pps + [None]:
+        if pp is not None and _is_fusable(pp):
+            group.append(pp)
+            continue
+        if len(group) > 1:
+            chain.append(FFmpegFusedPP(group[0]._downloader, group))
+        else:
+            chain.extend(group)
+        group = []
+        if pp is not None:
+            chain.append(pp)
+    return chain
+
 
 class FFmpegExtractAudioPP(FFmpegPostProcessor):
     def __init__(self, downloader=None, preferredcodec=None, preferredquality=None, nopostoverwrites=False):
@@ -372,8 +533,8 @@ class FFmpegVideoConvertorPP(FFmpegPostProcessor):
         return [path], information
 
 
-class FFmpegEmbedSubtitlePP(FFmpegPostProcessor):
-    def run(self, information):
+class FFmpegEmbedSubtitlePP(FFmpegFusablePostProcessor):
+    def _plan(self, information, command):
         if information['ext'] not in ('mp4', 'webm', 'mkv'):
             self._downloader.to_screen('[ffmpeg] Subtitles can only be embedded in mp4, webm or mkv files')
             return [], information
@@ -402,36 +563,35 @@ class FFmpegEmbedSubtitlePP(FFmpegPostProcessor):
         if not sub_langs:
             return [], information
 
-        input_files = [filename] + sub_filenames
-
-        opts = [
-            '-map', '0',
-            '-c', 'copy',
-            # Don't copy the existing subtitles, we may be running the
-            # postprocessor a second time
-            '-map', '-0:s',
-            # Don't copy Apple TV chapters track, bin_data (see #19042, #19024,
-            # https://trac.ffmpeg.org/ticket/6016)
-            '-map', '-0:d',
-        ]
+        if command.steps and command.codec_options != ['-c', 'copy']:
+            return None
+
+        if not command.input_paths:
+            command.add_input(filename)
+        if not command.maps:
+            command.maps.extend([
+                '-map', '0',
+                # Don't copy the existing subtitles, we may be running the
+                # postprocessor a second time
+                '-map', '-0:s',
+                # Don't copy Apple TV chapters track, bin_data (see #19042, #19024,
+                # https://trac.ffmpeg.org/ticket/6016)
+                '-map', '-0:d',
+            ])
         if information['ext'] == 'mp4':
-            opts += ['-c:s', 'mov_text']
-        for (i, lang) in enumerate(sub_langs):
-            opts.extend(['-map', '%d:0' % (i + 1)])
+            command.options.extend(['-c:s', 'mov_text'])
+        for (i, (lang, sub_filename)) in enumerate(zip(sub_langs, sub_filenames)):
+            command.maps.extend(['-map', '%d:0' % command.add_input(sub_filename)])
             lang_code = ISO639Utils.short2long(lang) or lang
-            opts.extend(['-metadata:s:s:%d' % i, 'language=%s' % lang_code])
+            command.options.extend(['-metadata:s:s:%d' % i, 'language=%s' % lang_code])
 
-        temp_filename = prepend_extension(filename, 'temp')
-        self._downloader.to_screen('[ffmpeg] Embedding subtitles in \'%s\'' % filename)
-        self.run_ffmpeg_multiple_files(input_files, temp_filename, opts)
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+        command.messages.append('[ffmpeg] Embedding subtitles in \'%s\'' % filename)
 
         return sub_filenames, information
 
 
-class FFmpegMetadataPP(FFmpegPostProcessor):
-    def run(self, info):
+class FFmpegMetadataPP(FFmpegFusablePostProcessor):
+    def _plan(self, info, command):
         metadata = {}
 
         def add(meta_list, info_list=None):
@@ -474,17 +634,18 @@ class FFmpegMetadataPP(FFmpegPostProcessor):
             return [], info
 
         filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-        in_filenames = [filename]
-        options = []
 
         if info['ext'] == 'm4a':
-            options.extend(['-vn', '-acodec', 'copy'])
-        else:
-            options.extend(['-c', 'copy'])
+            # Other steps expect all the streams to be copied
+            if command.steps:
+                return None
+            command.codec_options = ['-vn', '-acodec', 'copy']
+
+        if not command.input_paths:
+            command.add_input(filename)
 
         for (name, value) in metadata.items():
-            options.extend(['-metadata', '%s=%s' % (name, value)])
+            command.options.extend(['-metadata', '%s=%s' % (name, value)])
 
         chapters = info.get('chapters', [])
         if chapters:
@@ -502,26 +663,24 @@ class FFmpegMetadataPP(FFmpegPostProcessor):
                     if chapter_title:
                         metadata_file_content += 'title=%s\n' % ffmpeg_escape(chapter_title)
                 f.write(metadata_file_content)
-                in_filenames.append(metadata_filename)
-                options.extend(['-map_metadata', '1'])
+                command.options.extend([
+                    '-map_metadata', '%d' % command.add_input(metadata_filename)])
+                command.temp_files.append(metadata_filename)
 
-        self._downloader.to_screen('[ffmpeg] Adding metadata to \'%s\'' % filename)
-        self.run_ffmpeg_multiple_files(in_filenames, temp_filename, options)
-        if chapters:
-            os.remove(metadata_filename)
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+        command.messages.append('[ffmpeg] Adding metadata to \'%s\'' % filename)
         return [], info
 
 
-class FFmpegMergerPP(FFmpegPostProcessor):
-    def run(self, info):
-        filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-        args = ['-c', 'copy', '-map', '0:v:0', '-map', '1:a:0']
-        self._downloader.to_screen('[ffmpeg] Merging formats into "%s"' % filename)
-        self.run_ffmpeg_multiple_files(info['__files_to_merge'], temp_filename, args)
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+class FFmpegMergerPP(FFmpegFusablePostProcessor):
+    def _plan(self, info, command):
+        # The merged file is the input of the other steps
+        if command.steps:
+            return None
+        video_input, audio_input = [
+            command.add_input(path) for path in info['__files_to_merge']]
+        command.maps.extend([
+            '-map', '%d:v:0' % video_input, '-map', '%d:a:0' % audio_input])
+        command.messages.append('[ffmpeg] Merging formats into "%s"' % info['filepath'])
         return info['__files_to_merge'], info
 
     def can_merge(self):
@@ -542,39 +701,31 @@ class FFmpegMergerPP(FFmpegPostProcessor):
         return True
 
 
-class FFmpegFixupStretchedPP(FFmpegPostProcessor):
-    def run(self, info):
+class FFmpegFixupStretchedPP(FFmpegFusablePostProcessor):
+    def _plan(self, info, command):
         stretched_ratio = info.get('stretched_ratio')
         if stretched_ratio is None or stretched_ratio == 1:
             return [], info
 
         filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-
-        options = ['-c', 'copy', '-aspect', '%f' % stretched_ratio]
-        self._downloader.to_screen('[ffmpeg] Fixing aspect ratio in "%s"' % filename)
-        self.run_ffmpeg(filename, temp_filename, options)
-
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+        if not command.input_paths:
+            command.add_input(filename)
+        command.options.extend(['-aspect', '%f' % stretched_ratio])
+        command.messages.append('[ffmpeg] Fixing aspect ratio in "%s"' % filename)
 
         return [], info
 
 
-class FFmpegFixupM4aPP(FFmpegPostProcessor):
-    def run(self, info):
+class FFmpegFixupM4aPP(FFmpegFusablePostProcessor):
+    def _plan(self, info, command):
         if info.get('container') != 'm4a_dash':
             return [], info
 
         filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-
-        options = ['-c', 'copy', '-f', 'mp4']
-        self._downloader.to_screen('[ffmpeg] Correcting container in "%s"' % filename)
-        self.run_ffmpeg(filename, temp_filename, options)
-
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+        if not command.input_paths:
+            command.add_input(filename)
+        command.options.extend(['-f', 'mp4'])
+        command.messages.append('[ffmpeg] Correcting container in "%s"' % filename)
 
         return [], info
 
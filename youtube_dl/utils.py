@@ -15,7 +15,6 @@ import email.utils
 import email.header
 import errno
 import functools
-import gzip
 import io
 import itertools
 import json
@@ -26,17 +25,20 @@ import os
 import platform
 import random
 import re
+import select
 import socket
 import ssl
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import xml.etree.ElementTree
 import zlib
 
 from .compat import (
+    compat_brotli,
     compat_HTMLParseError,
     compat_HTMLParser,
     compat_basestring,
@@ -53,6 +55,7 @@ from .compat import (
     compat_os_name,
     compat_parse_qs,
     compat_shlex_quote,
+    compat_sre_parse,
     compat_str,
     compat_struct_pack,
     compat_struct_unpack,
@@ -64,6 +67,7 @@ from .compat import (
     compat_urllib_request,
     compat_urlparse,
     compat_xpath,
+    compat_zip,
 )
 
 from .socks import (
@@ -1672,7 +1676,7 @@ std_headers = {
     'User-Agent': random_user_agent(),
     'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Encoding': 'gzip, deflate, br' if compat_brotli else 'gzip, deflate',
     'Accept-Language': 'en-us,en;q=0.5',
 }
 
@@ -2545,6 +2549,274 @@ def handle_youtubedl_headers(headers):
     return filtered_headers
 
 
+class _KeepAliveHTTPResponse(compat_http_client.HTTPResponse):
+    """HTTPResponse that hands its connection back to the pool once read"""
+
+    _ytdl_release = None
+    _ytdl_trailer_read = False
+    _ytdl_reading_chunked = False
+
+    def _ytdl_done(self):
+        release, self._ytdl_release = self._ytdl_release, None
+        if release:
+            # The connection can only be reused if the body has been read
+            # completely, otherwise the rest of it is still on the wire
+            release((self.length == 0 or self._ytdl_trailer_read) and not self.will_close)
+
+    def _close_conn(self):  # Python 3
+        compat_http_client.HTTPResponse._close_conn(self)
+        self._ytdl_done()
+
+    def _read_and_discard_trailer(self):  # Python 3
+        compat_http_client.HTTPResponse._read_and_discard_trailer(self)
+        self._ytdl_trailer_read = True
+
+    def _read_chunked(self, amt=None):
+        # Python 2 has no trailer hook: the response is only closed while
+        # reading chunks once the last chunk and the trailer have been read
+        self._ytdl_reading_chunked = True
+        try:
+            return compat_http_client.HTTPResponse._read_chunked(self, amt)
+        finally:
+            self._ytdl_reading_chunked = False
+
+    def close(self):
+        if self._ytdl_reading_chunked:
+            self._ytdl_trailer_read = True
+        compat_http_client.HTTPResponse.close(self)
+        self._ytdl_done()
+
+
+class HTTPConnectionPool(object):
+    """Keep-alive pool of idle HTTP(S) connections
+
+    Connections are keyed by scheme, host, port, proxy and source address
+    and are handed back to the pool when their response has been read
+    completely, so that subsequent requests to the same host (web pages,
+    API calls, fragments) skip the TCP and TLS handshakes.
+    """
+
+    _MAX_IDLE_PER_KEY = 16
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_stale(conn):
+        sock = conn.sock
+        if sock is None:
+            return True
+        try:
+            # An idle connection must not have anything to read: either the
+            # server has closed it or it has sent garbage
+            return bool(select.select([sock], [], [], 0)[0])
+        except (socket.error, ValueError, TypeError):
+            return True
+
+    def _acquire(self, key):
+        with self._lock:
+            conns = self._idle.get(key)
+            while conns:
+                conn = conns.pop()
+                if not self._is_stale(conn):
+                    return conn
+                conn.close()
+
+    def _release(self, key, conn, reusable):
+        if reusable and conn.sock is not None:
+            with self._lock:
+                conns = self._idle.setdefault(key, [])
+                if len(conns) < self._MAX_IDLE_PER_KEY:
+                    conns.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def open(self, handler, http_class, req, key, **http_conn_args):
+        """Replacement for AbstractHTTPHandler.do_open using pooled connections"""
+        # Python 2 requests have a host attribute as well, which is only
+        # set by get_host()
+        host = req.get_host() if hasattr(req, 'get_host') else req.host
+        if not host:
+            raise compat_urllib_error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict(
+            (k, v) for k, v in req.headers.items() if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        tunnel_headers = {}
+        if tunnel_host:
+            proxy_auth_hdr = 'Proxy-Authorization'
+            if proxy_auth_hdr in headers:
+                tunnel_headers[proxy_auth_hdr] = headers.pop(proxy_auth_hdr)
+
+        key = key + (host.lower(), tunnel_host, tuple(sorted(tunnel_headers.items())))
+        selector = req.get_selector() if hasattr(req, 'get_selector') else req.selector
+        request_kwargs = {}
+        if sys.version_info >= (3, 6):
+            request_kwargs['encode_chunked'] = req.has_header('Transfer-encoding')
+
+        while True:
+            conn = self._acquire(key)
+            reused = conn is not None
+            if reused:
+                conn.timeout = req.timeout
+                if req.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    conn.sock.settimeout(req.timeout)
+            else:
+                conn = http_class(host, timeout=req.timeout, **http_conn_args)
+                conn.response_class = _KeepAliveHTTPResponse
+                if tunnel_host:
+                    set_tunnel = getattr(conn, 'set_tunnel', None) or conn._set_tunnel
+                    set_tunnel(tunnel_host, headers=tunnel_headers)
+            conn.set_debuglevel(handler._debuglevel)
+            try:
+                conn.request(
+                    req.get_method(), selector, req.data, headers,
+                    **compat_kwargs(request_kwargs))
+                if sys.version_info >= (3, 0):
+                    r = conn.getresponse()
+                else:
+                    try:
+                        r = conn.getresponse(buffering=True)
+                    except TypeError:  # Python 2.6
+                        r = conn.getresponse()
+            except (socket.error, compat_http_client.HTTPException) as err:
+                conn.close()
+                # The server may have dropped an idle connection in the
+                # meantime, retry with a new connection unless the request
+                # may have had side effects
+                if (reused and not isinstance(err, socket.timeout)
+                        and req.get_method() in ('GET', 'HEAD')):
+                    continue
+                if isinstance(err, socket.error):
+                    raise compat_urllib_error.URLError(err)
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        if r.will_close:
+            conn.close()
+        else:
+            r._ytdl_release = functools.partial(self._release, key, conn)
+
+        if sys.version_info >= (3, 0):
+            r.url = req.get_full_url()
+            r.msg = r.reason
+            return r
+        r.recv = r.read
+        fp = socket._fileobject(r, close=True)
+        resp = compat_urllib_request.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class _DecodingReader(io.RawIOBase):
+    """Decode a gzip, deflate or br encoded response as it is read
+
+    Only as much of the response as needed for the requested amount of
+    decoded data is read. Junk after the end of the compressed stream is
+    ignored, gzip streams made of several members are supported.
+    """
+
+    _CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fp, encoding):
+        self._fp = fp
+        self._encoding = encoding
+        # Decoded data that has not been returned yet
+        self._buffer = b''
+        # Compressed data that has not been fed to the decoder yet
+        self._pending = b''
+        # Compressed data fed to the decoder before it output anything, it
+        # must be decoded again if the deflate stream turns out to have a
+        # zlib header
+        self._consumed = b''
+        self._output_started = False
+        self._done = False
+        if encoding == 'br':
+            self._decoder = compat_brotli.Decompressor()
+        else:
+            self._decoder = self._zlib_decoder(
+                16 + zlib.MAX_WBITS if encoding == 'gzip' else -zlib.MAX_WBITS)
+
+    def _zlib_decoder(self, wbits):
+        self._wbits = wbits
+        return zlib.decompressobj(wbits)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._done:
+            self._decode(len(b))
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def _decode(self, size):
+        data = self._pending or self._fp.read(self._CHUNK_SIZE)
+        self._pending = b''
+        if not data:
+            self._done = True
+            if self._encoding != 'br':
+                self._buffer = self._decoder.flush()
+                # Python 2 does not tell whether the stream is complete
+                if not getattr(self._decoder, 'eof', True):
+                    raise IOError('Compressed data ended before the end-of-stream marker was reached')
+            return
+
+        if self._encoding == 'br':
+            self._buffer = self._decoder.process(data)
+            return
+
+        try:
+            self._buffer = self._decoder.decompress(data, size)
+        except zlib.error:
+            if self._wbits != -zlib.MAX_WBITS or self._output_started:
+                raise
+            # Not a raw deflate stream, try again with a zlib header
+            self._decoder = self._zlib_decoder(zlib.MAX_WBITS)
+            self._pending = self._consumed + data
+            return
+
+        if not self._output_started:
+            if self._buffer:
+                self._output_started = True
+                self._consumed = b''
+            elif self._wbits == -zlib.MAX_WBITS:
+                self._consumed += data
+        self._pending = self._decoder.unconsumed_tail
+        unused_data = self._decoder.unused_data
+        if unused_data:
+            # End of the compressed stream, what follows is either another
+            # gzip member or junk
+            if self._encoding == 'gzip' and unused_data.startswith(b'\x1f\x8b'):
+                self._decoder = self._zlib_decoder(16 + zlib.MAX_WBITS)
+                self._pending = unused_data
+            else:
+                self._done = True
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+        super(_DecodingReader, self).close()
+
+
 class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
     """Handler for HTTP requests and responses.
 
@@ -2563,9 +2835,10 @@ class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
     public domain.
     """
 
-    def __init__(self, params, *args, **kwargs):
+    def __init__(self, params, connection_pool=None, *args, **kwargs):
         compat_urllib_request.HTTPHandler.__init__(self, *args, **kwargs)
         self._params = params
+        self._connection_pool = connection_pool
 
     def http_open(self, req):
         conn_class = compat_http_client.HTTPConnection
@@ -2575,16 +2848,13 @@ class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
             conn_class = make_socks_conn_class(conn_class, socks_proxy)
             del req.headers['Ytdl-socks-proxy']
 
-        return self.do_open(functools.partial(
-            _create_http_connection, self, conn_class, False),
-            req)
-
-    @staticmethod
-    def deflate(data):
-        try:
-            return zlib.decompress(data, -zlib.MAX_WBITS)
-        except zlib.error:
-            return zlib.decompress(data)
+        http_class = functools.partial(
+            _create_http_connection, self, conn_class, False)
+        if self._connection_pool is None:
+            return self.do_open(http_class, req)
+        return self._connection_pool.open(
+            self, http_class, req,
+            ('http', socks_proxy, self._params.get('source_address')))
 
     def http_request(self, req):
         # According to RFC 3986, URLs can not contain non-ASCII characters, however this is not
@@ -2619,31 +2889,12 @@ class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
 
     def http_response(self, req, resp):
         old_resp = resp
-        # gzip
-        if resp.headers.get('Content-encoding', '') == 'gzip':
-            content = resp.read()
-            gz = gzip.GzipFile(fileobj=io.BytesIO(content), mode='rb')
-            try:
-                uncompressed = io.BytesIO(gz.read())
-            except IOError as original_ioerror:
-                # There may be junk add the end of the file
-                # See http://stackoverflow.com/q/4928560/35070 for details
-                for i in range(1, 1024):
-                    try:
-                        gz = gzip.GzipFile(fileobj=io.BytesIO(content[:-i]), mode='rb')
-                        uncompressed = io.BytesIO(gz.read())
-                    except IOError:
-                        continue
-                    break
-                else:
-                    raise original_ioerror
-            resp = compat_urllib_request.addinfourl(uncompressed, old_resp.headers, old_resp.url, old_resp.code)
-            resp.msg = old_resp.msg
-            del resp.headers['Content-encoding']
-        # deflate
-        if resp.headers.get('Content-encoding', '') == 'deflate':
-            gz = io.BytesIO(self.deflate(resp.read()))
-            resp = compat_urllib_request.addinfourl(gz, old_resp.headers, old_resp.url, old_resp.code)
+        # gzip, deflate and br are decoded as the response is read
+        encoding = resp.headers.get('Content-encoding', '')
+        if encoding in ('gzip', 'deflate') or encoding == 'br' and compat_brotli:
+            resp = compat_urllib_request.addinfourl(
+                io.BufferedReader(_DecodingReader(resp, encoding)),
+                old_resp.headers, old_resp.url, old_resp.code)
             resp.msg = old_resp.msg
             del resp.headers['Content-encoding']
         # Percent-encode redirect URL of Location HTTP header to satisfy RFC 3986 (see
@@ -2712,10 +2963,11 @@ def make_socks_conn_class(base_class, socks_proxy):
 
 
 class YoutubeDLHTTPSHandler(compat_urllib_request.HTTPSHandler):
-    def __init__(self, params, https_conn_class=None, *args, **kwargs):
+    def __init__(self, params, https_conn_class=None, connection_pool=None, *args, **kwargs):
         compat_urllib_request.HTTPSHandler.__init__(self, *args, **kwargs)
         self._https_conn_class = https_conn_class or compat_http_client.HTTPSConnection
         self._params = params
+        self._connection_pool = connection_pool
 
     def https_open(self, req):
         kwargs = {}
@@ -2731,9 +2983,14 @@ class YoutubeDLHTTPSHandler(compat_urllib_request.HTTPSHandler):
             conn_class = make_socks_conn_class(conn_class, socks_proxy)
             del req.headers['Ytdl-socks-proxy']
 
-        return self.do_open(functools.partial(
-            _create_http_connection, self, conn_class, True),
-            req, **kwargs)
+        http_class = functools.partial(
+            _create_http_connection, self, conn_class, True)
+        if self._connection_pool is None:
+            return self.do_open(http_class, req, **kwargs)
+        return self._connection_pool.open(
+            self, http_class, req,
+            ('https', socks_proxy, self._params.get('source_address')),
+            **kwargs)
 
 
 class YoutubeDLCookieJar(compat_cookiejar.MozillaCookieJar):
@@ -3275,12 +3532,12 @@ else:
 
 class locked_file(object):
     def __init__(self, filename, mode, encoding=None):
-        assert mode in ['r', 'a', 'w']
+        assert mode in ['r', 'rb', 'a', 'ab', 'w', 'wb']
         self.f = io.open(filename, mode, encoding=encoding)
         self.mode = mode
 
     def __enter__(self):
-        exclusive = self.mode != 'r'
+        exclusive = self.mode not in ['r', 'rb']
         try:
             _lock_file(self.f, exclusive)
         except IOError:
@@ -3303,6 +3560,9 @@ class locked_file(object):
     def read(self, *args):
         return self.f.read(*args)
 
+    def seek(self, *args):
+        return self.f.seek(*args)
+
 
 def get_filesystem_encoding():
     encoding = sys.getfilesystemencoding()
@@ -3761,6 +4021,14 @@ class PagedList(object):
         # This is only useful for tests
         return len(self.getslice())
 
+    def getslice(self, start=0, end=None):
+        return list(self.iterslice(start, end))
+
+    def iterslice(self, start=0, end=None):
+        """Yield the entries from start to end, only requesting each page
+        when its first entry is needed"""
+        raise NotImplementedError('This method must be implemented by subclasses')
+
 
 class OnDemandPagedList(PagedList):
     def __init__(self, pagefunc, pagesize, use_cache=True):
@@ -3770,8 +4038,7 @@ class OnDemandPagedList(PagedList):
         if use_cache:
             self._cache = {}
 
-    def getslice(self, start=0, end=None):
-        res = []
+    def iterslice(self, start=0, end=None):
         for pagenum in itertools.count(start // self._pagesize):
             firstid = pagenum * self._pagesize
             nextfirstid = pagenum * self._pagesize + self._pagesize
@@ -3798,7 +4065,8 @@ class OnDemandPagedList(PagedList):
 
             if startv != 0 or endv is not None:
                 page_results = page_results[startv:endv]
-            res.extend(page_results)
+            for entry in page_results:
+                yield entry
 
             # A little optimization - if current page is not "full", ie. does
             # not contain page_size videos then we can assume that this page
@@ -3811,7 +4079,6 @@ class OnDemandPagedList(PagedList):
             # break out early as well
             if end == nextfirstid:
                 break
-        return res
 
 
 class InAdvancePagedList(PagedList):
@@ -3820,8 +4087,7 @@ class InAdvancePagedList(PagedList):
         self._pagecount = pagecount
         self._pagesize = pagesize
 
-    def getslice(self, start=0, end=None):
-        res = []
+    def iterslice(self, start=0, end=None):
         start_page = start // self._pagesize
         end_page = (
             self._pagecount if end is None else (end // self._pagesize + 1))
@@ -3836,11 +4102,67 @@ class InAdvancePagedList(PagedList):
                 if len(page) < only_more:
                     only_more -= len(page)
                 else:
-                    page = page[:only_more]
-                    res.extend(page)
+                    for entry in page[:only_more]:
+                        yield entry
                     break
-            res.extend(page)
-        return res
+            for entry in page:
+                yield entry
+
+
+class LazyFragmentList(object):
+    """
+    Read-only list of the fragments of a fragmented format, each fragment
+    dict being generated by fragment_func(index) when it is accessed
+    instead of being stored. If initialization is given, it is the
+    first fragment.
+    """
+
+    def __init__(self, count, fragment_func, initialization=None):
+        self._count = count
+        self._fragment_func = fragment_func
+        self._initialization = initialization
+
+    def __len__(self):
+        return self._count + (1 if self._initialization is not None else 0)
+
+    def _fragment(self, index):
+        if self._initialization is not None:
+            if index == 0:
+                return dict(self._initialization)
+            index -= 1
+        return self._fragment_func(index)
+
+    def __getitem__(self, index):
+        length = len(self)
+        if isinstance(index, slice):
+            return [self._fragment(i) for i in range(*index.indices(length))]
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('fragment index out of range')
+        return self._fragment(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._fragment(index)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, LazyFragmentList)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in compat_zip(self, other))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __deepcopy__(self, memo):
+        # Nothing to copy, the fragments are always generated anew
+        return self
+
+    def __repr__(self):
+        return '<LazyFragmentList of %d fragments>' % len(self)
 
 
 def uppercase_escape(s):
@@ -3878,6 +4200,237 @@ def escape_url(url):
     ).geturl()
 
 
+def _sre_op_name(op):
+    # Opcodes are named integer constants on Python 3 and strings on Python 2
+    return compat_str(op).upper()
+
+
+def _sre_expand(items, limit):
+    """
+    Return the set of strings matched by a parsed regular expression
+    or None if it's not finite or larger than limit.
+    """
+    results = set([''])
+    for op, av in items:
+        op = _sre_op_name(op)
+        if op == 'LITERAL':
+            choices = set([compat_chr(av)])
+        elif op == 'IN':
+            choices = set()
+            for in_op, in_av in av:
+                in_op = _sre_op_name(in_op)
+                if in_op == 'LITERAL':
+                    choices.add(compat_chr(in_av))
+                elif in_op == 'RANGE' and in_av[1] - in_av[0] < limit:
+                    choices.update(compat_chr(c) for c in range(in_av[0], in_av[1] + 1))
+                else:
+                    return None
+        elif op == 'SUBPATTERN':
+            choices = _sre_expand(av[-1], limit)
+        elif op == 'BRANCH':
+            choices = set()
+            for alternative in av[1]:
+                alternative_choices = _sre_expand(alternative, limit)
+                if alternative_choices is None:
+                    return None
+                choices.update(alternative_choices)
+        elif op in ('MAX_REPEAT', 'MIN_REPEAT') and av[1] <= 1:
+            choices = _sre_expand(av[2], limit) if av[1] == 1 else set([''])
+            if choices is not None and av[0] == 0:
+                choices.add('')
+        elif op == 'AT' and _sre_op_name(av) in ('AT_BEGINNING', 'AT_BEGINNING_STRING'):
+            continue
+        else:
+            return None
+        if choices is None:
+            return None
+        results = set(r + c for r in results for c in choices)
+        if len(results) > limit:
+            return None
+    return results
+
+
+def _sre_separator_follows(items):
+    """
+    Whether the parsed regular expression can only match strings that are
+    either empty at the end of the input or start with /, ? or #.
+    """
+    if not items:
+        return False
+    op, av = items[0]
+    op = _sre_op_name(op)
+    if op == 'LITERAL':
+        return compat_chr(av) in '/?#'
+    elif op == 'IN':
+        return all(
+            _sre_op_name(in_op) == 'LITERAL' and compat_chr(in_av) in '/?#'
+            for in_op, in_av in av)
+    elif op == 'AT':
+        return (_sre_op_name(av) in ('AT_END', 'AT_END_STRING')
+                or _sre_separator_follows(items[1:]))
+    elif op in ('ASSERT', 'ASSERT_NOT'):
+        # Zero-width
+        return _sre_separator_follows(items[1:])
+    elif op == 'SUBPATTERN':
+        return _sre_separator_follows(list(av[-1]) + list(items[1:]))
+    elif op == 'BRANCH':
+        return all(
+            _sre_separator_follows(list(alternative) + list(items[1:]))
+            for alternative in av[1])
+    elif op in ('MAX_REPEAT', 'MIN_REPEAT'):
+        min_count, max_count, sub = av
+        if min_count == 0 and not _sre_separator_follows(items[1:]):
+            return False
+        return max_count == 0 or _sre_separator_follows(list(sub) + list(items[1:]))
+    return False
+
+
+def _sre_ends_with_dot(items):
+    """
+    Return 'dot' if the parsed regular expression only matches strings
+    ending with a dot, 'optional' if it may also match the empty string
+    and None otherwise.
+    """
+    for op, av in reversed(items):
+        op = _sre_op_name(op)
+        if op == 'LITERAL':
+            result = 'dot' if compat_chr(av) == '.' else None
+        elif op == 'IN':
+            result = 'dot' if all(
+                _sre_op_name(in_op) == 'LITERAL' and compat_chr(in_av) == '.'
+                for in_op, in_av in av) else None
+        elif op in ('AT', 'ASSERT', 'ASSERT_NOT'):
+            result = 'optional'
+        elif op == 'SUBPATTERN':
+            result = _sre_ends_with_dot(av[-1])
+        elif op == 'BRANCH':
+            results = [_sre_ends_with_dot(alternative) for alternative in av[1]]
+            result = (
+                None if None in results
+                else 'optional' if 'optional' in results else 'dot')
+        elif op in ('MAX_REPEAT', 'MIN_REPEAT'):
+            result = _sre_ends_with_dot(av[2]) if av[1] > 0 else 'optional'
+            if result is not None and av[0] == 0:
+                result = 'optional'
+        else:
+            result = None
+        if result != 'optional':
+            return result
+    return 'optional'
+
+
+def url_pattern_host_suffixes(pattern, limit=256):
+    """
+    Analyze a URL regular expression (e.g. an extractor's _VALID_URL) and
+    return a set of lowercase strings such that any URL matched by pattern
+    contains one of them, right before a /, ? or # or the end of the URL,
+    starting either at the beginning of the host or at or after a dot.
+    This is usually the domain part of the URL. Returns None if no such set
+    can be determined. See url_host_suffix_keys for the lookup side.
+    """
+    try:
+        items = list(compat_sre_parse.parse(pattern))
+    except Exception:
+        return None
+    suffixes = _url_items_host_suffixes(items, limit)
+    if suffixes is None:
+        return None
+    suffixes = set(suffix.lower() for suffix in suffixes)
+    # Require at least a second-level domain to be useful
+    if not all(re.search(r'[^.]\.', suffix) for suffix in suffixes):
+        return None
+    return suffixes
+
+
+def _url_items_host_suffixes(items, limit, depth=0):
+    # Optional URL scheme and //
+    scheme_end = 0
+    prefixes = set([''])
+    for i, item in enumerate(items):
+        choices = _sre_expand([item], limit)
+        if choices is None:
+            break
+        prefixes = set(p + c for p in prefixes for c in choices)
+        if not all(re.match(r'(?i)^(?:[a-z][a-z0-9+.-]*:?/{0,2})?$', prefix) for prefix in prefixes):
+            break
+        if all(re.match(r'(?i)^(?:(?:[a-z][a-z0-9+.-]*:)?//)?$', prefix) for prefix in prefixes):
+            scheme_end = i + 1
+
+    def split_alternatives():
+        # The host may be part of a group with alternatives, e.g.
+        # https?://(?:www\.foo\.com/video|player\.foo\.com)/
+        if depth > 2 or scheme_end == len(items):
+            return None
+        op, av = items[scheme_end]
+        op = _sre_op_name(op)
+        if op == 'SUBPATTERN':
+            alternatives = [av[-1]]
+            if len(av[-1]) == 1 and _sre_op_name(av[-1][0][0]) == 'BRANCH':
+                alternatives = av[-1][0][1][1]
+        elif op == 'BRANCH':
+            alternatives = av[1]
+        elif op in ('MAX_REPEAT', 'MIN_REPEAT') and av[1] == 1:
+            alternatives = [av[2]] + ([[]] if av[0] == 0 else [])
+        else:
+            return None
+        suffixes = set()
+        for alternative in alternatives:
+            alternative_suffixes = _url_items_host_suffixes(
+                items[:scheme_end] + list(alternative) + items[scheme_end + 1:],
+                limit, depth + 1)
+            if alternative_suffixes is None:
+                return None
+            suffixes.update(alternative_suffixes)
+        return suffixes
+
+    for host_end in range(scheme_end + 1, len(items) + 1):
+        if _sre_separator_follows(items[host_end:]):
+            break
+    else:
+        return split_alternatives()
+
+    suffixes = set([''])
+    for i in range(host_end - 1, scheme_end - 1, -1):
+        choices = _sre_expand(items[i:i + 1], limit)
+        if choices is None:
+            # Whatever precedes the suffixes should end with a dot unless
+            # they start with it
+            if (not all(suffix.startswith('.') for suffix in suffixes)
+                    and _sre_ends_with_dot(items[scheme_end:i + 1]) is None):
+                return split_alternatives()
+            break
+        suffixes = set(c + suffix for c in choices for suffix in suffixes)
+        if len(suffixes) > limit:
+            return split_alternatives()
+    if not all(re.search(r'[^.]\.', suffix) for suffix in suffixes):
+        return split_alternatives()
+    return suffixes
+
+
+def url_host_suffix_keys(url, max_length):
+    """
+    Return all the substrings of url that may be one of the strings
+    returned by url_pattern_host_suffixes for a pattern matching url.
+    """
+    url = url.lower()
+    starts = [0]
+    scheme_sep = url.find('//')
+    if scheme_sep != -1:
+        starts.append(scheme_sep + 2)
+    for i, c in enumerate(url):
+        if c == '.':
+            starts.extend((i, i + 1))
+    ends = [i for i, c in enumerate(url) if c in '/?#']
+    if not ends or ends[-1] != len(url) - 1:
+        ends.append(len(url))
+    keys = set()
+    for end in ends:
+        for start in starts:
+            if start < end and end - start <= max_length:
+                keys.add(url[start:end])
+    return keys
+
+
 def read_batch_urls(batch_fd):
     def fixup(url):
         if not isinstance(url, compat_str):
@@ -4304,6 +4857,102 @@ def determine_protocol(info_dict):
     return compat_urllib_parse_urlparse(url).scheme
 
 
+# Extension preferences of formats_sort_key, the higher the better
+_FORMATS_EXT_PREFERENCE = {
+    # (audio only, prefer free formats)
+    (False, False): dict((ext, i) for i, ext in enumerate(['webm', 'flv', 'mp4'])),
+    (False, True): dict((ext, i) for i, ext in enumerate(['flv', 'mp4', 'webm'])),
+    (True, False): dict((ext, i) for i, ext in enumerate(['webm', 'opus', 'ogg', 'mp3', 'aac', 'm4a'])),
+    (True, True): dict((ext, i) for i, ext in enumerate(['aac', 'mp3', 'm4a', 'webm', 'ogg', 'opus'])),
+}
+
+
+def formats_sort_key(prefer_free_formats=False, field_preference=None):
+    """
+    Return the key function sorting format dicts from worst to best, as
+    InfoExtractor._sort_formats does. field_preference is an optional list
+    of the fields to sort by, in place of the default preferences.
+    The key function fills the missing 'ext' fields in from the URLs.
+    """
+    if isinstance(field_preference, (list, tuple)):
+        def field_preference_key(f):
+            if not f.get('ext') and 'url' in f:
+                f['ext'] = determine_ext(f['url'])
+            return tuple(
+                f.get(field)
+                if f.get(field) is not None
+                else ('' if field == 'format_id' else -1)
+                for field in field_preference)
+        return field_preference_key
+
+    video_ext_preference = _FORMATS_EXT_PREFERENCE[(False, bool(prefer_free_formats))]
+    audio_ext_preference = _FORMATS_EXT_PREFERENCE[(True, bool(prefer_free_formats))]
+
+    def key(f):
+        get = f.get
+        ext = get('ext')
+        if not ext and 'url' in f:
+            ext = f['ext'] = determine_ext(f['url'])
+
+        preference = get('preference')
+        if preference is None:
+            preference = 0
+            if ext in ('f4f', 'f4m'):  # Not yet supported
+                preference -= 0.5
+
+        protocol = get('protocol')
+        if protocol is None:
+            url = f['url']
+            # Spare parsing the URLs of the usual HTTP formats
+            if url.startswith(('http://', 'https://')) and determine_ext(url) not in ('m3u8', 'f4m'):
+                protocol = 'http'
+            else:
+                protocol = determine_protocol(f)
+        proto_preference = 0 if protocol in ('http', 'https') else (-0.5 if protocol == 'rtsp' else -0.1)
+
+        if get('vcodec') == 'none':  # audio only
+            preference -= 50
+            ext_preference = 0
+            audio_ext = audio_ext_preference.get(ext, -1)
+        else:
+            if get('acodec') == 'none':  # video only
+                preference -= 40
+            ext_preference = video_ext_preference.get(ext, -1)
+            audio_ext = 0
+
+        language_preference = get('language_preference')
+        quality = get('quality')
+        tbr = get('tbr')
+        filesize = get('filesize')
+        vbr = get('vbr')
+        height = get('height')
+        width = get('width')
+        abr = get('abr')
+        fps = get('fps')
+        filesize_approx = get('filesize_approx')
+        source_preference = get('source_preference')
+        format_id = get('format_id')
+        return (
+            preference,
+            -1 if language_preference is None else language_preference,
+            -1 if quality is None else quality,
+            -1 if tbr is None else tbr,
+            -1 if filesize is None else filesize,
+            -1 if vbr is None else vbr,
+            -1 if height is None else height,
+            -1 if width is None else width,
+            proto_preference,
+            ext_preference,
+            -1 if abr is None else abr,
+            audio_ext,
+            -1 if fps is None else fps,
+            -1 if filesize_approx is None else filesize_approx,
+            -1 if source_preference is None else source_preference,
+            '' if format_id is None else format_id,
+        )
+    return key
+
+
 def render_table(header_row, data):
     """ Render a list of rows, each as a list of values """
     table = [header_row] + data
@@ -4312,86 +4961,162 @@ def render_table(header_row, data):
     return '\n'.join(format_str % tuple(row) for row in table)
 
 
-def _match_one(filter_part, dct):
-    COMPARISON_OPERATORS = {
-        '<': operator.lt,
-        '<=': operator.le,
-        '>': operator.gt,
-        '>=': operator.ge,
-        '=': operator.eq,
-        '!=': operator.ne,
-    }
-    operator_rex = re.compile(r'''(?x)\s*
-        (?P<key>[a-z_]+)
-        \s*(?P<op>%s)(?P<none_inclusive>\s*\?)?\s*
-        (?:
-            (?P<intval>[0-9.]+(?:[kKmMgGtTpPeEzZyY]i?[Bb]?)?)|
-            (?P<quote>["\'])(?P<quotedstrval>(?:\\.|(?!(?P=quote)|\\).)+?)(?P=quote)|
-            (?P<strval>(?![0-9.])[a-z0-9A-Z]*)
-        )
-        \s*$
-        ''' % '|'.join(map(re.escape, COMPARISON_OPERATORS.keys())))
-    m = operator_rex.search(filter_part)
+_MATCH_COMPARISON_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '!=': operator.ne,
+}
+_MATCH_COMPARISON_RE = re.compile(r'''(?x)\s*
+    (?P<key>[a-z_]+)
+    \s*(?P<op>%s)(?P<none_inclusive>\s*\?)?\s*
+    (?:
+        (?P<intval>[0-9.]+(?:[kKmMgGtTpPeEzZyY]i?[Bb]?)?)|
+        (?P<quote>["\'])(?P<quotedstrval>(?:\\.|(?!(?P=quote)|\\).)+?)(?P=quote)|
+        (?P<strval>(?![0-9.])[a-z0-9A-Z]*)
+    )
+    \s*$
+    ''' % '|'.join(map(re.escape, _MATCH_COMPARISON_OPERATORS.keys())))
+_MATCH_UNARY_OPERATORS = {
+    '': lambda v: (v is True) if isinstance(v, bool) else (v is not None),
+    '!': lambda v: (v is False) if isinstance(v, bool) else (v is None),
+}
+_MATCH_UNARY_RE = re.compile(r'''(?x)\s*
+    (?P<op>%s)\s*(?P<key>[a-z_]+)
+    \s*$
+    ''' % '|'.join(map(re.escape, _MATCH_UNARY_OPERATORS.keys())))
+# "||" and "&" outside of quoted strings
+_MATCH_FILTER_TOKEN_RE = re.compile(r'''(?x)
+    (?P<quoted>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|
+    (?P<or>\|\|)|
+    (?P<and>&)|
+    [^"'&|]+|["'|]
+    ''')
+
+
+def _compile_match_one(filter_part):
+    """ Returns the key filter_part tests and a function testing a dict """
+    m = _MATCH_COMPARISON_RE.search(filter_part)
     if m:
-        op = COMPARISON_OPERATORS[m.group('op')]
-        actual_value = dct.get(m.group('key'))
-        if (m.group('quotedstrval') is not None
-            or m.group('strval') is not None
-            # If the original field is a string and matching comparisonvalue is
-            # a number we should respect the origin of the original field
-            # and process comparison value as a string (see
-            # https://github.com/ytdl-org/youtube-dl/issues/11082).
-            or actual_value is not None and m.group('intval') is not None
-                and isinstance(actual_value, compat_str)):
-            if m.group('op') not in ('=', '!='):
-                raise ValueError(
-                    'Operator %s does not support string values!' % m.group('op'))
-            comparison_value = m.group('quotedstrval') or m.group('strval') or m.group('intval')
-            quote = m.group('quote')
-            if quote is not None:
-                comparison_value = comparison_value.replace(r'\%s' % quote, quote)
-        else:
+        key = m.group('key')
+        op_name = m.group('op')
+        op = _MATCH_COMPARISON_OPERATORS[op_name]
+        none_inclusive = m.group('none_inclusive')
+        intval = m.group('intval')
+        is_str = m.group('quotedstrval') is not None or m.group('strval') is not None
+        str_value = m.group('quotedstrval') or m.group('strval') or intval
+        quote = m.group('quote')
+        if quote is not None:
+            str_value = str_value.replace(r'\%s' % quote, quote)
+        int_value = None
+        if intval is not None:
             try:
-                comparison_value = int(m.group('intval'))
+                int_value = int(intval)
             except ValueError:
-                comparison_value = parse_filesize(m.group('intval'))
-                if comparison_value is None:
-                    comparison_value = parse_filesize(m.group('intval') + 'B')
-                if comparison_value is None:
+                int_value = parse_filesize(intval)
+                if int_value is None:
+                    int_value = parse_filesize(intval + 'B')
+
+        # As before the filter was compiled, the errors are only raised
+        # when the part is evaluated
+        def match(dct):
+            actual_value = dct.get(key)
+            if (is_str
+                # If the original field is a string and matching comparisonvalue is
+                # a number we should respect the origin of the original field
+                # and process comparison value as a string (see
+                # https://github.com/ytdl-org/youtube-dl/issues/11082).
+                    or actual_value is not None and intval is not None
+                    and isinstance(actual_value, compat_str)):
+                if op_name not in ('=', '!='):
+                    raise ValueError(
+                        'Operator %s does not support string values!' % op_name)
+                comparison_value = str_value
+            else:
+                if int_value is None:
                     raise ValueError(
                         'Invalid integer value %r in filter part %r' % (
-                            m.group('intval'), filter_part))
-        if actual_value is None:
-            return m.group('none_inclusive')
-        return op(actual_value, comparison_value)
-
-    UNARY_OPERATORS = {
-        '': lambda v: (v is True) if isinstance(v, bool) else (v is not None),
-        '!': lambda v: (v is False) if isinstance(v, bool) else (v is None),
-    }
-    operator_rex = re.compile(r'''(?x)\s*
-        (?P<op>%s)\s*(?P<key>[a-z_]+)
-        \s*$
-        ''' % '|'.join(map(re.escape, UNARY_OPERATORS.keys())))
-    m = operator_rex.search(filter_part)
+                            intval, filter_part))
+                comparison_value = int_value
+            if actual_value is None:
+                return none_inclusive
+            return op(actual_value, comparison_value)
+        return key, match
+
+    m = _MATCH_UNARY_RE.search(filter_part)
     if m:
-        op = UNARY_OPERATORS[m.group('op')]
-        actual_value = dct.get(m.group('key'))
-        return op(actual_value)
+        key = m.group('key')
+        unary_op = _MATCH_UNARY_OPERATORS[m.group('op')]
+        return key, lambda dct: unary_op(dct.get(key))
+
+    def invalid(dct):
+        raise ValueError('Invalid filter part %r' % filter_part)
+    return None, invalid
+
 
-    raise ValueError('Invalid filter part %r' % filter_part)
+class MatchFilter(object):
+    """
+    A filter string (see match_str) parsed once, to be called with the
+    dictionaries to test.
+
+    keys is the set of the keys the filter tests.
+    """
+
+    def __init__(self, filter_str):
+        self.filter_str = filter_str
+        self.keys = set()
+        # Alternatives separated by "||", each a list of the parts
+        # separated by "&", which take precedence
+        self._alternatives = []
+        parts = []
+        part = ''
+        for m in _MATCH_FILTER_TOKEN_RE.finditer(filter_str):
+            if m.group('and') or m.group('or'):
+                parts.append(part)
+                part = ''
+                if m.group('or'):
+                    self._alternatives.append(parts)
+                    parts = []
+            else:
+                part += m.group(0)
+        parts.append(part)
+        self._alternatives.append(parts)
+        for i, parts in enumerate(self._alternatives):
+            self._alternatives[i] = [self._compile_part(part) for part in parts]
+
+    def _compile_part(self, filter_part):
+        key, match = _compile_match_one(filter_part)
+        if key is not None:
+            self.keys.add(key)
+        return match
+
+    def __call__(self, dct):
+        return any(
+            all(match(dct) for match in matches)
+            for matches in self._alternatives)
+
+    def decidable(self, dct):
+        """ Whether dct has all the keys tested by the filter """
+        return all(dct.get(key) is not None for key in self.keys)
 
 
 def match_str(filter_str, dct):
     """ Filter a dictionary with a simple string syntax. Returns True (=passes filter) or false """
 
-    return all(
-        _match_one(filter_part, dct) for filter_part in filter_str.split('&'))
+    return MatchFilter(filter_str)(dct)
 
 
 def match_filter_func(filter_str):
-    def _match_func(info_dict):
-        if match_str(filter_str, info_dict):
+    match_filter = MatchFilter(filter_str)
+
+    def _match_func(info_dict, incomplete=False):
+        # Incomplete info dicts (playlist entries not extracted yet) are
+        # only rejected when they have all the fields the filter tests
+        if incomplete and not match_filter.decidable(info_dict):
+            return None
+        if match_filter(info_dict):
             return None
         else:
             video_title = info_dict.get('title', info_dict.get('id', 'video'))